@@ -2,7 +2,10 @@
 # coding: utf-8
 
 import os
-from flask import Flask, request, redirect, jsonify, url_for, session, abort
+import json
+import time
+from contextlib import nullcontext
+from flask import Flask, request, redirect, jsonify, url_for, session, abort, Response, stream_with_context
 from flask_cors import CORS
 from apiflask import APIFlask
 
@@ -14,10 +17,29 @@ from api_internals.config_apiflask import (
     PhotoDefectsFullOut,
     LaserDefectsIn,
     LaserDefectsFullOut,
+    LaserVideoIn,
+    LaserVideoFullOut,
+    LaserJobOut,
 )
-from api_internals.predict_defects_photo import predict_defects_photo, photo_model_selector
-from api_internals.predict_defects_laser import predict_defects_laser, laser_model_selector
-from api_internals.utils import check_uploaded_files
+from api_internals.predict_defects_photo import predict_defects_photo, photo_model_selector, BINARY_MODEL_ID
+from api_internals.predict_defects_laser import predict_defects_laser, iter_predict_defects_laser, laser_model_selector, LASER_BINARY_MODEL_ID
+from api_internals.utils import check_uploaded_files, check_uploaded_video, perenize_buffers
+from api_internals.model_registry import model_registry
+from api_internals.batching import get_batching_stats
+from api_internals.jobs import JobManager, TooManyJobsError
+from api_internals.result_cache import result_cache
+from api_internals.ingestion import IngestionRequest
+from api_internals.warmup import ModelWarmup, resolve_warmup_models, WARMUP_MODELS
+from api_internals.metrics import metrics_registry, serving_collector, track_request, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from api_internals.timing import timings_breakdown
+from api_internals.profiler import SamplingProfiler, profile_store, PROFILE_EXTENSION
+from api_internals.logs import setup_logging, get_logger, log_payload
+from api_internals.video import VideoFrameStore, video_path, VIDEO_TARGET_FPS
+
+
+# --- Logging (written by a background thread, see api_internals.logs) ---
+setup_logging()
+logger = get_logger("API_client_server")
 
 
 # --- API Flask app ---
@@ -25,9 +47,50 @@ from api_internals.utils import check_uploaded_files
 app = APIFlask(__name__, title="Omdena Reachbots - Inference API")
 app.secret_key = "super secret key"
 app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024 * 200
+# the files of the large uploads are spooled to disk and memory-mapped (see api_internals.ingestion)
+app.request_class = IngestionRequest
 
 CORS(app)
 
+# Load and warm the models up in the background (WARMUP_MODELS), /ready answers 503 until they are warm.
+# The warm-up is started once the worker runs (see `start_model_warmup`), not when this module is imported.
+model_warmup = ModelWarmup(
+    resolve_warmup_models(WARMUP_MODELS, [photo_model_selector, laser_model_selector], model_registry)
+)
+
+# Prometheus metrics of this worker (/metrics), the state of the models and caches is read at each scrape
+metrics_registry.register_collector(
+    serving_collector([photo_model_selector, laser_model_selector], model_registry, model_warmup)
+)
+
+
+def start_model_warmup():
+    """
+    Start the warm-up of the models of this worker (called by the gunicorn `post_worker_init` hook, see
+    gunicorn.conf.py, by `__main__`, and before the first request otherwise; the next calls do nothing).
+
+    With PRELOAD_MODELS=1, the shared models (binary classifiers) are loaded before it returns, so that the
+    worker doesn't answer any request before they are loaded; the other models are warmed up in the background.
+    """
+
+    if os.environ.get("PRELOAD_MODELS", "0") == "1":
+        model_registry.preload()
+
+    model_warmup.start()
+
+
+@app.before_request
+def ensure_model_warmup():
+    if model_warmup.thread is None:
+        start_model_warmup()
+
+
+laser_job_manager = JobManager(
+    max_workers=int(os.environ.get("LASER_JOBS_WORKERS", 2)),
+    ttl=float(os.environ.get("LASER_JOBS_TTL", 3600)),
+    max_pending=int(os.environ.get("LASER_JOBS_MAX_PENDING", 16)),
+)
+
 
 # ########## API ENTRY POINTS (BACKEND) ##########
 
@@ -72,8 +135,224 @@ def route_get_laser_models():
 
     return jsonify(json_dict)
 
+# ----- GET SERVING STATISTICS -----
+
+@app.route("/stats", methods=["GET"])
+def route_get_stats():
+    """
+    Define the API endpoint to get the serving statistics of this worker
+    (such as the micro-batching batch size histograms and the result cache hit/miss counters).
+    This entrypoint awaits a GET request and returns a JSON object.
+
+    Returns
+    -------
+    jsonify(json_dict) : JSON object
+        A JSON object containing the serving statistics.
+    """
+
+    json_dict = {
+        "batching": get_batching_stats(),
+        "result_cache": result_cache.get_stats(),
+    }
+
+    return jsonify(json_dict)
+
+# ----- GET METRICS -----
+
+@app.route("/metrics", methods=["GET"])
+def route_get_metrics():
+    """
+    Define the API endpoint to scrape the metrics of this worker in the Prometheus text format:
+    the request counts, the requests in flight, the request and stage (decode, preprocess, inference, formatting)
+    latency histograms labelled by pipeline and model, the models load times and the cache and batching counters.
+    This entrypoint awaits a GET request and returns a text answer.
+
+    Returns
+    -------
+    Response
+        The metrics (text/plain; version=0.0.4).
+    """
+
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+# ----- GET PROFILES -----
+
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def route_get_profile(profile_id):
+    """
+    Define the API endpoint to download the sampling profile of a request sent with `?profile=1`
+    (the `profile_url` of its answer), in the folded stacks format (flamegraph.pl, speedscope).
+    This entrypoint awaits a GET request and returns a text file.
+
+    Parameters
+    ----------
+    profile_id : str
+        The id of the profile.
+
+    Returns
+    -------
+    Response
+        The profile (text/plain attachment), or a 404 error if the profile is unknown or was deleted.
+    """
+
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        abort(404, description=f"Unknown profile {profile_id} (only the last profiles are kept).")
+
+    return Response(profile, content_type="text/plain; charset=utf-8", headers={
+        "Content-Disposition": f"attachment; filename=profile_{profile_id}{PROFILE_EXTENSION}",
+    })
+
+# ----- GET READINESS -----
+
+@app.route("/ready", methods=["GET"])
+def route_get_ready():
+    """
+    Define the API endpoint to check if this worker is ready to serve requests (for the load balancer readiness probe),
+    i.e. if all the models listed in WARMUP_MODELS are loaded and warmed up.
+    This entrypoint awaits a GET request and returns a JSON object (with a 503 status code while not ready).
+
+    Returns
+    -------
+    jsonify(json_dict) : JSON object
+        A JSON object containing the readiness and the state and timings (in seconds) of each warmed up model.
+    """
+
+    json_dict = model_warmup.get_status()
+
+    return jsonify(json_dict), 200 if json_dict["ready"] else 503
+
 # ----- PREDICT DEFECTS -----
 
+def get_laser_extra_info(request):
+    """
+    Gather the optional parameters of the laser prediction from the request form.
+
+    Parameters
+    ----------
+    request : request
+        The Flask request object containing the optional parameters.
+
+    Returns
+    -------
+    dict
+        A dictionary containing extra information useful for the laser prediction.
+    """
+
+    p_selected_model = request.form.get("selected_model")
+    p_slide_step = request.form.get("slide_step")
+    p_min_defects = request.form.get("min_defects")
+    p_binary_threshold = request.form.get("binary_threshold")
+    p_multi_threshold = request.form.get("multi_threshold")
+
+    extra_info = {
+        "selected_model": p_selected_model,
+        "slide_step": p_slide_step,
+        "min_defects": p_min_defects,
+        "binary_threshold": p_binary_threshold,
+        "multi_threshold": p_multi_threshold,
+    }
+
+    logger.debug("params", **extra_info)
+    return extra_info
+
+
+def get_debug_options(request):
+    """
+    Read the debug options of a prediction request from its query string:
+    `?timings=1` adds the time spent in each stage per model (and per image for the binary classifier),
+    `?profile=1` captures a sampling profile of the request, downloadable from the `profile_url` of the answer.
+
+    Returns
+    -------
+    tuple of bool
+        The timings and profile options.
+    """
+
+    return request.args.get("timings") == "1", request.args.get("profile") == "1"
+
+
+def add_debug_info(json_dict, timings, profiler, binary_model_id, filtered_files):
+    """
+    Add the timings breakdown (if `timings` is given) and the profile URL (if `profiler` is given) to an answer.
+
+    Parameters
+    ----------
+    json_dict : dict
+        The answer.
+    timings : RequestTimings or None
+        The timings of the request.
+    profiler : SamplingProfiler or None
+        The (stopped) profiler of the request.
+    binary_model_id : str
+        The id of the binary classifier (timed per image).
+    filtered_files : list
+        The uploaded files (or their perenized buffers).
+    """
+
+    if timings is not None:
+        filenames = [x['filename'] if isinstance(x, dict) else x.filename for x in filtered_files]
+        json_dict["timings"] = timings_breakdown(timings, binary_model_id, filenames)
+
+    if profiler is not None:
+        profile_id = profile_store.put(profiler.folded())
+        json_dict["profile_url"] = url_for("route_get_profile", profile_id=profile_id)
+        json_dict["profile_samples"] = profiler.num_samples()
+
+
+def predict_laser_json(filtered_files, extra_info, progress_callback=None, endpoint="predict_laser_defects", with_timings=False, with_profile=False, frame_store=None):
+    """
+    Run the laser pipeline and build the JSON answer (or the error message).
+
+    Parameters
+    ----------
+    filtered_files : list
+        The uploaded files (or their perenized buffers).
+    extra_info : dict
+        A dictionary containing extra information useful for the prediction.
+    progress_callback : callable, optional
+        A function called as `progress_callback(stage, frames_processed)` while the frames are processed.
+    endpoint : str
+        The name of the endpoint (metrics label).
+    with_timings : bool
+        Add the timings breakdown of the request to the answer (see `get_debug_options`).
+    with_profile : bool
+        Profile the request and add the URL of the profile to the answer (only from a request context).
+    frame_store : LaserFrameStore, optional
+        The store of the already transformed frames of `filtered_files` (the frames of a video).
+
+    Returns
+    -------
+    dict
+        The answer of the laser endpoints.
+    """
+
+    try:
+        profiler = SamplingProfiler() if with_profile else None
+        with track_request(endpoint, "laser", len(filtered_files)) as timings, profiler or nullcontext():
+            json_defects, inference_time, used_models = predict_defects_laser(filtered_files, extra_info, progress_callback, frame_store)
+        json_dict = {
+            "defect_models": used_models,
+            "inference_time": f"{round(inference_time,2)}s",
+            "mean_inference_time": f"{round(inference_time/len(filtered_files),2)}s",
+            "results": json_defects,
+        }
+        add_debug_info(json_dict, timings if with_timings else None, profiler, LASER_BINARY_MODEL_ID, filtered_files)
+        logger.info(endpoint, frames=len(filtered_files), windows=len(json_defects), models=",".join(used_models), inference_time=round(inference_time, 3))
+    except Exception as e:
+        # raise e
+        logger.error(f"{endpoint}_failed", frames=len(filtered_files), error=e, exc_info=True)
+        if str(e) == "image must be numpy array type":
+            e = "The provided image(s) are not laser images"
+
+        json_dict = {
+            "error_msg": str(e)
+        }
+
+    log_payload(logger, f"{endpoint}_output", json_dict)
+    return json_dict
+
+
 @app.route("/predict_photo_defects", methods=["POST"])
 @app.input(PhotoDefectsIn, location="files")
 @app.output(PhotoDefectsFullOut)
@@ -108,28 +387,37 @@ def route_predict_photo_defects(files_data):
         "multi_threshold": p_multi_threshold,
     }
 
-    print("params:", extra_info)
+    logger.debug("params", **extra_info)
+
+    with_timings, with_profile = get_debug_options(request)
 
     # --- PREDICT
     try:
-        json_defects, inference_time, used_models = predict_defects_photo(filtered_files, extra_info)
+        profiler = SamplingProfiler() if with_profile else None
+        with track_request("predict_photo_defects", "photo", len(filtered_files)) as timings, profiler or nullcontext():
+            json_defects, inference_time, used_models = predict_defects_photo(filtered_files, extra_info)
         json_dict = {
             "defect_models": used_models,
             "inference_time": f"{round(inference_time,2)}s",
             "mean_inference_time": f"{round(inference_time/len(filtered_files),2)}s",
             "results": json_defects,
         }
+        add_debug_info(json_dict, timings if with_timings else None, profiler, BINARY_MODEL_ID, filtered_files)
+        logger.info(
+            "predict_photo_defects", images=len(filtered_files), defects=sum(x['has_defect'] for x in json_defects),
+            models=",".join(used_models), inference_time=round(inference_time, 3),
+        )
     except Exception as e:
+        logger.error("predict_photo_defects_failed", images=len(filtered_files), error=e, exc_info=True)
         json_dict = {
             "error_msg": str(e)
         }
 
-    print("OUTPUT:\n", json_dict)
+    log_payload(logger, "predict_photo_defects_output", json_dict)
 
     # --- RETURN ANSWER
     args = request.args
     if args.get("isfrontend") is None:
-        print(jsonify(json_dict))
         return jsonify(json_dict)
 
     else:
@@ -160,47 +448,85 @@ def route_predict_defects(files_data):
     filtered_files = check_uploaded_files(request)
 
     # --- GATHER EXTRA INFORMATION
-    p_selected_model = request.form.get("selected_model")
-    p_slide_step = request.form.get("slide_step")
-    p_min_defects = request.form.get("min_defects")
-    p_binary_threshold = request.form.get("binary_threshold")
-    p_multi_threshold = request.form.get("multi_threshold")
+    extra_info = get_laser_extra_info(request)
 
-    extra_info = {
-        "selected_model": p_selected_model,
-        "slide_step": p_slide_step,
-        "min_defects": p_min_defects,
-        "binary_threshold": p_binary_threshold,
-        "multi_threshold": p_multi_threshold,
-    }
-
-    print("params:", extra_info)
+    with_timings, with_profile = get_debug_options(request)
 
     # --- PREDICT
+    json_dict = predict_laser_json(filtered_files, extra_info, with_timings=with_timings, with_profile=with_profile)
+
+    # --- RETURN ANSWER
+    args = request.args
+    if args.get("isfrontend") is None:
+        return jsonify(json_dict)
+
+    else:
+        session["json2html"] = json2html.convert(json_dict)
+        return redirect(url_for("upload_defects"))
+
+
+@app.route("/predict_laser_video", methods=["POST"])
+@app.input(LaserVideoIn, location="files")
+@app.output(LaserVideoFullOut)
+def route_predict_video(files_data):
+    """
+    Define the API endpoint to get defect predictions from a laser video.
+    This entrypoint awaits a POST request along with a 'file' parameter containing a single video:
+    the video is decoded server side and sampled at 'target_fps' frames per second (VIDEO_TARGET_FPS by default),
+    the sampled frames being given to the laser pipeline without being encoded as images.
+
+    Parameters
+    ----------
+    request : request
+        The Flask request object containing the video and optional parameters.
+
+    Returns
+    -------
+    jsonify(json_dict) : JSON object
+        A JSON object containing the predicted defects (the files being the sampled frames, named after their
+        index in the video) along with several other information.
+    """
+
+    # --- CHECK THE VIDEO
+    video = check_uploaded_video(request)
+
+    # --- GATHER EXTRA INFORMATION
+    extra_info = get_laser_extra_info(request)
+
     try:
-        json_defects, inference_time, used_models = predict_defects_laser(filtered_files, extra_info)
-        json_dict = {
-            "defect_models": used_models,
-            "inference_time": f"{round(inference_time,2)}s",
-            "mean_inference_time": f"{round(inference_time/len(json_defects),2)}s",
-            "results": json_defects,
-        }
-    except Exception as e:
-        # raise e
-        if str(e) == "image must be numpy array type":
-            e = "The provided image(s) are not laser images"
+        target_fps = float(request.form.get("target_fps") or VIDEO_TARGET_FPS)
+    except ValueError:
+        abort(400, description="The 'target_fps' parameter must be a number.")
+    if target_fps <= 0:
+        abort(400, description="The 'target_fps' parameter must be positive.")
+
+    with_timings, with_profile = get_debug_options(request)
 
+    # --- DECODE AND TRANSFORM THE SAMPLED FRAMES
+    # (before the request is measured: the number of frames is only known once the video is decoded)
+    try:
+        start_time = time.perf_counter()
+        with video_path(video) as path:
+            frame_store = VideoFrameStore(path, target_fps)
+        decode_time = time.perf_counter() - start_time
+    except ValueError as e:
+        logger.warning("predict_laser_video_failed", file=video.filename, error=e)
+        frame_store = None
         json_dict = {
             "error_msg": str(e)
         }
 
-
-    print("OUTPUT:\n", json_dict)
+    # --- PREDICT
+    if frame_store is not None:
+        json_dict = predict_laser_json(
+            frame_store.files, extra_info, endpoint="predict_laser_video",
+            with_timings=with_timings, with_profile=with_profile, frame_store=frame_store,
+        )
+        json_dict["video"] = dict(frame_store.info(), decode_time=round(decode_time, 3))
 
     # --- RETURN ANSWER
     args = request.args
     if args.get("isfrontend") is None:
-        print(jsonify(json_dict))
         return jsonify(json_dict)
 
     else:
@@ -208,6 +534,157 @@ def route_predict_defects(files_data):
         return redirect(url_for("upload_defects"))
 
 
+@app.route("/predict_laser_defects_stream", methods=["POST"])
+@app.input(LaserDefectsIn, location="files")
+def route_predict_defects_stream(files_data):
+    """
+    Define the API endpoint to get defect predictions from a laser sequence, streamed window by window.
+    This entrypoint awaits a POST request along with a 'file' parameter containing the image(s)
+    and the same optional parameters as /predict_laser_defects.
+
+    Each sliding window result (same format as the items of the /predict_laser_defects results) is sent
+    as soon as it is computed, followed by a summary containing the used models and the inference time.
+    The results are streamed as NDJSON (one JSON object per line) or as Server-Sent Events with `?format=sse`.
+
+    Returns
+    -------
+    Response
+        A streamed response (application/x-ndjson or text/event-stream).
+    """
+
+    # --- CHECK FILES
+    filtered_files = check_uploaded_files(request)
+
+    # --- GATHER EXTRA INFORMATION
+    extra_info = get_laser_extra_info(request)
+    use_sse = request.args.get("format") == "sse"
+
+    # --- READ THE UPLOADED FILES BEFORE STREAMING
+    images_bytes = perenize_buffers(filtered_files)
+
+    def format_event(kind, json_dict):
+        if use_sse:
+            return f"event: {kind}\ndata: {json.dumps(json_dict)}\n\n"
+        return json.dumps(json_dict) + "\n"
+
+    def generate():
+        try:
+            with track_request("predict_laser_defects_stream", "laser", len(images_bytes)):
+                for node in iter_predict_defects_laser(images_bytes, extra_info):
+                    if "defect_models" in node:
+                        node["inference_time"] = f"{round(node['inference_time'],2)}s"
+                        yield format_event("done", node)
+                    else:
+                        yield format_event("result", node)
+
+        except Exception as e:
+            logger.error("predict_laser_defects_stream_failed", frames=len(images_bytes), error=e, exc_info=True)
+            if str(e) == "image must be numpy array type":
+                e = "The provided image(s) are not laser images"
+
+            yield format_event("error", {"error_msg": str(e)})
+
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+# ----- ASYNCHRONOUS LASER JOBS -----
+
+def run_laser_job(job, images_bytes, extra_info):
+    """Run the laser pipeline for a job (in a worker of the job manager)"""
+
+    json_dict = predict_laser_json(images_bytes, extra_info, job.set_progress, endpoint="laser_jobs")
+    if "error_msg" in json_dict:
+        raise Exception(json_dict["error_msg"])
+
+    return json_dict
+
+
+@app.route("/laser_jobs", methods=["POST"])
+@app.input(LaserDefectsIn, location="files")
+@app.output(LaserJobOut, status_code=202)
+def route_submit_laser_job(files_data):
+    """
+    Define the API endpoint to submit a laser prediction job (for long sequences).
+    This entrypoint awaits a POST request along with a 'file' parameter
+    containing the image(s) and the same optional parameters as /predict_laser_defects.
+    It returns immediately a JSON object containing the job id, and the job status
+    and results can then be polled with the /laser_jobs/<job_id> and /laser_jobs/<job_id>/result endpoints.
+    It answers with a 429 status code when LASER_JOBS_MAX_PENDING jobs are already pending.
+
+    Returns
+    -------
+    jsonify(json_dict) : JSON object
+        A JSON object containing the job id and status.
+    """
+
+    # --- CHECK FILES
+    filtered_files = check_uploaded_files(request)
+
+    # --- GATHER EXTRA INFORMATION
+    extra_info = get_laser_extra_info(request)
+
+    # --- READ THE UPLOADED FILES BEFORE THE END OF THE REQUEST AND SUBMIT
+    images_bytes = perenize_buffers(filtered_files)
+    try:
+        job = laser_job_manager.submit(run_laser_job, len(images_bytes), images_bytes, extra_info)
+    except TooManyJobsError as e:
+        abort(429, description=str(e))
+
+    json_dict = job.to_dict()
+    json_dict["status_url"] = url_for("route_get_laser_job", job_id=job.job_id)
+    json_dict["result_url"] = url_for("route_get_laser_job_result", job_id=job.job_id)
+
+    return jsonify(json_dict), 202
+
+
+@app.route("/laser_jobs/<job_id>", methods=["GET"])
+@app.output(LaserJobOut)
+def route_get_laser_job(job_id):
+    """
+    Define the API endpoint to get the status of a laser prediction job
+    (status, current stage and number of frames processed).
+
+    Returns
+    -------
+    jsonify(json_dict) : JSON object
+        A JSON object containing the job status.
+    """
+
+    job = laser_job_manager.get(job_id)
+    if job is None:
+        abort(404, description=f"The '{job_id}' job doesn't exist (or expired).")
+
+    return jsonify(job.to_dict())
+
+
+@app.route("/laser_jobs/<job_id>/result", methods=["GET"])
+@app.output(LaserDefectsFullOut)
+def route_get_laser_job_result(job_id):
+    """
+    Define the API endpoint to fetch the result of a laser prediction job.
+    The answer is the same as the /predict_laser_defects one once the job is done,
+    or the job status (with a 202 status code) while it is still running.
+
+    Returns
+    -------
+    jsonify(json_dict) : JSON object
+        A JSON object containing the predicted defects along with several other information.
+    """
+
+    job = laser_job_manager.get(job_id)
+    if job is None:
+        abort(404, description=f"The '{job_id}' job doesn't exist (or expired).")
+
+    if not job.is_finished():
+        return jsonify(job.to_dict()), 202
+
+    if job.status == "failed":
+        return jsonify({"error_msg": job.error})
+
+    return jsonify(job.result)
+
+
 # ########## DEMO FRONTEND ##########
 # This could be a different Flask script totally independant from the API!
 
@@ -230,5 +707,6 @@ def index():
 # ########## START BOTH API & FRONTEND ##########
 
 if __name__ == "__main__":
+    start_model_warmup()
     current_port = int(os.environ.get("PORT") or 5000)
     app.run(debug=True, host="0.0.0.0", port=current_port, threaded=True)
@@ -11,6 +11,10 @@ import numpy as np
 import math
 from pathlib import Path
 
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
 
 def rotate_point(x, y, angle_rad):
     """
@@ -83,16 +87,130 @@ def extract_coordinates(binary_image):
     return coords[:, [1, 0]]  # Swap x and y
 
 
+def near_polygon_mask(points, vertices, threshold):
+    """
+    Vectorized version of `is_near_polygon` for an array of points.
+
+    Parameters:
+        points (array-like): the (N, 2) array of (x, y) points to check
+        vertices (list of tuples): the vertices of the triangle as (x, y) coordinates
+        threshold (float): the maximum distance (in pixels) of the points outside of the triangle
+
+    Returns:
+        array: a (N,) boolean mask of the points inside or close to the triangle
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    vertices = np.asarray(vertices, dtype=np.float64)
+
+    min_sq_distance = np.full(len(points), np.inf)
+    crosses = []
+    for k in range(len(vertices)):
+        a = vertices[k]
+        ab = vertices[(k + 1) % len(vertices)] - a
+        ap = points - a
+
+        # Squared distance to the edge [a, b]
+        sq_length = ab.dot(ab)
+        t = np.clip(ap.dot(ab) / sq_length, 0.0, 1.0) if sq_length > 0 else np.zeros(len(points))
+        closest = a + t[:, None] * ab
+        min_sq_distance = np.minimum(min_sq_distance, ((points - closest)**2).sum(axis=1))
+
+        # Side of the edge the points are on
+        crosses.append(ab[0] * ap[:, 1] - ab[1] * ap[:, 0])
+
+    crosses = np.stack(crosses)
+    inside = np.all(crosses > 0, axis=0) | np.all(crosses < 0, axis=0)
+
+    return inside | (np.sqrt(min_sq_distance) <= threshold)
+
+
+def project_profile(coords, intersection, lower_left, triangle_vertices, polygon_threshold):
+    """
+    Draw the profile points close to the bead triangle in a 300x300 image,
+    with the intersection point as origin and the line to the lower left point as x-axis.
+
+    Parameters:
+        coords (array-like): the (N, 2) array of (x, y) profile points
+        intersection (tuple): the (x, y) intersection point of the two plates lines
+        lower_left (tuple): the (x, y) farthest point towards the lower left corner
+        triangle_vertices (list of tuples): the vertices of the bead triangle
+        polygon_threshold (float): the maximum distance (in pixels) of the kept points outside of the triangle
+
+    Returns:
+        array: the transformed 300x300 image
+    """
+
+    # Filter out the coordinates based on the distance to the triangle
+    coords = np.asarray(coords).reshape(-1, 2)
+    coords_filtered = coords[near_polygon_mask(coords, triangle_vertices, polygon_threshold)]
+
+    # Define a new image for plotting the transformed points.
+    transformed_image = np.ones((300, 300), np.uint8) * 255
+
+    # Translate the coordinates so the intersection point is the origin.
+    xi, yi = intersection
+    llx, lly = lower_left
+    translated_coords = coords_filtered - np.array([xi, yi])
+
+    # Calculate the angle to rotate all points so the line from the intersection to the lower left corner is parallel to the x-axis.
+    angle_rad = np.arctan2(lly - yi, llx - xi)
+
+    # Rotate the coordinates (truncated towards zero, as rotate_point does).
+    x, y = translated_coords[:, 0], translated_coords[:, 1]
+    transformed_x = np.trunc(x * np.cos(-angle_rad) - y * np.sin(-angle_rad)).astype(np.int64)
+    transformed_y = np.trunc(x * np.sin(-angle_rad) + y * np.cos(-angle_rad)).astype(np.int64)
+
+    # Translate points back to fit into 300x300 image by adding an offset to the points for visiblity on inside the transformed image
+    offset_x = 50  # The new origin in the transformed image
+    offset_y = 250  # The new origin in the transformed image
+    translated_x, translated_y = transformed_x + offset_x, transformed_y + offset_y
+
+    visible = (0 <= translated_x) & (translated_x < transformed_image.shape[1]) \
+            & (0 <= translated_y) & (translated_y < transformed_image.shape[0])
+    transformed_image[translated_y[visible], translated_x[visible]] = 0
+
+    return transformed_image
+
+
 def transform_frame(frame,
                     bead_radius_threshold: float = 200.0,
                     lines_angular_threshold: float = 0.2,
                     polygon_threshold: float = 5.0):
+    """
+    Extract the laser profile of a frame and draw it in a normalized 300x300 image.
+
+    Parameters:
+        frame (array-like): the grayscale (or BGR) frame
+        bead_radius_threshold (float): radial distance of points from the intersection point
+        lines_angular_threshold (float): angular difference between two lines to supress parallel lines
+        polygon_threshold (float): distance threshold to filter out points that are not close to the triangle
+
+    Returns:
+        array: the transformed 300x300 image (or None if the profile couldn't be extracted)
+    """
+    profile = locate_profile(frame, bead_radius_threshold, lines_angular_threshold)
+    if profile is None:
+        return None
+
+    return project_profile(*profile, polygon_threshold)
+
+
+def locate_profile(frame,
+                   bead_radius_threshold: float = 200.0,
+                   lines_angular_threshold: float = 0.2):
+    """
+    Locate the laser profile points, the intersection of the two plates lines and the bead triangle in a frame.
+
+    Returns:
+        tuple: (coords, intersection, lower_left, triangle_vertices) as expected by `project_profile`
+        (or None if the profile couldn't be located)
+    """
 
     try:
         if frame is None:
             raise ValueError("Could not open or find the image.")
     except ValueError as e:
-        print(e)
+        logger.warning("laser_frame_invalid", error=e)
     if len(frame.shape) > 2 and frame.shape[2] == 3:
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     _, thresholded_image = cv2.threshold(frame, 0, 255,
@@ -121,7 +239,7 @@ def transform_frame(frame,
         ]  # To store the parameters (slope and intercept) of each line
 
         if len(lines.shape) == 1:
-            print('Only one hough line detected, Frame Passed')
+            logger.debug("laser_profile_not_found", reason="only one hough line detected")
             return None
 
         for x1, y1, x2, y2 in lines:
@@ -171,9 +289,7 @@ def transform_frame(frame,
             # cv2.circle(final_outliers_img, (int(xi), int(yi)), 5, 0, -1) #for visualization only
         else:
             # Handle the case where there is only one line
-            print(
-                'Only one line detected,cannot find Intersection, Frame Passed'
-            )
+            logger.debug("laser_profile_not_found", reason="only one line detected, no intersection")
             return None
 
         # Farthest point towards the lower left corner
@@ -195,73 +311,10 @@ def transform_frame(frame,
         #               color=0,
         #               thickness=1)
 
-        #Using polygon_threshold (in pixels) to filter out points that are not close to the triangle
-
-        # Filter out the coordinates based on the distance to the triangle
-        coords_filtered = [
-            pt for pt in coords
-            if is_near_polygon(pt, triangle_vertices, polygon_threshold)
-        ]
-
-        # Reset the final_outliers_img_filtered to a blank image
-        # final_outliers_img_filtered = np.ones_like(frame) * 255
-
-        # # Redraw the remaining coordinates back to a binary image for visualization only
-        # for x, y in coords_filtered:
-        #     cv2.circle(final_outliers_img_filtered, (x, y), 3, 0, -1)
-        # cv2.circle(final_outliers_img_filtered, farthest_lower_left, 8, 0, -1)
-        # cv2.circle(final_outliers_img_filtered, farthest_lower_right, 18, 0,
-        #            -1)
-
-        # Define a new image for plotting the transformed points.qq
-        transformed_image = np.ones((300, 300), np.uint8) * 255
-
-        # Coordinates of the intersection point
-        xi, yi = int(xi), int(yi)
-
-        # Coordinates of the lower left corner
-        llx, lly = farthest_lower_left
-
-        # Translate the coordinates so the intersection point is the origin.
-        translated_coords = [(x - xi, y - yi) for x, y in coords_filtered]
-        translated_lower_left = (llx - xi, lly - yi)
-        translated_lower_right = (farthest_lower_right[0] - xi,
-                                  farthest_lower_right[1] - yi)
-
-        # Calculate the angle to rotate all points so the line from the intersection to the lower left corner is parallel to the x-axis.
-        angle_rad = np.arctan2(lly - yi, llx - xi)
-
-        # Rotate and translate the coordinates.
-        transformed_coords = [
-            rotate_point(x, y, -angle_rad) for x, y in translated_coords
-        ]
-
-        transformed_lower_left = rotate_point(translated_lower_left[0],
-                                              translated_lower_left[1],
-                                              -angle_rad)
-
-        transformed_lower_right = rotate_point(translated_lower_right[0],
-                                               translated_lower_right[1],
-                                               -angle_rad)
-
-        # Translate points back to fit into 300x300 image by adding an offset to the points for visiblity on inside the transformed image
-        offset_x = 50  # The new origin in the transformed image
-        offset_y = 250  # The new origin in the transformed image
-
-        for x, y in transformed_coords:
-            # Translate the origin back to offset_x, offset_y
-            translated_x, translated_y = x + offset_x, y + offset_y
-            llp = transformed_lower_left[0] + offset_x, transformed_lower_left[
-                1] + offset_y
-            lrp = transformed_lower_right[
-                0] + offset_x, transformed_lower_right[1] + offset_y
-            if 0 <= translated_x < 500 and 0 <= translated_y < 500:
-                transformed_image[translated_y, translated_x] = 0
-
-        return transformed_image
+        return coords, (int(xi), int(yi)), farthest_lower_left, triangle_vertices
 
     else:
-        print('No hough lines detected, Frame Passed')
+        logger.debug("laser_profile_not_found", reason="no hough lines detected")
         return None
 
 
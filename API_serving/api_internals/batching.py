@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from collections import Counter
+
+
+# --- MICRO-BATCHING CONFIGURATION (opt-in)
+
+MICRO_BATCHING = os.environ.get("MICRO_BATCHING", "0") == "1"
+MICRO_BATCHING_MAX_SIZE = int(os.environ.get("MICRO_BATCHING_MAX_SIZE", 16))
+MICRO_BATCHING_MAX_WAIT_MS = float(os.environ.get("MICRO_BATCHING_MAX_WAIT_MS", 10))
+
+
+class _PendingRun:
+
+    def __init__(self, items):
+        self.items = items
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Gather the inputs of concurrent callers into a single model run.
+
+    Each call hands a list of (already preprocessed) inputs to the batcher and blocks until its own results are available.
+    A background thread collects the pending calls until `max_batch_size` inputs are gathered or `max_wait_ms`
+    elapsed since the first pending call, runs them through `run_batch` at once and scatters the results back.
+
+    The thread runs until `stop` is called (when the model is evicted): the pending calls are run first,
+    and the next calls (from the requests still holding the model) are run directly.
+
+    Parameters
+    ----------
+    run_batch : callable
+        A function taking a list of inputs and returning a sliceable sequence with one result per input.
+    max_batch_size : int
+        The maximum number of inputs gathered in a single run (a single call bigger than this is run alone).
+    max_wait_ms : float
+        The maximum time (in milliseconds) to wait for other callers once a call is pending.
+    name : str, optional
+        The name used to report the batcher statistics (usually the model name).
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=10.0, name=None):
+
+        self.run_batch = run_batch
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.pending = []
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.batch_sizes = Counter()
+        self.calls_per_batch = Counter()
+
+        self.worker = threading.Thread(target=self.__run_forever, daemon=True)
+        self.worker.start()
+
+    def __call__(self, items):
+
+        if len(items) == 0:
+            return self.run_batch(items)
+
+        pending_run = _PendingRun(list(items))
+
+        with self.condition:
+            queued = not self.stopped
+            if queued:
+                self.pending.append(pending_run)
+                self.condition.notify()
+
+        if not queued:
+            return self.run_batch(items)
+
+        pending_run.done.wait()
+
+        if pending_run.error is not None:
+            raise pending_run.error
+
+        return pending_run.results
+
+    def __collect(self):
+
+        with self.condition:
+            while len(self.pending) == 0:
+                if self.stopped:
+                    return None
+                self.condition.wait()
+
+            deadline = time.monotonic() + self.max_wait
+            while not self.stopped and sum(len(x.items) for x in self.pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            # -- Take as many pending calls as possible without exceeding the maximum batch size
+            batch = [self.pending.pop(0)]
+            size = len(batch[0].items)
+            while len(self.pending) > 0 and size + len(self.pending[0].items) <= self.max_batch_size:
+                size += len(self.pending[0].items)
+                batch.append(self.pending.pop(0))
+
+            return batch
+
+    def __run_forever(self):
+
+        while True:
+            batch = self.__collect()
+            if batch is None:
+                return
+
+            items = [item for pending_run in batch for item in pending_run.items]
+
+            self.batch_sizes[len(items)] += 1
+            self.calls_per_batch[len(batch)] += 1
+
+            try:
+                results = self.run_batch(items)
+
+                # -- Scatter the results back to each caller
+                offset = 0
+                for pending_run in batch:
+                    pending_run.results = results[offset:offset + len(pending_run.items)]
+                    offset += len(pending_run.items)
+
+            except Exception as e:
+                for pending_run in batch:
+                    pending_run.error = e
+
+            for pending_run in batch:
+                pending_run.done.set()
+
+    def stop(self):
+        """Stop the background thread once the pending calls are run (the next calls are run directly)"""
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def get_stats(self):
+        """Return the batch sizes histograms (number of inputs and number of callers per model run)"""
+
+        num_batches = sum(self.batch_sizes.values())
+        num_items = sum(size * count for size, count in self.batch_sizes.items())
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "num_batches": num_batches,
+            "mean_batch_size": num_items / num_batches if num_batches > 0 else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "calls_per_batch_histogram": dict(sorted(self.calls_per_batch.items())),
+        }
+
+
+batchers = {}
+
+
+def make_batched(name, run_batch):
+    """
+    Wrap a model run function with a MicroBatcher if the micro-batching is enabled (MICRO_BATCHING=1).
+
+    Parameters
+    ----------
+    name : str
+        The name used to report the batcher statistics (usually the model name).
+    run_batch : callable
+        A function taking a list of inputs and returning a sliceable sequence with one result per input.
+
+    Returns
+    -------
+    callable
+        The batched run function or `run_batch` itself if the micro-batching is disabled.
+    """
+
+    if not MICRO_BATCHING:
+        return run_batch
+
+    batcher = MicroBatcher(
+            run_batch,
+            max_batch_size=MICRO_BATCHING_MAX_SIZE,
+            max_wait_ms=MICRO_BATCHING_MAX_WAIT_MS,
+            name=name,
+            )
+
+    # (a model loaded again after an eviction replaces the batcher of its previous instance)
+    previous = batchers.get(name)
+    if previous is not None:
+        previous.stop()
+
+    batchers[name] = batcher
+    return batcher
+
+
+def stop_batched(model):
+    """
+    Stop the micro-batcher of a model (see `make_batched`) and forget its statistics, when the model is evicted.
+
+    Parameters
+    ----------
+    model : object
+        The evicted model (its `run_model` attribute is the batched run function, if any).
+    """
+
+    batcher = getattr(model, "run_model", None)
+    if not isinstance(batcher, MicroBatcher):
+        return
+
+    batcher.stop()
+    if batchers.get(batcher.name) is batcher:
+        del batchers[batcher.name]
+
+
+def get_batching_stats():
+    return {name: batcher.get_stats() for name, batcher in batchers.items()}
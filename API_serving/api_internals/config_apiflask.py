@@ -1,5 +1,5 @@
 from apiflask import APIFlask, Schema
-from apiflask.fields import Integer, String, File, List, Nested, Boolean, Float
+from apiflask.fields import Integer, String, File, List, Nested, Boolean, Float, Dict
 from apiflask.validators import Length, Range
 
 
@@ -19,6 +19,15 @@ class LaserDefectsIn(Schema):
     binary_threshold = Float(validate=Range(0.0, 1.0), dump_default=False)
     multi_threshold = Float(validate=Range(0.0, 1.0), dump_default=False)
 
+class LaserVideoIn(Schema):
+    file = File(required=True)
+    selected_model = String(required=True)
+    target_fps = Float(validate=Range(min=0.1, max=1000.0), dump_default=False)
+    slide_step = Integer(validate=Range(1,10), dump_default=False)
+    min_defects = Integer(validate=Range(1,10), dump_default=False)
+    binary_threshold = Float(validate=Range(0.0, 1.0), dump_default=False)
+    multi_threshold = Float(validate=Range(0.0, 1.0), dump_default=False)
+
 
 # class DefectsIn(Schema):
 #     file = File(required=True)
@@ -89,6 +98,12 @@ class LaserDefectsFullOut(Schema):
     results = List(Nested(LaserDefectsOut), load_default=laser_output_sample)
     inference_time = Float()
     mean_inference_time = Float()
+    timings = Dict(metadata={"description": "Time (seconds) spent in each stage, per model and per image of the binary classifier (with ?timings=1)"})
+    profile_url = String(metadata={"description": "URL of the sampling profile of the request (with ?profile=1)"})
+    profile_samples = Integer()
+
+class LaserVideoFullOut(LaserDefectsFullOut):
+    video = Dict(metadata={"description": "Frame rates and numbers of frames of the video, and its decoding time (seconds)"})
 
 
 class PhotoDefectsOut(Schema):
@@ -102,6 +117,9 @@ class PhotoDefectsFullOut(Schema):
     results = List(Nested(PhotoDefectsOut), load_default=damage_sample)
     inference_time = Float()
     mean_inference_time = Float()
+    timings = Dict(metadata={"description": "Time (seconds) spent in each stage, per model and per image of the binary classifier (with ?timings=1)"})
+    profile_url = String(metadata={"description": "URL of the sampling profile of the request (with ?profile=1)"})
+    profile_samples = Integer()
 
 
 class ModelsOut(Schema):
@@ -111,3 +129,17 @@ class ModelsOut(Schema):
 
 class ModelsFullOut(Schema):
     models = List(Nested(ModelsOut), load_default=model_sample)
+
+
+class LaserJobOut(Schema):
+    job_id = String()
+    status = String()
+    stage = String()
+    frames_processed = Integer()
+    frames_total = Integer()
+    created_at = Float()
+    started_at = Float()
+    finished_at = Float()
+    error_msg = String()
+    status_url = String()
+    result_url = String()
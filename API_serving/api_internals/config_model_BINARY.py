@@ -1,56 +1,82 @@
 # from ultralytics import YOLO
 
-import io
 from pathlib import Path
 
 import onnxruntime as rt
 import numpy as np
 
-from torchvision import transforms
-from PIL import Image
+from api_internals.batching import make_batched
+from api_internals.decoded_image import decoded_image
+from api_internals.onnx_session import create_session, dummy_inputs
+from api_internals.result_cache import cached_run, model_version
+from api_internals.timing import stage
+from api_internals.logs import get_logger
 
+logger = get_logger(__name__)
 
-class BinaryClassifier():
 
-    def __init__(self, model_path):
+INPUT_SIZE = 580
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
 
-        print("init_BINARY", model_path)
+# (x / 255 - mean) / std = x * SCALE + OFFSET
+SCALE = 1.0 / (255.0 * STD)
+OFFSET = -MEAN / STD
 
-        self.model_path = model_path
-        self.model_name = Path(model_path).name
 
-        print("ONNX:", rt.get_device())
+def transform_image_from_bytes(file, out):
+    """
+    Write an uploaded image (resized, scaled and normalized) into a slot of the input batch.
 
-        providers = [
-            # "TensorrtExecutionProvider",
-            # "CUDAExecutionProvider",
-            "CPUExecutionProvider",
-        ]
+    It is the NumPy/OpenCV equivalent of the torchvision `Resize(580)`, `ToTensor` and `Normalize` transforms,
+    without any intermediate tensor.
 
-        self.model = rt.InferenceSession(
-            str(model_path), providers=providers
-        )
+    Parameters
+    ----------
+    file : dict
+        The perenized file (see `perenize_buffers`).
+    out : ndarray
+        The (3, 580, 580) float32 view of the batch the image is written into.
 
-        self.input_name = self.model.get_inputs()[0].name
-        self.output_name = self.model.get_outputs()[0].name
+    Returns
+    -------
+    ndarray
+        `out`.
+    """
+
+    # -- Decoded once per request (shared with the multilabel model), without applying the EXIF orientation (like PIL).
+    # The PIL bilinear resize is antialiased (see `resize_image`)
+    img = decoded_image(file).resized((INPUT_SIZE, INPUT_SIZE), antialias=True, oriented=False)
+
+    # -- HWC BGR uint8 -> CHW RGB float32
+    for c in range(3):
+        np.multiply(img[:, :, 2 - c], SCALE[c], out=out[c])
+        out[c] += OFFSET[c]
+
+    return out
+
+
+class BinaryClassifier():
 
-    def __transform_image_from_bytes(self, file):
+    def __init__(self, model_path, session_config=None):
 
-        # -- Read image using PIL (from buffer)
-        nparr = file['buffer'] # np.frombuffer(file.read(), np.uint8)
-        img = Image.open(io.BytesIO(nparr))
+        logger.info("init_BINARY", model_path=model_path)
 
-        # -- Define PyTorch transformations
-        transform = transforms.Compose([
-            transforms.Resize((580, 580)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
+        self.model_path = model_path
+        self.model_name = Path(model_path).name
+        self.model_version = model_version(model_path)
+
+        logger.info("onnx_device", device=rt.get_device())
 
-        # -- Apply transformations
-        img = transform(img)
+        self.model = create_session(model_path, session_config)
+
+        self.input_name = self.model.get_inputs()[0].name
+        self.output_name = self.model.get_outputs()[0].name
+        self.run_model = make_batched(self.model_name, self.__run_model)
 
-        return img
+    def warmup(self):
+        """Run a dummy input of the real input shape (not cached) to initialize the session before the first request"""
+        self.model.run([self.output_name], dummy_inputs(self.model))
 
     # def __transform_image_from_path(self, image_path):
     # 
@@ -71,18 +97,37 @@ class BinaryClassifier():
     #     return img
 
     def predict(self, filtered_files, pred_threshold = 0.5):
-        print("infer_BINARY_CLASSIFIER ", pred_threshold)
+        logger.debug("infer_BINARY_CLASSIFIER", images=len(filtered_files), threshold=pred_threshold)
 
-        # -- Prepare images
-        preprocessed_files = [self.__transform_image_from_bytes(x) for x in filtered_files]
+        # -- Infer (or fetch the raw scores of the already seen images)
+        results = cached_run(self.model_name, self.model_version, filtered_files, self.__infer)
+        results = np.array(results)
+
+        with stage("formatting", self.model_name, len(filtered_files)):
+            return self.__format_results(results, filtered_files, pred_threshold)
+
+    def __infer(self, filtered_files):
+
+        # -- Prepare images (directly in the NCHW batch, timed per image)
+        batch = np.empty((len(filtered_files), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        for i, file in enumerate(filtered_files):
+            with stage("preprocess", self.model_name, item=file['filename']):
+                transform_image_from_bytes(file, batch[i])
 
         # -- Infer
-        results = self.model.run([self.output_name], {self.input_name: preprocessed_files})[0]
+        with stage("inference", self.model_name, len(filtered_files)):
+            return self.run_model(batch)
+
+    def __run_model(self, batch):
+
+        # the micro-batcher hands a list of (3, 580, 580) images gathered from several requests
+        if not isinstance(batch, np.ndarray):
+            batch = np.stack(batch)
 
-        return self.__format_results(results, filtered_files, pred_threshold)
+        return self.model.run([self.output_name], {self.input_name: batch})[0]
 
     def __format_results(self, results, filtered_files, threshold):
-        print("format_results_BINARY_CLASSIFIER")
+        logger.debug("format_results_BINARY_CLASSIFIER")
 
         predictions = np.where(results > threshold, 1, 0)
         # print("PREDS:", predictions)
@@ -3,31 +3,33 @@ from pathlib import Path
 
 import onnxruntime as rt
 import numpy as np
-import cv2
 from PIL import Image
 
+from api_internals.batching import make_batched
+from api_internals.decoded_image import decoded_image
+from api_internals.onnx_session import create_session, dummy_inputs
+from api_internals.result_cache import cached_run, model_version
+from api_internals.timing import stage
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
 
 class MultiLabel_MobileNet:
 
-    def __init__(self, model_path):
+    input_size = (224, 224) # W, H
+
+    def __init__(self, model_path, session_config=None):
 
-        print("init_MOBILENET", model_path)
+        logger.info("init_MOBILENET", model_path=model_path)
 
         self.model_path = model_path
         self.model_name = Path(model_path).name
-        self.input_size = (224, 224) # W, H
+        self.model_version = model_version(model_path)
 
-        print("ONNX:", rt.get_device())
-
-        providers = [
-            # "TensorrtExecutionProvider",
-            # "CUDAExecutionProvider",
-            "CPUExecutionProvider",
-        ]
+        logger.info("onnx_device", device=rt.get_device())
 
-        self.model = rt.InferenceSession(
-            str(model_path), providers=providers
-        )
+        self.model = create_session(model_path, session_config)
 
         self.input_name = self.model.get_inputs()[0].name
         self.output_name = self.model.get_outputs()[0].name
@@ -38,14 +40,27 @@ class MultiLabel_MobileNet:
                 'start_stop_overlap',
                 'porosity_burn_through'
         ]
+        self.run_model = make_batched(self.model_name, self.__run_model)
+
+    def warmup(self):
+        """Run a dummy input of the real input shape (not cached) to initialize the session before the first request"""
+        self.model.run([self.output_name], dummy_inputs(self.model))
 
     def predict(self, filtered_files, pred_threshold = 0.3):
-        print("infer_MOBILENET ", pred_threshold)
+        logger.debug("infer_MOBILENET", images=len(filtered_files), threshold=pred_threshold)
+
+        # -- Infer (or fetch the raw probabilities of the already seen images)
+        results = cached_run(self.model_name, self.model_version, filtered_files, self.__infer)
+
+        with stage("formatting", self.model_name, len(filtered_files)):
+            return self.__format_results(results, pred_threshold)
 
+    def __infer(self, filtered_files):
 
         # -- Prepare images
-        preprocessed_data = [self.__preprocessing(x) for x in filtered_files]
-        preprocessed_files, original_ratios = list(map(list, zip(*preprocessed_data)))
+        with stage("preprocess", self.model_name, len(filtered_files)):
+            preprocessed_data = [self.__preprocessing(x) for x in filtered_files]
+            preprocessed_files, original_ratios = list(map(list, zip(*preprocessed_data)))
 
 
         # img = load_and_prep_image(filename)
@@ -57,23 +72,26 @@ class MultiLabel_MobileNet:
         # Model_Predictions_Prob = session.run([output_name], {input_name: img_expanded})[0]
 
         # -- Infer
-        results = self.model.run([self.output_name], {self.input_name: preprocessed_files})[0]
+        with stage("inference", self.model_name, len(filtered_files)):
+            return self.run_model(preprocessed_files)
 
-        return self.__format_results(results, original_ratios, pred_threshold)
+    def __run_model(self, preprocessed_files):
+        return self.model.run([self.output_name], {self.input_name: preprocessed_files})[0]
 
 
-    def __preprocessing(self, file, img_shape=224):
+    def preprocess(self, file):
+        """Return the model input of an uploaded file (used to calibrate the quantized models)"""
+        return self.__preprocessing(file)[0]
 
-        # -- Read image using PIL (from buffer)
-        nparr = file['buffer'] # np.frombuffer(file.read(), np.uint8)
-        image_bytes = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    def __preprocessing(self, file, img_shape=224):
 
-        resized = cv2.resize(
-            image_bytes, self.input_size, interpolation=cv2.INTER_LINEAR
-        )
+        # -- Decoded once per request (shared with the binary classifier)
+        image = decoded_image(file)
+        resized = image.resized(self.input_size)
 
-        ratioW = image_bytes.shape[0] / self.input_size[0]
-        ratioH = image_bytes.shape[1] / self.input_size[1]
+        width, height = image.size()
+        ratioW = height / self.input_size[0]
+        ratioH = width / self.input_size[1]
 
         return resized, (ratioW, ratioH)
 
@@ -84,8 +102,8 @@ class MultiLabel_MobileNet:
         # img_expanded = np.expand_dims(img, axis=0).astype(np.float32)  # ONNX expects float32 type
         # return img_expanded
 
-    def __format_results(self, results, original_ratios, threshold):
-        print("format_results_MOBILENET")
+    def __format_results(self, results, threshold):
+        logger.debug("format_results_MOBILENET")
 
         images = []
 
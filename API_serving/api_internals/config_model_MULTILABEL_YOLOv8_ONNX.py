@@ -0,0 +1,291 @@
+import ast
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from api_internals.batching import make_batched
+from api_internals.decoded_image import decoded_image
+from api_internals.onnx_session import create_session
+from api_internals.result_cache import cached_run, model_version
+from api_internals.timing import stage
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+def xywh_to_xyxy(boxes):
+    """Convert (N, 4) [center x, center y, width, height] boxes to [x1, y1, x2, y2]"""
+
+    xyxy = np.empty_like(boxes)
+    xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+    xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+    return xyxy
+
+
+def nms(boxes, scores, iou_threshold, max_keep=None):
+    """
+    Greedy non maximum suppression (same rule as torchvision.ops.nms).
+
+    Parameters
+    ----------
+    boxes : ndarray
+        The (N, 4) [x1, y1, x2, y2] boxes.
+    scores : ndarray
+        The (N,) scores of the boxes.
+    iou_threshold : float
+        The boxes overlapping a kept box with an IoU above this threshold are discarded.
+    max_keep : int, optional
+        Stop once this number of boxes is kept (the result is the same as truncating the full suppression).
+
+    Returns
+    -------
+    ndarray
+        The indexes of the kept boxes, by decreasing score.
+    """
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size > 0 and (max_keep is None or len(keep) < max_keep):
+        i = order[0]
+        keep.append(i)
+
+        others = order[1:]
+        width = np.clip(np.minimum(boxes[i, 2], boxes[others, 2]) - np.maximum(boxes[i, 0], boxes[others, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[i, 3], boxes[others, 3]) - np.maximum(boxes[i, 1], boxes[others, 1]), 0, None)
+        intersection = width * height
+        iou = intersection / (areas[i] + areas[others] - intersection)
+
+        order = others[iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def decode_yolov8(output, input_size, conf_threshold=0.25, iou_threshold=0.7, max_det=300, max_nms=30000):
+    """
+    Decode the raw output of an exported YOLOv8 detection model for one image
+    (the same post-processing as ultralytics `non_max_suppression` with `agnostic_nms=True`).
+
+    Parameters
+    ----------
+    output : ndarray
+        The (4 + C, N) output of the model for one image (N candidates: box center, size and C class scores).
+    input_size : tuple of int
+        The (width, height) of the model input, the boxes are clipped to it.
+    conf_threshold : float
+        The minimum class score of a detection.
+    iou_threshold : float
+        The IoU threshold of the (class agnostic) non maximum suppression.
+    max_det : int
+        The maximum number of detections.
+    max_nms : int
+        The maximum number of candidates given to the non maximum suppression (the best ones).
+
+    Returns
+    -------
+    ndarray
+        A (K, 6) array of [x1, y1, x2, y2, probability, class id] in the model input coordinates.
+    """
+
+    predictions = output.T # (N, 4 + C)
+    class_scores = predictions[:, 4:]
+
+    class_ids = np.argmax(class_scores, axis=1)
+    scores = class_scores[np.arange(len(class_scores)), class_ids]
+
+    candidates = scores > conf_threshold
+    boxes = xywh_to_xyxy(predictions[candidates, :4])
+    scores = scores[candidates]
+    class_ids = class_ids[candidates]
+
+    if len(scores) > max_nms:
+        best = np.argsort(-scores, kind="stable")[:max_nms]
+        boxes, scores, class_ids = boxes[best], scores[best], class_ids[best]
+
+    keep = nms(boxes, scores, iou_threshold, max_keep=max_det)
+
+    detections = np.column_stack([boxes[keep], scores[keep], class_ids[keep]]).reshape(-1, 6).astype(np.float64)
+    detections[:, [0, 2]] = detections[:, [0, 2]].clip(0, input_size[0])
+    detections[:, [1, 3]] = detections[:, [1, 3]].clip(0, input_size[1])
+
+    return detections
+
+
+class MultiLabel_YOLOv8_ONNX:
+    """
+    YOLOv8 detection model exported to ONNX (`yolo export format=onnx`), run with ONNX Runtime (or OpenVINO)
+    without the torch/ultralytics stack. The raw `[B, 4 + C, N]` output is decoded with NumPy.
+
+    The whole batch is run at once when the model was exported with a dynamic batch size (`dynamic=True`),
+    one image at a time otherwise.
+    """
+
+    input_size = (640, 640) # W, H (the default export size, replaced by the model input size once loaded)
+
+    def __init__(self, model_path, session_config=None, backend="onnxruntime", conf_threshold=0.25, iou_threshold=0.7):
+
+        logger.info("init_YOLO_ONNX", model_path=model_path, backend=backend)
+
+        self.model_path = model_path
+        self.model_name = Path(model_path).name
+        self.model_version = model_version(model_path)
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+
+        if backend == "openvino":
+            self.__load_openvino(model_path)
+        elif backend == "onnxruntime":
+            self.__load_onnxruntime(model_path, session_config)
+        else:
+            raise ValueError(f"Unknown YOLOv8 backend '{backend}' (expected 'onnxruntime' or 'openvino')")
+
+        self.input_size = (self.input_shape[3], self.input_shape[2]) # W, H
+        self.run_model = make_batched(self.model_name, self.__run_model)
+
+    def __load_onnxruntime(self, model_path, session_config):
+
+        self.model = create_session(model_path, session_config)
+
+        model_input = self.model.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.model.get_outputs()[0].name
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        self.input_shape = [x if isinstance(x, int) else 1 for x in model_input.shape]
+
+        metadata = self.model.get_modelmeta().custom_metadata_map
+        self.class_names = self.__parse_names(metadata.get('names'))
+
+        self.infer = lambda batch: self.model.run([self.output_name], {self.input_name: batch})[0]
+
+    def __load_openvino(self, model_path):
+
+        import onnx
+        from openvino.runtime import Core
+
+        ie_core = Core()
+        model = ie_core.read_model(model_path)
+        self.model = ie_core.compile_model(model=model, device_name="CPU", config={"PERFORMANCE_HINT": "LATENCY"})
+
+        input_shape = model.input(0).get_partial_shape()
+        self.dynamic_batch = input_shape[0].is_dynamic
+        self.input_shape = [1 if x.is_dynamic else x.get_length() for x in input_shape]
+
+        # -- the class names are stored in the ONNX metadata (not exposed by OpenVINO)
+        metadata = {p.key: p.value for p in onnx.load(model_path, load_external_data=False).metadata_props}
+        self.class_names = self.__parse_names(metadata.get('names'))
+
+        # -- the compiled model is shared by the request threads, its implicit infer request (`self.model(batch)`)
+        # isn't thread safe: each inference takes a free infer request from a pool (a new one if they are all busy)
+        self.output = self.model.output(0)
+        self.infer_requests = []
+        self.infer_requests_lock = threading.Lock()
+        self.infer = self.__infer_openvino
+
+    def __infer_openvino(self, batch):
+
+        with self.infer_requests_lock:
+            infer_request = self.infer_requests.pop() if self.infer_requests else self.model.create_infer_request()
+
+        try:
+            # (copied: the output tensor of the request is overwritten by its next inference)
+            return np.array(infer_request.infer({0: batch})[self.output], copy=True)
+        finally:
+            with self.infer_requests_lock:
+                self.infer_requests.append(infer_request)
+
+    @staticmethod
+    def __parse_names(names):
+        # ultralytics stores the names as the repr of a {class id: name} dict
+
+        if names is None:
+            raise ValueError("The class names are missing from the ONNX metadata (export the model with ultralytics)")
+
+        return ast.literal_eval(names)
+
+    def warmup(self):
+        """Run a dummy input of the real input shape (not cached) to initialize the model before the first request"""
+        self.infer(np.zeros(self.input_shape, dtype=np.float32))
+
+    def predict(self, filtered_files, *args, **kwargs):
+        logger.debug("infer_YOLO_ONNX", images=len(filtered_files))
+
+        # -- Infer (or fetch the raw detections of the already seen images)
+        results = cached_run(self.model_name, self.model_version, filtered_files, self.__infer)
+
+        with stage("formatting", self.model_name, len(filtered_files)):
+            return self.__format_results(results)
+
+    def __infer(self, filtered_files):
+
+        # -- Prepare images (directly in the NCHW batch)
+        with stage("preprocess", self.model_name, len(filtered_files)):
+            batch = np.empty((len(filtered_files), 3, self.input_size[1], self.input_size[0]), dtype=np.float32)
+            original_ratios = [self.__preprocessing(x, batch[i]) for i, x in enumerate(filtered_files)]
+
+        # -- Infer
+        with stage("inference", self.model_name, len(filtered_files)):
+            outputs = self.run_model(batch)
+
+        # -- Decode the detections (NMS)
+        with stage("formatting", self.model_name, len(filtered_files)):
+            return [self.__to_raw_detections(output, original_ratios[i]) for i, output in enumerate(outputs)]
+
+    def __run_model(self, batch):
+
+        # the micro-batcher hands a list of (3, H, W) images gathered from several requests
+        if not isinstance(batch, np.ndarray):
+            batch = np.stack(batch)
+
+        if self.dynamic_batch:
+            return self.infer(batch)
+
+        return np.concatenate([self.infer(batch[i:i + 1]) for i in range(len(batch))])
+
+    def __preprocessing(self, file, out):
+        # same resize as the ultralytics path (MultiLabel_YOLOv8_Standalone), then BGR -> RGB, HWC -> CHW and [0, 1] scaling
+
+        # -- Decoded once per request (shared with the binary classifier)
+        image = decoded_image(file)
+        resized = image.resized(self.input_size)
+
+        for c in range(3):
+            np.multiply(resized[:, :, 2 - c], 1.0 / 255.0, out=out[c])
+
+        width, height = image.size()
+        ratioW = height / self.input_size[1]
+        ratioH = width / self.input_size[0]
+
+        return ratioW, ratioH
+
+    def __to_raw_detections(self, output, original_ratio):
+        """Return the detections as a (N, 6) array of [x1, y1, x2, y2, probability, class id] in the original image coordinates"""
+
+        detections = decode_yolov8(output, self.input_size, self.conf_threshold, self.iou_threshold)
+
+        detections[:, [0, 2]] *= original_ratio[1]
+        detections[:, [1, 3]] *= original_ratio[0]
+
+        return detections
+
+    def __format_results(self, results):
+        logger.debug("format_results_YOLO_ONNX")
+
+        images = []
+        for r in results:
+            detects = []
+
+            for box in r:
+
+                detect = {
+                    # get box coordinates in (top, left, bottom, right) format
+                    "coords": box[:4].tolist(),
+                    "type": self.class_names[int(box[5])],
+                    "probability": float(box[4]),
+                }
+                detects.append(detect)
+
+            images.append(detects)
+
+        return images
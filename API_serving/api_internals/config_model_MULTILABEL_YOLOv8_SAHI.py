@@ -1,97 +1,193 @@
+import os
 import cv2
 from pathlib import Path
+from collections import defaultdict
 
-from sahi import AutoDetectionModel
-from sahi.predict import get_sliced_prediction, predict
+import numpy as np
+
+from sahi.slicing import get_slice_bboxes
+from sahi.prediction import ObjectPrediction
+from sahi.postprocess.combine import GreedyNMMPostprocess
 
 # import onnxruntime as rt
 from ultralytics import YOLO
 
+from api_internals.decoded_image import decoded_image
+from api_internals.result_cache import cached_run, model_version
+from api_internals.timing import stage
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- SLICES BATCHING CONFIGURATION
+
+SAHI_SLICE_BATCH_SIZE = int(os.environ.get("SAHI_SLICE_BATCH_SIZE", 16))
+
 
 class MultiLabel_YOLOv8_SAHI:
+    """
+    YOLOv8 model run on overlapping slices of the images (SAHI sliced prediction).
+
+    All the images of a request are cut into slices up front and the slices are run through the detector
+    in batches of `batch_size` (instead of one `get_sliced_prediction` per image, running the slices one by one).
+    The predictions are then merged per image with the SAHI postprocessing (same settings as `get_sliced_prediction`:
+    standard prediction on the full image, greedy NMM with the IOS metric at 0.5).
+    """
 
-    def __init__(self, model_path):
+    input_size = None # full resolution (sliced)
 
-        print("init_YOLO_SAHI", model_path)
+    def __init__(self, model_path, slice_size=512, overlap_ratio=0.2, confidence_threshold=0.3, batch_size=None):
+
+        logger.info("init_YOLO_SAHI", model_path=model_path)
 
         self.model_path = model_path
         self.model_name = Path(model_path).name
+        self.model_version = model_version(model_path)
 
-        # self.input_size = (640, 540) # W, H
-        # self.input_size = (1920, 1080) # W, H
-        # print("ONNX:", rt.get_device())
+        self.slice_size = slice_size
+        self.overlap_ratio = overlap_ratio
+        self.confidence_threshold = confidence_threshold
+        self.batch_size = batch_size or SAHI_SLICE_BATCH_SIZE
 
-        defect_model = YOLO(model_path)
-        self.class_names = defect_model.names
+        self.model = YOLO(model_path)
+        self.class_names = self.model.names
 
-        self.model = AutoDetectionModel.from_pretrained(
-            model_type="yolov8",
-            model_path=model_path,
-            confidence_threshold=0.3,
-            device="cpu",  # or 'cuda:0'
-        )
+        self.postprocess = GreedyNMMPostprocess(match_threshold=0.5, match_metric="IOS", class_agnostic=False)
 
-        # self.model.names = class_names
+    def warmup(self):
+        """Run a dummy slice (not cached) to initialize the model before the first request"""
+        self.model.predict([np.zeros((self.slice_size, self.slice_size, 3), dtype=np.uint8)], verbose=False, device="cpu")
 
     def predict(self, filtered_files, *args, **kwargs):
-        print("infer_YOLO SAHI")
+        logger.debug("infer_YOLO_SAHI", images=len(filtered_files))
+
+        # -- Infer (or fetch the raw detections of the already seen images)
+        results = cached_run(self.model_name, self.model_version, filtered_files, self.__infer)
+
+        with stage("formatting", self.model_name, len(filtered_files)):
+            return self.__format_results(results)
+
+    def __infer(self, filtered_files):
 
         # -- Prepare images
-        preprocessed_data = [self.__preprocessing(x) for x in filtered_files]
-        preprocessed_files, original_ratios = list(map(list, zip(*preprocessed_data)))
+        with stage("preprocess", self.model_name, len(filtered_files)):
+            preprocessed_data = [self.__preprocessing(x) for x in filtered_files]
+            preprocessed_files, original_ratios = list(map(list, zip(*preprocessed_data)))
+
+            # -- Cut all the images into slices (plus the full image when it is sliced, the SAHI "standard prediction")
+            tasks = []
+            for i, image in enumerate(preprocessed_files):
+
+                slice_bboxes = get_slice_bboxes(
+                    image_height=image.shape[0],
+                    image_width=image.shape[1],
+                    slice_height=self.slice_size,
+                    slice_width=self.slice_size,
+                    overlap_height_ratio=self.overlap_ratio,
+                    overlap_width_ratio=self.overlap_ratio,
+                )
+                for x1, y1, x2, y2 in slice_bboxes:
+                    tasks.append((i, (x1, y1), image[y1:y2, x1:x2]))
+
+                if len(slice_bboxes) > 1:
+                    tasks.append((i, (0, 0), image))
 
         # -- Infer
-        results = []
-        for file in preprocessed_files:
-            result = get_sliced_prediction(
-                file,
-                self.model,
-                slice_height=512,
-                slice_width=512,
-                overlap_height_ratio=0.2,
-                overlap_width_ratio=0.2,
-            )
-            results.append(result.object_prediction_list)
-
-        return self.__format_results(results, original_ratios)
+        with stage("inference", self.model_name, len(filtered_files)):
+            predictions = self.__run_tasks(tasks)
 
-    def __preprocessing(self, file):
+        # -- Merge the predictions of each image (slices order, then the standard prediction, as SAHI does)
+        with stage("formatting", self.model_name, len(filtered_files)):
+            object_predictions = [[] for _ in preprocessed_files]
+            for (i, shift, _), boxes in zip(tasks, predictions):
+                object_predictions[i] += self.__to_object_predictions(boxes, shift, preprocessed_files[i].shape)
+
+            results = [self.postprocess(x) if len(x) > 1 else x for x in object_predictions]
+
+            return [self.__to_raw_detections(r, original_ratios[i]) for i, r in enumerate(results)]
+
+    def __run_tasks(self, tasks):
+        """Run the slices (and full images) in batches and return the (K, 6) [x1, y1, x2, y2, conf, class id] boxes of each one"""
+
+        # only the images of the same shape are batched together, so that ultralytics letterboxes them as if they were alone
+        groups = defaultdict(list)
+        for j, (_, _, image) in enumerate(tasks):
+            groups[image.shape].append(j)
 
-        nparr = file['buffer'] # nparr = np.frombuffer(file.read(), np.uint8)
-        image_bytes = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        predictions = [None] * len(tasks)
+        for indexes in groups.values():
+            for k in range(0, len(indexes), self.batch_size):
+                batch_indexes = indexes[k:k + self.batch_size]
 
-        # resized = cv2.resize(
-        #     image_bytes, self.input_size, interpolation=cv2.INTER_LINEAR
-        # )
+                results = self.model.predict([tasks[j][2] for j in batch_indexes], verbose=False, device="cpu")
+                for j, r in zip(batch_indexes, results):
+                    predictions[j] = r.boxes.data.cpu().numpy()
 
-        # ratioW = image_bytes.shape[0] / self.input_size[1]
-        # ratioH = image_bytes.shape[1] / self.input_size[0]
+        return predictions
 
-        resized = image_bytes
+    def __to_object_predictions(self, boxes, shift, full_shape):
+        """Build the SAHI predictions of a slice in the full image coordinates (same filtering and fixes as the SAHI yolov8 model)"""
+
+        height, width = full_shape[:2]
+
+        object_predictions = []
+        for x1, y1, x2, y2, score, category_id in boxes[boxes[:, 4] >= self.confidence_threshold]:
+
+            # -- Fix the negative and out of image coordinates, ignore the invalid boxes
+            x1, x2 = min(width, max(0, x1)), min(width, max(0, x2))
+            y1, y2 = min(height, max(0, y1)), min(height, max(0, y2))
+            if not (x1 < x2 and y1 < y2):
+                continue
+
+            object_predictions.append(ObjectPrediction(
+                bbox=[float(x1) + shift[0], float(y1) + shift[1], float(x2) + shift[0], float(y2) + shift[1]],
+                category_id=int(category_id),
+                score=float(score),
+                category_name=self.class_names[int(category_id)],
+                shift_amount=[0, 0],
+                full_shape=[height, width],
+            ))
+
+        return object_predictions
+
+    def __preprocessing(self, file):
+
+        # -- Decoded once per request (shared with the binary classifier), at full resolution
+        image_bytes = decoded_image(file).full()
+
+        # SAHI handled the decoded (BGR) image as RGB and reversed the channels of each slice
+        # before giving it to ultralytics (which expects BGR): the model was fed with RGB slices
+        resized = cv2.cvtColor(image_bytes, cv2.COLOR_BGR2RGB)
         ratioW = ratioH = 1.0
 
         return resized, (ratioW, ratioH)
 
-    def __format_results(self, results, original_ratios):
-        print("format_results_YOLO SAHI")
+    def __to_raw_detections(self, object_predictions, original_ratio):
+        """Return the detections as a (N, 6) array of [x1, y1, x2, y2, probability, class id] in the original image coordinates"""
+
+        detections = np.array([
+            [*box.bbox.to_xyxy(), box.score.value, box.category.id] for box in object_predictions
+        ], dtype=np.float64).reshape(-1, 6)
+
+        detections[:, [0, 2]] *= original_ratio[1]
+        detections[:, [1, 3]] *= original_ratio[0]
+
+        return detections
+
+    def __format_results(self, results):
+        logger.debug("format_results_YOLO_SAHI")
 
         images = []
-        for i, r in enumerate(results):
+        for r in results:
             detects = []
 
             for box in r:
 
-                coords_ratio = box.bbox.to_xyxy()
-                coords_ratio[0] *= original_ratios[i][1]
-                coords_ratio[1] *= original_ratios[i][0]
-                coords_ratio[2] *= original_ratios[i][1]
-                coords_ratio[3] *= original_ratios[i][0]
-
                 detect = {
                     # get box coordinates in (top, left, bottom, right) format
-                    "coords": coords_ratio,
-                    "type": self.class_names[box.category.id],
-                    "probability": float(box.score.value),
+                    "coords": box[:4].tolist(),
+                    "type": self.class_names[int(box[5])],
+                    "probability": float(box[4]),
                 }
                 detects.append(detect)
 
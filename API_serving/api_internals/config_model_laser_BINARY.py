@@ -3,29 +3,35 @@ import io
 from pathlib import Path
 from typing import Union, Optional
 from importlib.util import find_spec
+import os
+import threading
 
 import albumentations as A
 import numpy as np
 
 # import onnxruntime as rt
-from openvino.runtime import Core
+from openvino.runtime import Core, AsyncInferQueue
 
 # from anomalib.data.utils import get_image_filenames
 from anomalib.deploy.inferencers.base_inferencer import Inferencer
 from anomalib.data.utils import read_image
+from anomalib.post_processing.normalization.min_max import normalize as normalize_min_max
+from anomalib.post_processing.normalization.cdf import standardize, normalize as normalize_cdf
 # from anomalib.post_processing import Visualizer
 # from anomalib.post_processing import ImageResult
 
-from api_internals.LaserProfileTransformation import transform_frame
+from api_internals.frame_store import LaserFrameStore
+from api_internals.timing import stage
+from api_internals.logs import get_logger
 
-from PIL import Image
+logger = get_logger(__name__)
 
 
 class LaserBinaryClassifier(Inferencer):
 
-    def __init__(self, model_path, metadata_path) -> None:
+    def __init__(self, model_path, metadata_path, num_requests=None) -> None:
 
-        print("init_laserBINARY", model_path)
+        logger.info("init_laserBINARY", model_path=model_path)
 
         self.model_path = model_path
         self.model_name = Path(model_path).name
@@ -34,13 +40,23 @@ class LaserBinaryClassifier(Inferencer):
 
         self.input_name, self.output_name, self.model = self.load_model(model_path)
         self.metadata = super()._load_metadata(metadata_path)
+        self.transform = A.from_dict(self.metadata["transform"])
+
+        # -- Number of inferences run simultaneously by `predict` (0 => the optimal number for the device)
+        if num_requests is None:
+            num_requests = int(os.environ.get("LASER_BINARY_INFER_REQUESTS", 0))
+        self.num_requests = num_requests
 
     def load_model(self, path: Union[str, Path]):
 
         # -- Define and load model
         ie_core = Core()
         model = ie_core.read_model(path)
-        compile_model = ie_core.compile_model(model=model, device_name=self.device)
+        compile_model = ie_core.compile_model(
+                model=model,
+                device_name=self.device,
+                config={"PERFORMANCE_HINT": "THROUGHPUT"},
+                )
 
         # -- Create cache folder
         # cache_folder = Path("cache")
@@ -52,12 +68,16 @@ class LaserBinaryClassifier(Inferencer):
         output_blob = compile_model.output(0)
         return input_blob, output_blob, compile_model
 
-    def pre_process(self, image: np.ndarray) -> np.ndarray:
+    def warmup(self):
+        """Run a dummy input of the real input shape to initialize the model before the first request"""
 
-        image = transform_frame(image) # needed for extra processing
+        shape = [1 if x.is_dynamic else x.get_length() for x in self.input_name.get_partial_shape()]
+        self.forward(np.zeros(shape, dtype=np.float32))
 
-        transform = A.from_dict(self.metadata["transform"])
-        processed_image = transform(image=image)["image"]
+    def pre_process(self, image: np.ndarray) -> np.ndarray:
+        # the image is the transformed frame (see LaserFrameStore) as the model needs the extracted laser profile
+
+        processed_image = self.transform(image=image)["image"]
 
         if len(processed_image.shape) == 3:
             processed_image = np.expand_dims(processed_image, axis=0)
@@ -68,8 +88,19 @@ class LaserBinaryClassifier(Inferencer):
         processed_image = np.repeat(processed_image, 3, axis=1) # needed for extra processing
         return processed_image
 
-    def forward(self, image: np.ndarray) -> np.ndarray:
-        return self.model(image)
+    def forward(self, image: np.ndarray, infer_request=None) -> np.ndarray:
+        """
+        Run the model on a preprocessed frame.
+
+        The compiled model is shared by the requests (see api_internals.model_registry) and its implicit infer request
+        (`self.model(image)`) isn't thread safe: the inference runs on the given infer request (owned by the caller),
+        or on a new one.
+        """
+
+        if infer_request is None:
+            infer_request = self.model.create_infer_request()
+
+        return infer_request.infer({0: image})
 
     def post_process(self, predictions: np.ndarray):
 
@@ -97,52 +128,124 @@ class LaserBinaryClassifier(Inferencer):
             "pred_score": pred_score,
         }
 
-    def predict(self, filtered_files, pred_threshold = 0.5):
-        print("infer_laser_BINARY_CLASSIFIER", pred_threshold)
+    def predict(self, filtered_files, pred_threshold = 0.5, progress_callback = None, frame_store = None):
+        logger.debug("infer_laser_BINARY_CLASSIFIER", frames=len(filtered_files), threshold=pred_threshold)
 
-        results = []
-        for file in filtered_files:
-            image_arr = np.array(file['buffer'])
-            img = Image.open(io.BytesIO(image_arr))
-            # img = img.convert('RGB')
-            image_arr = np.array(img)
-            # self.metadata["image_shape"] = image_arr.shape[:2]
+        if frame_store is None:
+            frame_store = LaserFrameStore(filtered_files)
 
-            processed_image = self.pre_process(image_arr)
-            predictions = self.forward(processed_image)
-            output = self.post_process(predictions)
+        results = self.__infer_scores(frame_store, len(filtered_files), progress_callback)
 
-            results.append(output['pred_score'])
+        with stage("formatting", self.model_name, len(filtered_files)):
+            return self.__format_results(results, filtered_files, pred_threshold)
 
-        results = np.array(results)
-        return self.__format_results(results, filtered_files, pred_threshold)
+    def __infer_scores(self, frame_store, num_frames, progress_callback = None):
+        """
+        Score all the frames with several inferences in flight (AsyncInferQueue), the next frames being
+        preprocessed while the previous ones are inferred, and normalize all the scores at once.
+        """
 
-    def __format_results(self, results, filtered_files, pred_threshold):
-        print("format_results_laser_BINARY_CLASSIFIER", pred_threshold)
+        infer_queue = AsyncInferQueue(self.model, self.num_requests)
+        raw_scores = np.empty(num_frames, dtype=np.float64)
+
+        lock = threading.Lock()
+        frames_processed = [0]
+
+        def on_inferred(request, index):
+            raw_scores[index] = request.get_output_tensor(0).data.max()
+
+            if progress_callback is not None:
+                with lock:
+                    frames_processed[0] += 1
+                    progress_callback(frames_processed[0])
+
+        infer_queue.set_callback(on_inferred)
+
+        # (the time spent waiting for a free infer request is counted as inference)
+        try:
+            for i in range(num_frames):
+                with stage("preprocess", self.model_name, item=frame_store.filename(i)):
+                    processed_image = self.pre_process(frame_store.get(i))
+                with stage("inference", self.model_name, item=frame_store.filename(i)):
+                    infer_queue.start_async({0: processed_image}, userdata=i)
+        finally:
+            with stage("inference", self.model_name, count=0):
+                infer_queue.wait_all()
+
+        with stage("formatting", self.model_name, count=0):
+            return self.__normalize_scores(raw_scores)
+
+    def __normalize_scores(self, pred_scores):
+        """Vectorized version of the scores normalization done by `post_process` (see Inferencer._normalize)"""
+
+        if "image_threshold" not in self.metadata:
+            return pred_scores
+
+        if "min" in self.metadata and "max" in self.metadata:
+            pred_scores = normalize_min_max(
+                    pred_scores,
+                    self.metadata["image_threshold"],
+                    self.metadata["min"],
+                    self.metadata["max"],
+                    )
+
+        if "image_mean" in self.metadata:
+            pred_scores = standardize(pred_scores, self.metadata["image_mean"], self.metadata["image_std"])
+            pred_scores = normalize_cdf(pred_scores, self.metadata["image_threshold"])
 
-        predictions = np.where(results > pred_threshold, 0, 1)
-        # print("PREDS:", predictions)
-        # labels = np.where(predictions == 0, "Defect", "No defect" )
-        # print("LABELS:", labels)
+        return np.asarray(pred_scores, dtype=np.float64)
+
+    def iter_predict(self, filtered_files, pred_threshold = 0.5, frame_store = None):
+        """Yield the result of each frame as soon as it is scored (same format as the results of `predict`)"""
+
+        logger.debug("iter_infer_laser_BINARY_CLASSIFIER", frames=len(filtered_files), threshold=pred_threshold)
+
+        if frame_store is None:
+            frame_store = LaserFrameStore(filtered_files)
+
+        # (one infer request per stream: the concurrent streams share the compiled model)
+        infer_request = self.model.create_infer_request()
+
+        for i, file in enumerate(filtered_files):
+            yield self.__format_result(self.__score(frame_store.get(i), infer_request), file, pred_threshold)
+
+    def __score(self, transformed_frame, infer_request):
+
+        with stage("preprocess", self.model_name):
+            processed_image = self.pre_process(transformed_frame)
+        with stage("inference", self.model_name):
+            predictions = self.forward(processed_image, infer_request)
+        with stage("formatting", self.model_name):
+            output = self.post_process(predictions)
+
+        return output['pred_score']
+
+    def __format_results(self, results, filtered_files, pred_threshold):
+        logger.debug("format_results_laser_BINARY_CLASSIFIER", threshold=pred_threshold)
 
         images = []
         defect_indexes = []
         for i, r in enumerate(results):
 
-            has_defect = not bool(predictions[i])
-            if has_defect:
+            defect = self.__format_result(r, filtered_files[i], pred_threshold)
+            if defect['has_defect']:
                 defect_indexes.append(i)
 
-            binary_score = prob = r
-            if predictions[i] == 1: # Defect
-                prob = 1.0 - prob
-
-            defect = {
-                "file": filtered_files[i]['filename'],
-                "has_defect": has_defect,
-                "score": float(binary_score),
-                "probability": float(prob),
-            }
             images.append(defect)
 
         return images, defect_indexes
+
+    def __format_result(self, score, file, pred_threshold):
+
+        has_defect = bool(score > pred_threshold)
+
+        binary_score = prob = score
+        if not has_defect:
+            prob = 1.0 - prob
+
+        return {
+            "file": file['filename'],
+            "has_defect": has_defect,
+            "score": float(binary_score),
+            "probability": float(prob),
+        }
@@ -6,102 +6,169 @@ import numpy as np
 import cv2
 from PIL import Image
 
-from api_internals.LaserProfileTransformation import transform_frame
+from api_internals.frame_store import LaserFrameStore
+from api_internals.onnx_session import create_session, dummy_inputs
+from api_internals.timing import stage
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+WINDOW_SIZE = 10 # number of frames per sliding window
 
 
 class Laser_Multiclass_MobileNet:
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, session_config=None):
 
-        print("init_laser_MOBILENET", model_path)
+        logger.info("init_laser_MOBILENET", model_path=model_path)
 
         self.model_path = model_path
         self.model_name = Path(model_path).name
         self.input_size = (224, 224) # W, H
 
-        print("ONNX:", rt.get_device())
-
-        providers = [
-            # "TensorrtExecutionProvider",
-            # "CUDAExecutionProvider",
-            "CPUExecutionProvider",
-        ]
+        logger.info("onnx_device", device=rt.get_device())
 
-        self.model = rt.InferenceSession(
-            str(model_path), providers=providers
-        )
+        self.model = create_session(model_path, session_config)
 
         self.input_name = self.model.get_inputs()[0].name
         self.output_name = self.model.get_outputs()[0].name
         self.class_names = ['Irregular_Bead', 'Porosity_Burn_Through', 'Start_Stop_Overlap']
 
-    def predict(self, filtered_files, binary_defect_indexes, slide_step=3, defects_threshold=1, pred_threshold=0.5):
-        print("infer_laser_MOBILENET", defects_threshold, pred_threshold)
+    def warmup(self):
+        """Run a dummy input of the real input shape (not cached) to initialize the session before the first request"""
+        self.model.run([self.output_name], dummy_inputs(self.model))
 
-        if len(filtered_files) < 10:
+    def predict(self, filtered_files, binary_defect_indexes, slide_step=3, defects_threshold=1, pred_threshold=0.5, progress_callback=None, frame_store=None):
+        logger.debug("infer_laser_MOBILENET", frames=len(filtered_files), defects_threshold=defects_threshold, threshold=pred_threshold)
+
+        if len(filtered_files) < WINDOW_SIZE:
             return []
 
+        if frame_store is None:
+            frame_store = LaserFrameStore(filtered_files)
+
         # -- Pre process all images
         preprocessed_files_all = []
-        for filtered_img in filtered_files:
-            preprocessed_files_all.append(self.__preprocessing(filtered_img))
+        for i in range(len(filtered_files)):
+            transformed_frame = frame_store.get(i)
+            with stage("preprocess", self.model_name):
+                preprocessed_files_all.append(self.__preprocessing(transformed_frame))
+
+            if progress_callback is not None:
+                progress_callback(i + 1)
 
         # -- Prepare batches of 10 images
         preprocessed_batch = []
         batch_indexes = []
 
         binary_defect_bools = [1 if x in binary_defect_indexes else 0 for x in range(len(filtered_files))]
-        i = 0
-        while i+10 <= len(filtered_files):
+        for i in self.window_starts(len(filtered_files), slide_step):
 
-            binary_defect_values = binary_defect_bools[i:i+10]
-            num_defects_in_batch = np.array(binary_defect_values).sum()
-            print("NUM_DEFECTS_IN_BATCH:", num_defects_in_batch)
-
-            indexes = []
-
-            if num_defects_in_batch >= defects_threshold:
-                selected_files = []
-                for j, processed_img in enumerate(preprocessed_files_all):
-
-                    if processed_img is not None:
-                        selected_files.append(processed_img)
-                        indexes.append(i+j)
-                    if len(selected_files) == 10:
-                        break
-
-                preprocessed_batch.append(selected_files)
-                batch_indexes.append(indexes)
-
-            else:
-                preprocessed_batch.append([])
+            num_defects_in_batch = np.array(binary_defect_bools[i:i+WINDOW_SIZE]).sum()
 
-            i += slide_step
+            selected_files, indexes = self.select_window(
+                    preprocessed_files_all.__getitem__,
+                    len(filtered_files),
+                    i,
+                    num_defects_in_batch,
+                    defects_threshold,
+                    )
 
-        # print("PREPROCESSED_BATCH:", preprocessed_batch)
+            preprocessed_batch.append(selected_files)
+            batch_indexes.append(indexes)
 
         # -- Infer
         preprocessed = [x for x in preprocessed_batch if len(x) > 0]
         results = []
         if len(preprocessed) > 0:
-            results = self.model.run([self.output_name], {self.input_name: preprocessed})[0]
+            with stage("inference", self.model_name, len(preprocessed) * WINDOW_SIZE):
+                results = self.model.run([self.output_name], {self.input_name: preprocessed})[0]
 
         # -- Prepare results
-        r = [results[j] if len(x) > 0 else None for j, x in enumerate(preprocessed_batch)]
-
-        print("RESULTS:", r)
-        return self.__format_results(r, batch_indexes, pred_threshold)
-
-
-    def __preprocessing(self, file, img_shape=224):
-
-        nparr = file['buffer'] # np.frombuffer(file.read(), np.uint8)
-        image_bytes = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        #///img = cv2.imread(img_path)
-
-        gray_frame = cv2.cvtColor(image_bytes, cv2.COLOR_BGR2GRAY)
-        gray_transformed_frame = transform_frame(gray_frame)
-        # gray_transformed_frame = transform_frame(image_bytes)
+        results = iter(results)
+        r = [next(results) if len(x) > 0 else None for x in preprocessed_batch]
+
+        with stage("formatting", self.model_name, len(preprocessed_batch)):
+            return self.__format_results(r, batch_indexes, pred_threshold)
+
+    def predict_window(self, get_preprocessed, num_files, start, num_defects, defects_threshold=1, pred_threshold=0.5):
+        """
+        Predict the defect of a single sliding window (used to stream the results window by window).
+
+        Parameters
+        ----------
+        get_preprocessed : callable
+            A function returning the preprocessed frame (see `preprocess`) of a given frame index.
+        num_files : int
+            The number of frames in the sequence.
+        start : int
+            The index of the first frame of the window.
+        num_defects : int
+            The number of frames of the window classified as defective by the binary classifier.
+        defects_threshold : int
+            The minimum number of defective frames required to run the model on the window.
+        pred_threshold : float
+            The minimum probability of the predicted class to report a defect.
+
+        Returns
+        -------
+        dict
+            The prediction of the window (same format as the items returned by `predict`).
+        """
+
+        selected_files, indexes = self.select_window(get_preprocessed, num_files, start, num_defects, defects_threshold)
+
+        result = None
+        if len(selected_files) > 0:
+            with stage("inference", self.model_name, WINDOW_SIZE):
+                result = self.model.run([self.output_name], {self.input_name: [selected_files]})[0][0]
+
+        with stage("formatting", self.model_name):
+            return self.__format_result(result, indexes, pred_threshold)
+
+    def preprocess(self, gray_transformed_frame):
+        with stage("preprocess", self.model_name):
+            return self.__preprocessing(gray_transformed_frame)
+
+    @staticmethod
+    def window_starts(num_files, slide_step):
+        """Return the index of the first frame of each sliding window"""
+
+        return range(0, num_files - WINDOW_SIZE + 1, slide_step)
+
+    @staticmethod
+    def select_window(get_preprocessed, num_files, start, num_defects, defects_threshold):
+        """
+        Select the frames of the sliding window starting at `start`.
+
+        The window is made of the first 10 frames (starting at `start`) for which the laser profile could be extracted.
+        It is left empty if the binary classifier found less than `defects_threshold` defective frames in the window,
+        or if there aren't enough usable frames until the end of the sequence.
+
+        Returns
+        -------
+        tuple of (list, list)
+            The selected preprocessed frames and their indexes in the sequence.
+        """
+
+        if num_defects < defects_threshold:
+            return [], list(range(start, start + WINDOW_SIZE))
+
+        selected_files = []
+        indexes = []
+        for j in range(start, num_files):
+
+            processed_img = get_preprocessed(j)
+            if processed_img is not None:
+                selected_files.append(processed_img)
+                indexes.append(j)
+            if len(selected_files) == WINDOW_SIZE:
+                return selected_files, indexes
+
+        return [], list(range(start, start + WINDOW_SIZE))
+
+    def __preprocessing(self, gray_transformed_frame, img_shape=224):
+        # the frame was decoded and transformed once for all the laser models (see LaserFrameStore)
 
         if gray_transformed_frame is None:
             return None
@@ -130,45 +197,42 @@ class Laser_Multiclass_MobileNet:
 
 
     def __format_results(self, results, batch_indexes, pred_threshold):
-        print("format_results_laser_MOBILENET")
-
-        images = []
+        logger.debug("format_results_laser_MOBILENET", windows=len(results))
 
-        for i, result in enumerate(results):
-            image_names = []
-            batch_index = batch_indexes[i] if len(batch_indexes) > 0 else (0,0,0)
+        images = [self.__format_result(result, batch_indexes[i], pred_threshold) for i, result in enumerate(results)]
 
-            defect = {
-                'indexes': batch_index,
-                'has_defect': None,
-                'type': None,
-                'probability': None,
-                'score': None,
-            }
+        return images
 
-            if result is None:
-                defect['type'] = 'no_pred'
+    def __format_result(self, result, batch_index, pred_threshold):
+
+        defect = {
+            'indexes': batch_index,
+            'has_defect': None,
+            'type': None,
+            'probability': None,
+            'score': None,
+        }
+
+        if result is None:
+            defect['type'] = 'no_pred'
+        else:
+            probabilities = np.array(result)
+            max_value = np.max(probabilities)
+            max_index = np.argmax(probabilities)
+
+            if max_value > pred_threshold:
+                defect['type'] = self.class_names[max_index]
+                defect['has_defect'] = True
             else:
-                probabilities = np.array(result)
-                max_value = np.max(probabilities)
-                max_index = np.argmax(probabilities)
-
-                if max_value > pred_threshold:
-                    defect['type'] = self.class_names[max_index]
-                    defect['has_defect'] = True
-                else:
-                    defect['type'] = 'no_defect_found'
-                    defect['has_defect'] = False
-
-                proba = float(probabilities[max_index])
-                defect['score'] = proba
+                defect['type'] = 'no_defect_found'
+                defect['has_defect'] = False
 
-                if defect['has_defect']:
-                    defect['probability'] = proba
-                else:
-                    defect['probability'] = 1.0 - proba
+            proba = float(probabilities[max_index])
+            defect['score'] = proba
 
-            images.append(defect)
+            if defect['has_defect']:
+                defect['probability'] = proba
+            else:
+                defect['probability'] = 1.0 - proba
 
-        print("IMAGES:", images)
-        return images
+        return defect
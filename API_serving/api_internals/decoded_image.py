@@ -0,0 +1,308 @@
+import os
+import math
+import threading
+
+import cv2
+from PIL import Image
+
+from api_internals.ingestion import open_buffer
+from api_internals.timing import stage
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- DECODING CONFIGURATION
+
+# decode the JPEG images at 1/2, 1/4 or 1/8 of their size (libjpeg DCT scaling) when the models need smaller images
+JPEG_REDUCED_DECODE = os.environ.get("JPEG_REDUCED_DECODE", "1") == "1"
+
+# the reduced image must be at least this many times larger than the model inputs (in each dimension)
+JPEG_REDUCED_DECODE_MIN_RATIO = float(os.environ.get("JPEG_REDUCED_DECODE_MIN_RATIO", 1.0))
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# EXIF orientation -> the transforms applied by OpenCV (IMREAD_COLOR) to the stored pixels
+ORIENTATION_TRANSFORMS = {
+    1: [],
+    2: [lambda x: cv2.flip(x, 1)],
+    3: [lambda x: cv2.flip(x, -1)],
+    4: [lambda x: cv2.flip(x, 0)],
+    5: [cv2.transpose],
+    6: [cv2.transpose, lambda x: cv2.flip(x, 1)],
+    7: [cv2.transpose, lambda x: cv2.flip(x, -1)],
+    8: [cv2.transpose, lambda x: cv2.flip(x, 0)],
+}
+
+
+def read_header(buffer):
+    """
+    Read the header of an encoded image, without decoding it.
+
+    Returns
+    -------
+    tuple of (str, tuple, int)
+        The format ('JPEG', 'PNG'... None if unknown), the stored (width, height) (None if unknown)
+        and the EXIF orientation (1 if none).
+    """
+
+    try:
+        with Image.open(open_buffer(buffer)) as img:
+            image_format, size = img.format, img.size
+
+            # (the EXIF block of the JPEG, PNG and WebP images is read with the header)
+            orientation = 1
+            exif_bytes = img.info.get("exif")
+            if exif_bytes:
+                exif = Image.Exif()
+                exif.load(exif_bytes)
+                orientation = int(exif.get(EXIF_ORIENTATION_TAG, 1))
+    except Exception:
+        return None, None, 1
+
+    return image_format, size, orientation if orientation in ORIENTATION_TRANSFORMS else 1
+
+
+def resize_image(img, size, antialias=False):
+    """
+    Resize an image (bilinear interpolation).
+
+    Parameters
+    ----------
+    img : ndarray
+        The (H, W, C) image.
+    size : tuple of int
+        The (width, height) of the resized image.
+    antialias : bool
+        Blur the image before downscaling it, like the PIL bilinear resize (a triangle filter as wide as the
+        downscaling factor, approximated by a gaussian of the same standard deviation: factor / sqrt(6)).
+
+    Returns
+    -------
+    ndarray
+        The resized image.
+    """
+
+    if antialias:
+        height, width = img.shape[:2]
+        sigma_x = 0.4 * width / size[0] if width > size[0] else 0
+        sigma_y = 0.4 * height / size[1] if height > size[1] else 0
+        if sigma_x > 0 or sigma_y > 0:
+            img = cv2.GaussianBlur(img, (0, 0), sigmaX=max(sigma_x, 1e-3), sigmaY=max(sigma_y, 1e-3))
+
+    return cv2.resize(img, size, interpolation=cv2.INTER_LINEAR)
+
+
+class DecodedImage:
+    """
+    An uploaded image decoded once per request, from which every model derives its input.
+
+    The image is decoded (BGR, as stored, i.e. without its EXIF orientation) on first use, and the resized
+    variants are cached. The variants declared with `require` are computed as soon as the image is decoded,
+    after which the full resolution image is only kept if one of the declared variants needs it,
+    so that a request doesn't keep all its images at full resolution between the models.
+
+    The JPEG images are decoded at the smallest scale (1/2, 1/4 or 1/8, see JPEG_REDUCED_DECODE) still covering
+    all the declared variants (and the requested one), the full resolution images being decoded at full scale.
+
+    Parameters
+    ----------
+    buffer : ndarray
+        The encoded image (see `perenize_buffers`).
+    filename : str, optional
+        The name of the uploaded file (for the error messages).
+    reduced_decode : bool, optional
+        Allow the reduced JPEG decoding (JPEG_REDUCED_DECODE by default).
+    """
+
+    def __init__(self, buffer, filename=None, reduced_decode=None):
+
+        self.buffer = buffer
+        self.filename = filename
+        self.reduced_decode = JPEG_REDUCED_DECODE if reduced_decode is None else reduced_decode
+        self.format, self.stored_size, self.orientation = read_header(buffer)
+        self.image = None
+        self.scale = None
+        self.variants = {}
+        self.required = set()
+        self.decode_count = 0
+        self.lock = threading.RLock()
+
+    def require(self, size=None, antialias=False, oriented=True):
+        """
+        Declare a variant that will be needed (computed with the first decode).
+
+        Parameters
+        ----------
+        size : tuple of int, optional
+            The (width, height) of the variant, None for the full resolution.
+        antialias : bool
+            See `resize_image`.
+        oriented : bool
+            Apply the EXIF orientation (as `cv2.IMREAD_COLOR` does).
+        """
+
+        with self.lock:
+            self.required.add((tuple(size) if size is not None else None, antialias, oriented))
+
+    def __covers(self, key, scale):
+        """Check if the image decoded at 1/scale is large enough for a variant"""
+
+        size, _, oriented = key
+        if scale == 1:
+            return True
+        if size is None or self.stored_size is None:
+            return False
+
+        # (the variant size in the stored orientation)
+        width, height = (size[1], size[0]) if oriented and self.orientation >= 5 else size
+        return (
+            math.ceil(self.stored_size[0] / scale) >= width * JPEG_REDUCED_DECODE_MIN_RATIO
+            and math.ceil(self.stored_size[1] / scale) >= height * JPEG_REDUCED_DECODE_MIN_RATIO
+        )
+
+    def decode_scale(self, keys):
+        """Return the cheapest decode scale (1, 2, 4 or 8) covering the given variants"""
+
+        if not self.reduced_decode or self.format != "JPEG":
+            return 1
+
+        for scale in (8, 4, 2):
+            if all(self.__covers(key, scale) for key in keys):
+                return scale
+
+        return 1
+
+    def __decode(self, key=None):
+        # the caller holds the lock
+
+        needed = self.required | ({key} if key is not None else set())
+        scale = self.decode_scale(needed)
+
+        with stage("decode"):
+            image = cv2.imdecode(self.buffer, REDUCED_DECODE_FLAGS[scale] | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            raise ValueError(f"Cannot decode the image {self.filename}")
+
+        self.decode_count += 1
+        if self.decode_count > 1:
+            logger.debug("decode_image_again", file=self.filename, scale=scale)
+
+        if scale == 1 or self.stored_size is None:
+            self.stored_size = (image.shape[1], image.shape[0])
+
+        self.image = image
+        self.scale = scale
+
+        # -- Compute the declared variants and keep the full resolution image only if it is needed
+        for required_key in self.required:
+            if self.__covers(required_key, scale):
+                self.__variant(*required_key)
+
+        if not any(size is None for size, _, _ in self.required):
+            self.image = None
+
+        return image
+
+    def __orient(self, img):
+
+        for transform in ORIENTATION_TRANSFORMS[self.orientation]:
+            img = transform(img)
+        return img
+
+    def __variant(self, size, antialias, oriented):
+        # the caller holds the lock
+
+        key = (size, antialias, oriented)
+        if key in self.variants:
+            return self.variants[key]
+
+        # decoded again if the image was released or decoded at a too small scale
+        if self.image is not None and self.__covers(key, self.scale):
+            img = self.image
+        else:
+            img = self.__decode(key)
+
+        if size is None:
+            variant = self.__orient(img) if oriented else img
+        elif oriented and self.orientation >= 5:
+            # transposed orientation: resize the stored image to the transposed size, then orient it
+            variant = self.__orient(resize_image(img, (size[1], size[0]), antialias))
+        else:
+            variant = resize_image(img, size, antialias)
+            variant = self.__orient(variant) if oriented else variant
+
+        self.variants[key] = variant
+        return variant
+
+    def full(self, oriented=True):
+        """Return the full resolution image (BGR uint8)"""
+
+        with self.lock:
+            return self.__variant(None, False, oriented)
+
+    def resized(self, size, antialias=False, oriented=True):
+        """
+        Return the image resized to `size` (BGR uint8, see `resize_image`).
+
+        Parameters
+        ----------
+        size : tuple of int
+            The (width, height) of the resized image.
+        antialias : bool
+            See `resize_image`.
+        oriented : bool
+            Apply the EXIF orientation (as `cv2.IMREAD_COLOR` does).
+
+        Returns
+        -------
+        ndarray
+            The resized image (shared: it must not be modified).
+        """
+
+        with self.lock:
+            return self.__variant(tuple(size), antialias, oriented)
+
+    def size(self, oriented=True):
+        """Return the (width, height) of the original image (to rescale the coordinates)"""
+
+        with self.lock:
+            if self.stored_size is None:
+                self.__decode()
+
+            width, height = self.stored_size
+            return (height, width) if oriented and self.orientation >= 5 else (width, height)
+
+    def release(self):
+        """Free the decoded image and its variants"""
+
+        with self.lock:
+            self.image = None
+            self.variants = {}
+
+
+def decoded_image(file):
+    """
+    Return the `DecodedImage` of a perenized file (created on first use).
+
+    Parameters
+    ----------
+    file : dict
+        The perenized file (see `perenize_buffers`).
+
+    Returns
+    -------
+    DecodedImage
+        The decoded image shared by the models.
+    """
+
+    if 'image' not in file:
+        file['image'] = DecodedImage(file['buffer'], file.get('filename'))
+
+    return file['image']
@@ -0,0 +1,154 @@
+import os
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from api_internals.LaserProfileTransformation import transform_frame
+
+TRANSFORMED_SHAPE = (300, 300) # shape of the frames returned by transform_frame
+
+# --- PROCESS POOL CONFIGURATION (opt-in)
+
+LASER_TRANSFORM_WORKERS = int(os.environ.get("LASER_TRANSFORM_WORKERS", 0))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_frame_pool():
+    """Return the shared process pool used to transform the laser frames (or None if it is disabled)"""
+
+    global _executor
+
+    if LASER_TRANSFORM_WORKERS <= 0:
+        return None
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                    max_workers=LASER_TRANSFORM_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    )
+
+        return _executor
+
+
+def _attach(name):
+    """Attach an existing shared memory block created (and unlinked) by the parent process"""
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError: # Python < 3.13: the spawned workers share the resource tracker of the parent process
+        return shared_memory.SharedMemory(name=name)
+
+
+def _transform_chunk(inputs_name, outputs_name, offsets, num_frames, start, stop, shapes=None):
+    """Decode and transform the frames [start, stop[ (run in a worker process)"""
+
+    inputs_shm = _attach(inputs_name)
+    outputs_shm = _attach(outputs_name)
+
+    try:
+        inputs = np.ndarray((offsets[-1],), dtype=np.uint8, buffer=inputs_shm.buf)
+        frames = np.ndarray((num_frames, *TRANSFORMED_SHAPE), dtype=np.uint8, buffer=outputs_shm.buf)
+        found = np.ndarray((num_frames,), dtype=np.uint8, buffer=outputs_shm.buf, offset=frames.nbytes)
+
+        for i in range(start, stop):
+            transformed = None
+
+            buffer = inputs[offsets[i]:offsets[i + 1]]
+            if shapes is not None: # (already decoded grayscale frames)
+                transformed = transform_frame(buffer.reshape(shapes[i]))
+            elif len(buffer) > 0:
+                image_bytes = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+                if image_bytes is not None:
+                    gray_frame = cv2.cvtColor(image_bytes, cv2.COLOR_BGR2GRAY)
+                    transformed = transform_frame(gray_frame)
+
+            found[i] = transformed is not None
+            if transformed is not None:
+                frames[i] = transformed
+
+        # the views must be released before closing the shared memory blocks
+        del inputs, frames, found
+
+    finally:
+        inputs_shm.close()
+        outputs_shm.close()
+
+    return stop - start
+
+
+def transform_frames(buffers, executor=None, num_chunks=None, decoded=False):
+    """
+    Decode and transform (see `transform_frame`) the encoded frames in a pool of worker processes.
+
+    The encoded frames are handed to the workers through a shared memory block (and the transformed frames
+    are written back to another one), so that no frame is pickled between the processes.
+
+    Parameters
+    ----------
+    buffers : list of ndarray
+        The encoded frames (uint8 buffers of the uploaded files), or the decoded grayscale frames if `decoded`.
+    executor : ProcessPoolExecutor, optional
+        The pool of worker processes (the shared pool if None).
+    num_chunks : int, optional
+        The number of tasks the frames are split into (4 per worker if None).
+    decoded : bool
+        The frames are already decoded (2D uint8 grayscale arrays, such as the frames of a video).
+
+    Returns
+    -------
+    list
+        The transformed frames (or None if the laser profile couldn't be extracted), in the order of `buffers`.
+    """
+
+    if executor is None:
+        executor = get_frame_pool()
+
+    num_frames = len(buffers)
+    if num_frames == 0:
+        return []
+
+    if num_chunks is None:
+        num_chunks = 4 * executor._max_workers
+    num_chunks = max(1, min(num_chunks, num_frames))
+
+    shapes = [x.shape for x in buffers] if decoded else None
+    if decoded:
+        buffers = [np.ascontiguousarray(x).reshape(-1) for x in buffers]
+
+    offsets = np.concatenate([[0], np.cumsum([len(x) for x in buffers])]).tolist()
+    inputs_shm = shared_memory.SharedMemory(create=True, size=max(1, offsets[-1]))
+    outputs_shm = shared_memory.SharedMemory(create=True, size=num_frames * (TRANSFORMED_SHAPE[0] * TRANSFORMED_SHAPE[1] + 1))
+
+    try:
+        inputs = np.ndarray((offsets[-1],), dtype=np.uint8, buffer=inputs_shm.buf)
+        for i, buffer in enumerate(buffers):
+            inputs[offsets[i]:offsets[i + 1]] = buffer
+        del inputs
+
+        bounds = np.linspace(0, num_frames, num_chunks + 1).astype(int)
+        futures = [
+            executor.submit(_transform_chunk, inputs_shm.name, outputs_shm.name, offsets, num_frames, start, stop, shapes)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+        ]
+        for future in futures:
+            future.result()
+
+        frames = np.ndarray((num_frames, *TRANSFORMED_SHAPE), dtype=np.uint8, buffer=outputs_shm.buf)
+        found = np.ndarray((num_frames,), dtype=np.uint8, buffer=outputs_shm.buf, offset=frames.nbytes)
+        transformed = [frames[i].copy() if found[i] else None for i in range(num_frames)]
+        del frames, found
+
+    finally:
+        inputs_shm.close()
+        inputs_shm.unlink()
+        outputs_shm.close()
+        outputs_shm.unlink()
+
+    return transformed
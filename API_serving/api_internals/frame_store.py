@@ -0,0 +1,78 @@
+import cv2
+
+from api_internals.LaserProfileTransformation import transform_frame
+from api_internals.frame_pool import get_frame_pool, transform_frames
+from api_internals.timing import stage
+
+
+class LaserFrameStore:
+    """
+    Per-request store of the laser frames: each frame is decoded and transformed (`transform_frame`) only once,
+    and the result (including the "no profile found" None outcome) is shared by all the laser models.
+
+    When the process pool is enabled (LASER_TRANSFORM_WORKERS > 0), the frames are transformed by chunks
+    in the worker processes instead of the request thread.
+
+    Parameters
+    ----------
+    filtered_files : list of dict
+        The perenized files (see `perenize_buffers`).
+    chunk_size : int
+        The number of frames transformed at once by the process pool when a missing frame is requested.
+    """
+
+    def __init__(self, filtered_files, chunk_size=32):
+
+        self.files = filtered_files
+        self.transformed = {}
+        self.pool = get_frame_pool()
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.files)
+
+    def filename(self, index):
+        return self.files[index]['filename']
+
+    def get(self, index):
+        """
+        Return the transformed (300x300 grayscale) frame of the given index,
+        or None if the laser profile couldn't be extracted from the frame.
+        """
+
+        if index not in self.transformed:
+            if self.pool is not None:
+                self.prefetch(range(index, min(index + self.chunk_size, len(self.files))))
+            else:
+                with stage("decode"):
+                    self.transformed[index] = self.__transform(self.files[index])
+
+        return self.transformed[index]
+
+    def prefetch(self, indexes=None):
+        """Transform the given frames (all the frames if None) at once in the process pool (if it is enabled)"""
+
+        if self.pool is None:
+            return
+
+        if indexes is None:
+            indexes = range(len(self.files))
+
+        indexes = [x for x in indexes if x not in self.transformed]
+        with stage("decode", count=len(indexes)):
+            transformed = transform_frames([self.files[x]['buffer'] for x in indexes], self.pool)
+        self.transformed.update(zip(indexes, transformed))
+
+    def release(self, index):
+        """Forget a transformed frame that won't be used anymore"""
+
+        self.transformed.pop(index, None)
+
+    def __transform(self, file):
+
+        image_bytes = cv2.imdecode(file['buffer'], cv2.IMREAD_COLOR)
+        if image_bytes is None:
+            return None
+
+        gray_frame = cv2.cvtColor(image_bytes, cv2.COLOR_BGR2GRAY)
+        return transform_frame(gray_frame)
@@ -0,0 +1,236 @@
+import io
+import os
+import mmap
+import tempfile
+import threading
+
+import numpy as np
+from flask import Request
+
+# --- UPLOAD SPOOLING CONFIGURATION
+
+# the files of the requests larger than this are spooled to disk (the smaller ones are kept in memory)
+UPLOAD_SPOOL_THRESHOLD_MB = float(os.environ.get("UPLOAD_SPOOL_THRESHOLD_MB", 1))
+
+# folder of the spool files (the system temporary folder if not set)
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+
+
+class UploadSpool:
+    """
+    A temporary file holding all the uploaded files of a request back to back (one region per file).
+
+    Once the request is parsed, the spool is memory-mapped (read-only) and the uploaded files are handed to
+    the models as views of the mapping: they are neither copied in memory nor read through Python file objects,
+    and a request only uses one file descriptor however many files it contains.
+    The data remains available as long as a view references the mapping (even after the request is closed).
+    """
+
+    def __init__(self, spool_dir=UPLOAD_SPOOL_DIR):
+
+        self.file = tempfile.TemporaryFile(dir=spool_dir)
+        self.size = 0
+        self.mmap = None
+        self.current_region = None
+        self.lock = threading.Lock()
+
+    def new_region(self):
+        """Return the writable stream of the next uploaded file (starting at the end of the spool)"""
+
+        with self.lock:
+            self.current_region = SpoolRegion(self, self.size)
+            return self.current_region
+
+    def write_at(self, region, position, data):
+
+        with self.lock:
+            # the uploaded files are written one after the other, only the last one can grow
+            if region is not self.current_region and position + len(data) > region.length:
+                raise OSError("Only the last uploaded file of the spool can be extended")
+
+            written = os.pwrite(self.file.fileno(), data, region.offset + position)
+            self.size = max(self.size, region.offset + position + written)
+            return written
+
+    def read_at(self, region, position, size):
+        return os.pread(self.file.fileno(), size, region.offset + position)
+
+    def view(self, region):
+        """Return the content of a region as a read-only uint8 array (view of the memory-mapped spool)"""
+
+        if region.length == 0:
+            return np.empty(0, dtype=np.uint8)
+
+        with self.lock:
+            # mapped once the request is parsed (mapped again if the spool grew since)
+            if self.mmap is None or len(self.mmap) < region.offset + region.length:
+                self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            return np.frombuffer(self.mmap, dtype=np.uint8, count=region.length, offset=region.offset)
+
+    def close(self):
+        # the views keep the mapping (and the data) alive
+        self.file.close()
+
+
+class SpoolRegion(io.RawIOBase):
+    """The file-like stream of an uploaded file stored in an `UploadSpool` (used as the werkzeug upload container)"""
+
+    def __init__(self, spool, offset):
+
+        super().__init__()
+        self.spool = spool
+        self.offset = offset
+        self.length = 0
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+
+        data = self.spool.read_at(self, self.position, max(0, min(len(buffer), self.length - self.position)))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def write(self, data):
+
+        written = self.spool.write_at(self, self.position, data)
+        self.position += written
+        self.length = max(self.length, self.position)
+        return written
+
+    def seek(self, position, whence=io.SEEK_SET):
+
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.length
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self.position = position
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only file-like object over a buffer (without copying it, unlike io.BytesIO)"""
+
+    def __init__(self, buffer):
+
+        super().__init__()
+        self.buffer = memoryview(buffer).cast("B")
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+
+        data = self.buffer[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, position, whence=io.SEEK_SET):
+
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += len(self.buffer)
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self.position = position
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def open_buffer(buffer):
+    """
+    Return a read-only file object over an ingested buffer (e.g. for PIL `Image.open`) without copying it.
+
+    Parameters
+    ----------
+    buffer : ndarray
+        The buffer of an ingested file (see `ingest_file`).
+
+    Returns
+    -------
+    BufferedReader
+        The file object.
+    """
+
+    return io.BufferedReader(BufferReader(buffer))
+
+
+def ingest_file(f):
+    """
+    Return the content of an uploaded file as a read-only uint8 array, avoiding copies when possible.
+
+    - the files spooled to disk (see `IngestionRequest`) are returned as views of the memory-mapped spool,
+    - the files kept in memory by werkzeug (io.BytesIO) share its buffer,
+    - the other streams are read.
+
+    Parameters
+    ----------
+    f : FileStorage or file object
+        The uploaded file.
+
+    Returns
+    -------
+    ndarray
+        The file content (that `cv2.imdecode` can decode directly).
+    """
+
+    stream = getattr(f, "stream", f)
+
+    if isinstance(stream, SpoolRegion):
+        return stream.spool.view(stream)
+
+    if isinstance(stream, io.BytesIO):
+        return np.frombuffer(stream.getvalue(), dtype=np.uint8)
+
+    return np.frombuffer(f.read(), dtype=np.uint8)
+
+
+class IngestionRequest(Request):
+    """
+    Flask request storing the uploaded files of the large requests (above UPLOAD_SPOOL_THRESHOLD_MB)
+    in a single spool file instead of keeping them in memory (or in one temporary file per uploaded file).
+    """
+
+    upload_spool = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_THRESHOLD_MB * 1024 * 1024:
+            return io.BytesIO()
+
+        if self.upload_spool is None:
+            self.upload_spool = UploadSpool()
+
+        return self.upload_spool.new_region()
+
+    def close(self):
+
+        super().close()
+        if self.upload_spool is not None:
+            self.upload_spool.close()
@@ -0,0 +1,149 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TooManyJobsError(RuntimeError):
+    """Raised when a job is submitted while the maximum number of pending jobs is reached"""
+
+
+class Job:
+    """
+    The state of an asynchronous prediction job.
+
+    The job function reports its progress with `set_progress` and its outcome is stored in `result` (or `error`).
+    """
+
+    def __init__(self, frames_total):
+
+        self.job_id = uuid.uuid4().hex
+        self.status = "queued"
+        self.stage = None
+        self.frames_total = frames_total
+        self.frames_processed = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    def set_progress(self, stage, frames_processed):
+        with self.lock:
+            self.stage = stage
+            self.frames_processed = frames_processed
+
+    def is_finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "stage": self.stage,
+                "frames_processed": self.frames_processed,
+                "frames_total": self.frames_total,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "error_msg": self.error,
+            }
+
+
+class JobManager:
+    """
+    Run the jobs in a local pool of worker threads and keep their state (and results) for `ttl` seconds once finished.
+
+    The jobs (and their inputs) are kept in the memory of the process: a job is only known by the process (the
+    gunicorn worker) it was submitted to.
+
+    Parameters
+    ----------
+    max_workers : int
+        The number of jobs that can run simultaneously.
+    ttl : float
+        The number of seconds a finished job (and its result) is kept.
+    max_pending : int
+        The maximum number of pending (queued or running) jobs, 0 for no limit.
+    """
+
+    def __init__(self, max_workers=2, ttl=3600, max_pending=16):
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, frames_total, *args, **kwargs):
+        """
+        Submit a new job.
+
+        Parameters
+        ----------
+        fn : callable
+            The job function, called as `fn(job, *args, **kwargs)` and returning the job result.
+        frames_total : int
+            The number of frames to process (used to report the progress).
+
+        Returns
+        -------
+        Job
+            The submitted job.
+
+        Raises
+        ------
+        TooManyJobsError
+            If `max_pending` jobs are already pending.
+        """
+
+        self.cleanup()
+
+        job = Job(frames_total)
+        with self.lock:
+            if self.max_pending and self.count_pending() >= self.max_pending:
+                raise TooManyJobsError(f"{self.max_pending} jobs are already pending, retry later.")
+            self.jobs[job.job_id] = job
+
+        self.executor.submit(self.__run, job, fn, *args, **kwargs)
+        return job
+
+    def __run(self, job, fn, *args, **kwargs):
+
+        job.status = "running"
+        job.started_at = time.time()
+
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+
+        job.finished_at = time.time()
+
+    def count_pending(self):
+        """Return the number of pending (queued or running) jobs (to call with the lock held)"""
+        return sum(not job.is_finished() for job in self.jobs.values())
+
+    def get(self, job_id):
+        """Return the job with the given id (or None if it doesn't exist or expired)"""
+
+        self.cleanup()
+
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cleanup(self):
+        """Forget the jobs finished for more than `ttl` seconds"""
+
+        now = time.time()
+        with self.lock:
+            expired = [
+                job_id for job_id, job in self.jobs.items()
+                if job.is_finished() and now - job.finished_at > self.ttl
+            ]
+            for job_id in expired:
+                del self.jobs[job_id]
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+# --- LOGGING CONFIGURATION
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# "text" (event key=value...) or "json" (one JSON object per line)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+# number of records waiting to be written: the records are dropped (and counted) rather than blocking the requests
+LOG_QUEUE_MAX_RECORDS = int(os.environ.get("LOG_QUEUE_MAX_RECORDS", 10000))
+
+# fraction of the request and result payloads logged (0 disables the payload logging)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+
+# maximum number of characters of a logged payload (the rest is truncated)
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 2000))
+
+LOGGER_NAMESPACE = "reachbots"
+
+# the attributes of a LogRecord that aren't fields given to the logger
+_RESERVED_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    Logger of an event name and its fields, given as keyword arguments:
+    `logger.info("model_loaded", model=model_id, load_time=2.1)`.
+    """
+
+    def process(self, msg, kwargs):
+
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _RESERVED_KWARGS}
+        kwargs["extra"] = dict(kwargs.get("extra") or {}, fields=fields)
+        return msg, kwargs
+
+
+class StructuredFormatter(logging.Formatter):
+    """Format the records as "time level logger event key=value..." lines, or as JSON objects"""
+
+    def __init__(self, json_format=False):
+
+        super().__init__()
+        self.json_format = json_format
+
+    def format(self, record):
+
+        fields = getattr(record, "fields", {})
+
+        if self.json_format:
+            entry = {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "event": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_text:
+                entry["exception"] = record.exc_text
+            return json.dumps(entry, default=str)
+
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue the records for the writer thread (`QueueListener`) without formatting them: the request threads
+    never wait for the I/O. The records are dropped when the queue is full (the number of dropped records
+    is logged once the queue has room again).
+    """
+
+    def __init__(self, log_queue):
+
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+
+        # (only the message and the traceback are rendered in the calling thread, the fields are formatted by the writer)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+
+        try:
+            if self.dropped > 0:
+                dropped = logging.makeLogRecord({
+                    "name": record.name, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": "log_records_dropped", "fields": {"count": self.dropped},
+                })
+                self.queue.put_nowait(dropped)
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_settings = None # the arguments of the last `setup_logging` call
+_lock = threading.Lock()
+
+
+def get_logger(name):
+    """
+    Return the structured logger of a module.
+
+    Parameters
+    ----------
+    name : str
+        The module name (`__name__`), the package prefix is dropped.
+
+    Returns
+    -------
+    StructuredLogger
+        The logger, its records are written by the handler installed by `setup_logging`.
+    """
+
+    return StructuredLogger(logging.getLogger(f"{LOGGER_NAMESPACE}.{name.rsplit('.', 1)[-1]}"), {})
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    """
+    Install the queue-backed handler of the loggers returned by `get_logger`: the records are queued by the
+    request threads and written to `stream` (stdout by default) by a background thread.
+
+    Calling it again replaces the previous handler (the queued records are written first).
+
+    Parameters
+    ----------
+    level : str
+        The minimum level of the written records (DEBUG, INFO, WARNING, ERROR).
+    log_format : str
+        "text" or "json".
+    stream : file, optional
+        The stream the records are written to.
+    """
+
+    global _listener, _settings
+
+    with _lock:
+        logger = logging.getLogger(LOGGER_NAMESPACE)
+
+        if _listener is not None:
+            _listener.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        _settings = (level, log_format, stream)
+
+        writer = logging.StreamHandler(stream if stream is not None else sys.stdout)
+        writer.setFormatter(StructuredFormatter(json_format=log_format == "json"))
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX_RECORDS)
+        _listener = logging.handlers.QueueListener(log_queue, writer)
+        _listener.start()
+
+        logger.addHandler(DroppingQueueHandler(log_queue))
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+def flush_logging():
+    """Write the queued records and stop the writer thread (at exit, or before replacing the stream)"""
+
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _restart_after_fork():
+    """The writer thread doesn't survive a fork: start a new one (and a new queue) in the child process"""
+
+    global _listener, _lock
+
+    _lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        setup_logging(*_settings)
+
+
+atexit.register(flush_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def log_payload(logger, event, payload, **fields):
+    """
+    Log a sample of the request or result payloads (LOG_PAYLOAD_SAMPLE_RATE), serialized as JSON and truncated to
+    LOG_PAYLOAD_MAX_CHARS characters. The payload is only serialized when it is logged.
+
+    Parameters
+    ----------
+    logger : StructuredLogger
+        The logger.
+    event : str
+        The event name.
+    payload : object
+        The JSON-serializable payload.
+    **fields
+        The other fields of the record.
+    """
+
+    if LOG_PAYLOAD_SAMPLE_RATE <= 0 or not logger.isEnabledFor(logging.INFO):
+        return
+    if LOG_PAYLOAD_SAMPLE_RATE < 1 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+
+    # (the payload is serialized incrementally: the serialization of a large payload stops at the size cap)
+    chunks, length = [], 0
+    for chunk in json.JSONEncoder(default=str).iterencode(payload):
+        chunks.append(chunk)
+        length += len(chunk)
+        if length > LOG_PAYLOAD_MAX_CHARS:
+            break
+
+    text = "".join(chunks)
+    if length > LOG_PAYLOAD_MAX_CHARS:
+        text = text[:LOG_PAYLOAD_MAX_CHARS] + "...(truncated)"
+
+    logger.info(event, payload=text, **fields)
@@ -0,0 +1,294 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from api_internals.timing import collect_timings
+from api_internals.batching import get_batching_stats
+from api_internals.result_cache import result_cache
+
+# --- METRICS CONFIGURATION
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+METRICS_LATENCY_BUCKETS = [float(x) for x in os.environ.get(
+    "METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+).split(",")]
+
+IMAGES_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+METRICS_PREFIX = "reachbots_"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A labelled metric family (the values of each combination of labels), rendered in the Prometheus text format.
+
+    Parameters
+    ----------
+    name : str
+        The metric name (prefixed with METRICS_PREFIX).
+    documentation : str
+        The HELP text.
+    labelnames : tuple of str
+        The names of the labels, given as keyword arguments when updating the metric.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"The {self.name} metric expects the labels {self.labelnames}, got {tuple(labels)}")
+
+        return tuple(str(labels[x]) for x in self.labelnames)
+
+    def render(self):
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines += self.render_samples(list(zip(self.labelnames, key)), value)
+
+        return lines
+
+    def render_samples(self, labels, value):
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRICS_LATENCY_BUCKETS):
+
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+
+            entry = self.values[key]
+            entry["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render_samples(self, labels, value):
+
+        lines = []
+        cumulated = 0
+        for bound, count in zip(self.buckets + [float("inf")], value["buckets"]):
+            cumulated += count
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {cumulated}")
+
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {value['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of this worker, and the collectors of the metrics read from the serving components when scraped
+    (model load times, result cache and micro-batching counters...).
+    """
+
+    def __init__(self):
+
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """Register a callable returning metrics (Metric instances filled when called) at each scrape"""
+
+        self.collectors.append(collector)
+
+    def render(self):
+        """Return all the metrics in the Prometheus text exposition format"""
+
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            metrics += collector()
+
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+requests_total = metrics_registry.register(Counter(
+    "requests_total", "Number of prediction requests.", ("endpoint", "pipeline", "status")))
+requests_in_flight = metrics_registry.register(Gauge(
+    "requests_in_flight", "Number of prediction requests being processed.", ("pipeline",)))
+request_duration = metrics_registry.register(Histogram(
+    "request_duration_seconds", "Duration of the prediction requests.", ("pipeline",)))
+request_images = metrics_registry.register(Histogram(
+    "request_images", "Number of images (or frames) per prediction request.", ("pipeline",), IMAGES_BUCKETS))
+stage_duration = metrics_registry.register(Histogram(
+    "stage_duration_seconds", "Time spent in each stage (decode, preprocess, inference, formatting) per request and model "
+    "(the decode stage is shared by the models: empty model label).", ("pipeline", "model", "stage")))
+stage_images = metrics_registry.register(Counter(
+    "stage_images_total", "Number of images (or frames, or windows) processed by each stage.", ("pipeline", "model", "stage")))
+
+
+@contextmanager
+def track_request(endpoint, pipeline, num_images):
+    """
+    Count a prediction request and time it and its stages (see `api_internals.timing`).
+
+    The request is counted as an error if an exception is raised in the block.
+
+    Parameters
+    ----------
+    endpoint : str
+        The name of the endpoint.
+    pipeline : str
+        The pipeline ("photo" or "laser").
+    num_images : int
+        The number of uploaded images (or frames).
+
+    Yields
+    ------
+    RequestTimings
+        The timings of the stages of the request.
+    """
+
+    status = "error"
+    requests_in_flight.inc(pipeline=pipeline)
+    start_time = time.perf_counter()
+
+    try:
+        with collect_timings() as timings:
+            yield timings
+        status = "ok"
+    finally:
+        requests_in_flight.dec(pipeline=pipeline)
+        requests_total.inc(endpoint=endpoint, pipeline=pipeline, status=status)
+        request_duration.observe(time.perf_counter() - start_time, pipeline=pipeline)
+        request_images.observe(num_images, pipeline=pipeline)
+
+        for (stage_name, model), x in timings.stages.items():
+            stage_duration.observe(x["time"], pipeline=pipeline, model=model or "", stage=stage_name)
+            stage_images.inc(x["count"], pipeline=pipeline, model=model or "", stage=stage_name)
+
+
+def serving_collector(selectors, registry, warmup=None):
+    """
+    Return a collector of the state of the serving components (see `MetricsRegistry.register_collector`).
+
+    Parameters
+    ----------
+    selectors : list of ModelSelector
+        The selectors of the selectable models (photo, laser).
+    registry : ModelRegistry
+        The registry of the shared models.
+    warmup : ModelWarmup, optional
+        The warm-up of the models (readiness).
+    """
+
+    def collect():
+
+        loaded = Gauge("model_loaded", "1 if the model is loaded in this worker.", ("model",))
+        load_time = Gauge("model_load_seconds", "Time taken to load the model (last load).", ("model",))
+        for selector in selectors:
+            for model_id in selector.models_def:
+                loaded.set(int(model_id in selector.models), model=model_id)
+            for model_id, duration in selector.load_times.items():
+                load_time.set(duration, model=model_id)
+
+        for model_id in registry.loaders:
+            loaded.set(int(registry.is_loaded(model_id)), model=model_id)
+        for model_id, duration in registry.load_times.items():
+            load_time.set(duration, model=model_id)
+
+        cache_stats = result_cache.get_stats()
+        cache_lookups = Counter("result_cache_lookups_total", "Result cache lookups per outcome (one per image and model).", ("result",))
+        cache_lookups.inc(cache_stats["hits"], result="hit")
+        cache_lookups.inc(cache_stats["disk_hits"], result="disk_hit")
+        cache_lookups.inc(cache_stats["misses"], result="miss")
+        cache_entries = Gauge("result_cache_entries", "Number of results in the memory cache.")
+        cache_entries.set(cache_stats["entries"])
+
+        batches = Counter("batches_total", "Number of model runs of the micro-batcher.", ("model",))
+        batch_items = Counter("batch_items_total", "Number of inputs run by the micro-batcher.", ("model",))
+        for model, stats in get_batching_stats().items():
+            batches.inc(stats["num_batches"], model=model)
+            batch_items.inc(sum(size * count for size, count in stats["batch_size_histogram"].items()), model=model)
+
+        metrics = [loaded, load_time, cache_lookups, cache_entries, batches, batch_items]
+
+        if warmup is not None:
+            ready = Gauge("ready", "1 once the models listed in WARMUP_MODELS are loaded and warmed up.")
+            ready.set(int(warmup.is_ready()))
+            metrics.append(ready)
+
+        return metrics
+
+    return collect
@@ -0,0 +1,66 @@
+import importlib
+import threading
+
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- MODEL CLASSES REGISTRY
+
+# The `class` of a models.json entry -> the module defining it.
+# The modules import heavy frameworks (ultralytics/torch, sahi, openvino, anomalib...), so they are only
+# imported when a model of one of their classes is loaded for the first time.
+MODEL_CLASSES = {
+    "BinaryClassifier": "api_internals.config_model_BINARY",
+    "MultiLabel_MobileNet": "api_internals.config_model_MULTILABEL_MobileNet",
+    "MultiLabel_YOLOv8_ONNX": "api_internals.config_model_MULTILABEL_YOLOv8_ONNX",
+    "MultiLabel_YOLOv8_SAHI": "api_internals.config_model_MULTILABEL_YOLOv8_SAHI",
+    "MultiLabel_YOLOv8_Standalone": "api_internals.config_model_MULTILABEL_YOLOv8_Standalone",
+    "Laser_Multiclass_MobileNet": "api_internals.config_model_laser_MULTICLASS_MobileNet",
+    "LaserBinaryClassifier": "api_internals.config_model_laser_BINARY",
+}
+
+_loaded_classes = {}
+_lock = threading.Lock()
+
+
+def get_model_class(class_name):
+    """
+    Return a model class from its name, importing its module on first use.
+
+    Parameters
+    ----------
+    class_name : str
+        The name of the class (the `class` entry of a model in models.json).
+
+    Returns
+    -------
+    type
+        The model class.
+
+    Raises
+    ------
+    ValueError
+        If the class is not registered in MODEL_CLASSES.
+    """
+
+    model_class = _loaded_classes.get(class_name)
+    if model_class is not None:
+        return model_class
+
+    if class_name not in MODEL_CLASSES:
+        raise ValueError(f"Unknown model class '{class_name}' (expected one of {list(MODEL_CLASSES)})")
+
+    with _lock:
+        if class_name not in _loaded_classes:
+            module = importlib.import_module(MODEL_CLASSES[class_name])
+            _loaded_classes[class_name] = getattr(module, class_name)
+            logger.info("import_model_class", model_class=class_name, module=MODEL_CLASSES[class_name])
+
+        return _loaded_classes[class_name]
+
+
+def loaded_model_classes():
+    """Return the names of the model classes imported so far"""
+
+    return list(_loaded_classes)
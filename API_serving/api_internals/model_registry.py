@@ -0,0 +1,88 @@
+import time
+import threading
+
+
+class ModelRegistry:
+    """
+    Process-wide store of the models that are shared by every request.
+
+    Each model is registered with a loader (a callable without argument returning the model instance),
+    is loaded only once (on first use or eagerly with `preload`) and the same instance is then handed
+    out to all the following requests.
+    """
+
+    def __init__(self):
+
+        self.loaders = {}
+        self.models = {}
+        self.load_times = {}
+        self.lock = threading.Lock()
+
+    def register(self, model_id, loader):
+        """
+        Register the loader of a model.
+
+        Parameters
+        ----------
+        model_id : str
+            The identifier of the model (usually the model file name).
+        loader : callable
+            A callable without argument returning the loaded model.
+        """
+
+        with self.lock:
+            self.loaders[model_id] = loader
+
+    def get(self, model_id):
+        """
+        Return the shared instance of a model, loading it first if needed.
+
+        Parameters
+        ----------
+        model_id : str
+            The identifier of a registered model.
+
+        Returns
+        -------
+        object
+            The loaded model instance.
+        """
+
+        model = self.models.get(model_id)
+        if model is not None:
+            return model
+
+        with self.lock:
+            # another thread may have loaded it while we were waiting for the lock
+            if model_id not in self.models:
+
+                if model_id not in self.loaders:
+                    raise ValueError(f"The '{model_id}' model is not registered")
+
+                start_time = time.time()
+                self.models[model_id] = self.loaders[model_id]()
+                self.load_times[model_id] = time.time() - start_time
+
+            return self.models[model_id]
+
+    def preload(self, model_ids=None):
+        """
+        Eagerly load the registered models (all of them if `model_ids` is None).
+
+        Parameters
+        ----------
+        model_ids : list of str, optional
+            The identifiers of the models to load.
+        """
+
+        if model_ids is None:
+            model_ids = list(self.loaders.keys())
+
+        for model_id in model_ids:
+            self.get(model_id)
+
+    def is_loaded(self, model_id):
+        return model_id in self.models
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as rt
+
+from api_internals.result_cache import model_version
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- OPTIMIZED MODELS CACHE CONFIGURATION
+
+ONNX_OPTIMIZED_MODELS_DIR = os.environ.get("ONNX_OPTIMIZED_MODELS_DIR", "models/optimized")
+
+DEFAULT_PROVIDERS = [
+    # "TensorrtExecutionProvider",
+    # "CUDAExecutionProvider",
+    "CPUExecutionProvider",
+]
+
+EXECUTION_MODES = {
+    "sequential": rt.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": rt.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": rt.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": rt.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": rt.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# optimization level of the serialized graphs: the optimizations above it (ORT_ENABLE_ALL: NCHWc layout...) depend
+# on the CPU, so they are applied when the cached graph is loaded rather than baked into a file that can be shared
+SERIALIZED_OPTIMIZATION_LEVEL = rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+
+
+def make_session_options(session_config):
+    """
+    Build the ONNX Runtime session options from the `session` entry of a model in models.json.
+
+    Parameters
+    ----------
+    session_config : dict
+        The session settings, all optional:
+        - "intra_op_num_threads" / "inter_op_num_threads" (int, 0 lets ONNX Runtime decide),
+        - "execution_mode" ("sequential" or "parallel"),
+        - "graph_optimization_level" ("disable", "basic", "extended" or "all"),
+        - "enable_cpu_mem_arena" / "enable_mem_pattern" / "enable_mem_reuse" (bool),
+        - "config_entries" (dict of extra ONNX Runtime session configuration entries, e.g. "session.intra_op.allow_spinning").
+
+    Returns
+    -------
+    SessionOptions
+        The session options.
+
+    Raises
+    ------
+    ValueError
+        If a setting is unknown or has an invalid value.
+    """
+
+    options = rt.SessionOptions()
+
+    for key, value in session_config.items():
+
+        if key in ("intra_op_num_threads", "inter_op_num_threads"):
+            setattr(options, key, int(value))
+
+        elif key == "execution_mode":
+            if value not in EXECUTION_MODES:
+                raise ValueError(f"Invalid execution_mode '{value}' (expected one of {list(EXECUTION_MODES)})")
+            options.execution_mode = EXECUTION_MODES[value]
+
+        elif key == "graph_optimization_level":
+            if value not in GRAPH_OPTIMIZATION_LEVELS:
+                raise ValueError(f"Invalid graph_optimization_level '{value}' (expected one of {list(GRAPH_OPTIMIZATION_LEVELS)})")
+            options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[value]
+
+        elif key in ("enable_cpu_mem_arena", "enable_mem_pattern", "enable_mem_reuse"):
+            setattr(options, key, bool(value))
+
+        elif key == "config_entries":
+            for entry, entry_value in value.items():
+                options.add_session_config_entry(entry, str(entry_value))
+
+        elif key != "providers":
+            raise ValueError(f"Unknown ONNX Runtime session setting '{key}'")
+
+    return options
+
+
+def optimized_model_path(model_path, session_config, providers, cache_dir=ONNX_OPTIMIZED_MODELS_DIR):
+    """
+    Return the path of the cached optimized graph of a model.
+
+    The file name depends on the model version, the ONNX Runtime version, the providers, the session settings and
+    the optimization level of the serialized graph, so that changing any of them produces (and uses) a new optimized
+    graph. The serialized graphs don't depend on the hardware (see SERIALIZED_OPTIMIZATION_LEVEL).
+    """
+
+    key = json.dumps(
+        [model_version(model_path), rt.__version__, providers, session_config, int(SERIALIZED_OPTIMIZATION_LEVEL)],
+        sort_keys=True,
+    )
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    return Path(cache_dir).joinpath(f"{Path(model_path).stem}.{digest}.onnx")
+
+
+def create_session(model_path, session_config=None, cache_dir=ONNX_OPTIMIZED_MODELS_DIR):
+    """
+    Create the ONNX Runtime inference session of a model with the session settings of models.json.
+
+    On the first load the graph optimized by ONNX Runtime is serialized in `cache_dir`, and the following loads
+    use it directly (without optimizing the graph again) to reduce the cold start time. The graph is serialized
+    at most at the ORT_ENABLE_EXTENDED level (hardware independent), the hardware specific optimizations of
+    ORT_ENABLE_ALL being applied when it is loaded.
+
+    Parameters
+    ----------
+    model_path : str
+        The path of the ONNX model.
+    session_config : dict, optional
+        The `session` entry of the model in models.json (see `make_session_options`).
+        It may also define the "providers" list (CPUExecutionProvider only by default).
+    cache_dir : str, optional
+        The folder of the optimized graphs (no cache if empty).
+
+    Returns
+    -------
+    InferenceSession
+        The inference session.
+    """
+
+    session_config = dict(session_config or {})
+    providers = session_config.get("providers", DEFAULT_PROVIDERS)
+    options = make_session_options(session_config)
+
+    if not cache_dir or options.graph_optimization_level == rt.GraphOptimizationLevel.ORT_DISABLE_ALL:
+        return rt.InferenceSession(str(model_path), sess_options=options, providers=providers)
+
+    cached_path = optimized_model_path(model_path, session_config, providers, cache_dir)
+    level = options.graph_optimization_level
+    load_level = level if int(level) > int(SERIALIZED_OPTIMIZATION_LEVEL) else rt.GraphOptimizationLevel.ORT_DISABLE_ALL
+
+    # -- Reuse the already optimized graph
+    if cached_path.exists():
+        options.graph_optimization_level = load_level
+        try:
+            session = rt.InferenceSession(str(cached_path), sess_options=options, providers=providers)
+            logger.info("onnx_session_optimized_cache_hit", path=cached_path)
+            return session
+        except Exception as e:
+            logger.warning("onnx_session_optimized_cache_invalid", path=cached_path, error=e)
+            options = make_session_options(session_config)
+
+    # -- Optimize the graph and serialize it (if the cache folder is writable)
+    try:
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        writable = os.access(cached_path.parent, os.W_OK)
+    except OSError:
+        writable = False
+
+    if not writable:
+        logger.warning("onnx_session_optimized_cache_unavailable", path=cached_path.parent)
+        return rt.InferenceSession(str(model_path), sess_options=options, providers=providers)
+
+    # written to a temporary file first so that a partially written graph is never loaded
+    tmp_path = cached_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    options.optimized_model_filepath = str(tmp_path)
+    if load_level != rt.GraphOptimizationLevel.ORT_DISABLE_ALL:
+        options.graph_optimization_level = SERIALIZED_OPTIMIZATION_LEVEL
+    session = rt.InferenceSession(str(model_path), sess_options=options, providers=providers)
+
+    source_path = cached_path
+    try:
+        os.replace(tmp_path, cached_path)
+        logger.info("onnx_session_optimized_cache_write", path=cached_path)
+    except OSError as e:
+        logger.warning("onnx_session_optimized_cache_unavailable", path=cached_path, error=e)
+        tmp_path.unlink(missing_ok=True)
+        source_path = model_path
+
+    # -- Apply the hardware specific optimizations (to the serialized graph, or to the model if it wasn't saved)
+    if load_level != rt.GraphOptimizationLevel.ORT_DISABLE_ALL:
+        options = make_session_options(session_config)
+        session = rt.InferenceSession(str(source_path), sess_options=options, providers=providers)
+
+    return session
+
+
+ONNX_INPUT_TYPES = {
+    "tensor(float)": "float32",
+    "tensor(double)": "float64",
+    "tensor(float16)": "float16",
+    "tensor(uint8)": "uint8",
+    "tensor(int64)": "int64",
+}
+
+
+def dummy_inputs(session, batch_size=1):
+    """
+    Return zero filled inputs of the real input shapes of a session (used to warm the model up).
+
+    The dynamic dimensions are set to `batch_size` for the first (batch) dimension and to 1 otherwise.
+    """
+
+    inputs = {}
+    for model_input in session.get_inputs():
+        shape = [x if isinstance(x, int) else (batch_size if i == 0 else 1) for i, x in enumerate(model_input.shape)]
+        inputs[model_input.name] = np.zeros(shape, dtype=ONNX_INPUT_TYPES.get(model_input.type, "float32"))
+
+    return inputs
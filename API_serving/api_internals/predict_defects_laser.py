@@ -1,10 +1,55 @@
+import os
 import json
 import time
+from collections import deque
 
-from api_internals.config_model_laser_BINARY import LaserBinaryClassifier
+from api_internals.config_model_laser_MULTICLASS_MobileNet import WINDOW_SIZE
 from api_internals.utils import perenize_buffers, ModelSelector, make_gif
+from api_internals.model_classes import get_model_class
+from api_internals.model_registry import model_registry
+from api_internals.frame_store import LaserFrameStore
 
-laser_model_selector = ModelSelector(category='laser')
+LASER_BINARY_MODEL_ID = 'laser_binary_classifier.onnx'
+
+laser_model_selector = ModelSelector(
+        category='laser',
+        max_models=int(os.environ.get("LASER_MODELS_MAX_LOADED", 0)),
+        max_memory_mb=float(os.environ.get("LASER_MODELS_MAX_MEMORY_MB", 0)),
+        )
+model_registry.register(
+        LASER_BINARY_MODEL_ID,
+        lambda: get_model_class('LaserBinaryClassifier')(
+            f'models/{LASER_BINARY_MODEL_ID}',
+            'models/laser_binary_classifier_metadata.json'
+            )
+        )
+
+
+def _stage_progress(progress_callback, stage):
+    """Bind the stage name to the progress callback given to predict_defects_laser (if any)"""
+
+    if progress_callback is None:
+        return None
+
+    return lambda frames_processed: progress_callback(stage, frames_processed)
+
+
+def _cast_extra_info(extra_info):
+    """Cast the optional parameters of the laser pipeline to the expected format (or use the default values)"""
+
+    slide_step = extra_info['slide_step']
+    slide_step = int(slide_step) if slide_step else 3
+
+    min_defects = extra_info['min_defects']
+    min_defects = int(min_defects) if min_defects else 1
+
+    binary_threshold = extra_info['binary_threshold']
+    binary_threshold = float(binary_threshold) if binary_threshold else 0.5
+
+    multi_threshold = extra_info['multi_threshold']
+    multi_threshold = float(multi_threshold) if multi_threshold else 0.4
+
+    return slide_step, min_defects, binary_threshold, multi_threshold
 
 
 # --- MAIN FUNCTION
@@ -12,6 +57,8 @@ laser_model_selector = ModelSelector(category='laser')
 def predict_defects_laser(
     filtered_files: list,
     extra_info: dict,
+    progress_callback=None,
+    frame_store=None,
 ) -> list:
     """
     Predicts defects and their probability levels for given preprocessed files.
@@ -22,6 +69,12 @@ def predict_defects_laser(
         A list of the filtered files so that we can return the name of the original files.
     extra_info: dict
         A dictionary containing extra information useful for the prediction.
+    progress_callback: callable, optional
+        A function called as `progress_callback(stage, frames_processed)` while the frames are processed
+        (the stage being 'binary' then 'multiclass').
+    frame_store: LaserFrameStore, optional
+        The store of the already transformed frames of `filtered_files` (the frames of a video, see
+        api_internals.video), a store of the uploaded frames is created if None.
 
     Returns
     -------
@@ -42,43 +95,44 @@ def predict_defects_laser(
 
     # --- CAST EXTRA INFO TO THE EXPECTED FORMAT
 
-    slide_step = extra_info['slide_step']
-    slide_step = int(slide_step) if slide_step else 3
-
-    min_defects = extra_info['min_defects']
-    min_defects = int(min_defects) if min_defects else 1
-
-    binary_threshold = extra_info['binary_threshold']
-    binary_threshold = float(binary_threshold) if binary_threshold else 0.5
-
-    multi_threshold = extra_info['multi_threshold']
-    multi_threshold = float(multi_threshold) if multi_threshold else 0.4
+    slide_step, min_defects, binary_threshold, multi_threshold = _cast_extra_info(extra_info)
 
     # --- PERENIZE THE UPLOADED FILES SO THAT WE CAN APPLY SEVERAL MODELS
 
     images_bytes = perenize_buffers(filtered_files)
 
+    # --- DECODE AND TRANSFORM EACH FRAME ONCE FOR BOTH MODELS
+
+    if frame_store is None:
+        frame_store = LaserFrameStore(images_bytes)
+        frame_store.prefetch()
+
     # --- USE BINARY MODEL
 
-    bc = LaserBinaryClassifier(
-            'models/laser_binary_classifier.onnx',
-            'models/laser_binary_classifier_metadata.json'
-            )
+    bc = model_registry.get(LASER_BINARY_MODEL_ID)
 
-    results_binary, defect_indexes = bc.predict(images_bytes, pred_threshold=binary_threshold)
+    results_binary, defect_indexes = bc.predict(
+            images_bytes,
+            pred_threshold=binary_threshold,
+            progress_callback=_stage_progress(progress_callback, 'binary'),
+            frame_store=frame_store,
+    )
     used_models = [bc.model_name]
 
 
     # --- LOAD THE SELECTED MULTICLASS MODEL AND INFER
 
-    used_models.append(extra_info['selected_model'])
-    laser_model_selector.set_current_model_id(extra_info["selected_model"])
-    results_multi = laser_model_selector.predict_current(
+    selected_model = laser_model_selector.resolve_model_id(extra_info['selected_model'])
+    used_models.append(selected_model)
+    results_multi = laser_model_selector.predict(
+            selected_model,
             images_bytes,
             defect_indexes,
             slide_step = slide_step,
             defects_threshold = min_defects,
             pred_threshold = multi_threshold,
+            progress_callback = _stage_progress(progress_callback, 'multiclass'),
+            frame_store = frame_store,
     )
 
     for i, result_multi in enumerate(results_multi):
@@ -98,3 +152,119 @@ def predict_defects_laser(
 
     inference_time = time.time() - start_time
     return results_json, inference_time, used_models
+
+
+def iter_predict_defects_laser(
+    filtered_files: list,
+    extra_info: dict,
+):
+    """
+    Predicts defects like `predict_defects_laser` but yields each sliding window result as soon as it is computed.
+
+    The frames are scored one by one by the binary classifier, and each sliding window is scored by the multiclass
+    model as soon as the binary results of its frames are available, so that the first results are available
+    long before the end of the sequence (and the full results list is never held in memory).
+
+    Parameters
+    ----------
+    filtered_files: list
+        A list of the filtered files (or their perenized buffers).
+    extra_info: dict
+        A dictionary containing extra information useful for the prediction.
+
+    Yields
+    ------
+    dict
+        A node (same format as the items returned by `predict_defects_laser`) for each sliding window,
+        and finally a summary containing the used models, the inference time and the number of windows.
+    """
+
+    start_time = time.time()
+
+    if len(filtered_files) < WINDOW_SIZE:
+        raise Exception("The Laser pipeline need batches with at least 10 images")
+
+    # --- CAST EXTRA INFO TO THE EXPECTED FORMAT
+
+    slide_step, min_defects, binary_threshold, multi_threshold = _cast_extra_info(extra_info)
+
+    # --- PERENIZE THE UPLOADED FILES SO THAT WE CAN APPLY SEVERAL MODELS
+
+    images_bytes = perenize_buffers(filtered_files)
+    frame_store = LaserFrameStore(images_bytes)
+
+    # --- LOAD THE MODELS
+
+    bc = model_registry.get(LASER_BINARY_MODEL_ID)
+    selected_model = laser_model_selector.resolve_model_id(extra_info['selected_model'])
+    multi_model = laser_model_selector.get_model(selected_model)
+    used_models = [bc.model_name, selected_model]
+
+    # -- The multiclass preprocessing is done lazily (once per frame) and forgotten once the windows moved past it
+    # (as the transformed frames, whether they were preprocessed or not)
+    preprocessed = {}
+    released = 0 # the frames before this index are released
+
+    def get_preprocessed(j):
+        if j not in preprocessed:
+            preprocessed[j] = multi_model.preprocess(frame_store.get(j))
+        return preprocessed[j]
+
+    # --- SCORE THE FRAMES AND EMIT EACH WINDOW AS SOON AS ITS FRAMES ARE SCORED
+
+    results_binary = []
+    window_starts = iter(multi_model.window_starts(len(images_bytes), slide_step))
+    window_start = next(window_starts, None)
+    pending_nodes = deque()
+    num_windows = 0
+
+    for result_binary in bc.iter_predict(images_bytes, pred_threshold=binary_threshold, frame_store=frame_store):
+        results_binary.append(result_binary)
+
+        while window_start is not None and window_start + WINDOW_SIZE <= len(results_binary):
+
+            num_defects = sum(x['has_defect'] for x in results_binary[window_start:window_start + WINDOW_SIZE])
+            result_multi = multi_model.predict_window(
+                    get_preprocessed,
+                    len(images_bytes),
+                    window_start,
+                    num_defects,
+                    defects_threshold = min_defects,
+                    pred_threshold = multi_threshold,
+            )
+            pending_nodes.append(result_multi)
+
+            window_start = next(window_starts, None)
+
+        # -- The windows only move forward: the frames before the next window won't be used anymore
+        release_end = len(results_binary) if window_start is None else min(window_start, len(results_binary))
+        for j in range(released, release_end):
+            preprocessed.pop(j, None)
+            frame_store.release(j)
+        released = max(released, release_end)
+
+        # -- A window may end after the frames scored so far (when some frames can't be used by the multiclass model)
+        while len(pending_nodes) > 0 and pending_nodes[0]['indexes'][-1] < len(results_binary):
+            yield _make_node(results_binary, pending_nodes.popleft())
+            num_windows += 1
+
+    while len(pending_nodes) > 0:
+        yield _make_node(results_binary, pending_nodes.popleft())
+        num_windows += 1
+
+    yield {
+        "defect_models": used_models,
+        "inference_time": time.time() - start_time,
+        "num_windows": num_windows,
+    }
+
+
+def _make_node(results_binary, result_multi):
+    """Gather the result of a sliding window along with the binary results of its frames"""
+
+    batch_index_l, *_, batch_index_r = result_multi['indexes']
+
+    return {
+        "binary_results": results_binary[batch_index_l:batch_index_r+1],
+        "multi_results": result_multi,
+    }
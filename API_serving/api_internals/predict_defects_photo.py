@@ -1,10 +1,25 @@
+import os
 import json
 import time
 
-from api_internals.config_model_BINARY import BinaryClassifier
-from api_internals.utils import perenize_buffers, ModelSelector
+from api_internals.model_classes import get_model_class
+from api_internals.utils import perenize_buffers, ModelSelector, get_session_config
+from api_internals.model_registry import model_registry
+from api_internals.decoded_image import decoded_image
 
-photo_model_selector = ModelSelector(category='photo')
+BINARY_MODEL_ID = os.environ.get("BINARY_MODEL_ID", 'binary_classifier.onnx')
+
+photo_model_selector = ModelSelector(
+        category='photo',
+        max_models=int(os.environ.get("PHOTO_MODELS_MAX_LOADED", 0)),
+        max_memory_mb=float(os.environ.get("PHOTO_MODELS_MAX_MEMORY_MB", 0)),
+        )
+model_registry.register(
+        BINARY_MODEL_ID,
+        lambda: get_model_class('BinaryClassifier')(
+            f'models/{BINARY_MODEL_ID}', session_config=get_session_config(BINARY_MODEL_ID)
+            )
+        )
 
 
 # --- MAIN FUNCTION
@@ -48,15 +63,29 @@ def predict_defects_photo(
 
     images_bytes = perenize_buffers(filtered_files)
 
+    # --- DECODE EACH IMAGE ONCE: THE MULTILABEL MODEL INPUT IS DERIVED FROM THE DECODE OF THE BINARY MODEL
+
+    selected_model = photo_model_selector.resolve_model_id(extra_info['selected_model'])
+    multi_input_size = photo_model_selector.get_input_size(selected_model)
+
+    for file in images_bytes:
+        decoded_image(file).require(multi_input_size)
+
     # --- USE BINARY MODEL
 
-    bc = BinaryClassifier('models/binary_classifier.onnx')
+    bc = model_registry.get(BINARY_MODEL_ID)
     results_binary, defect_indexes = bc.predict(images_bytes, pred_threshold=binary_threshold)
     used_models = [bc.model_name]
 
+    # -- the images without defect are not needed anymore
+    defect_indexes_set = set(defect_indexes)
+    for i, file in enumerate(images_bytes):
+        if i not in defect_indexes_set:
+            decoded_image(file).release()
+
     if len(defect_indexes) > 0 :
 
-        used_models.append(extra_info['selected_model'])
+        used_models.append(selected_model)
 
         # --- SELECT THE IMAGES CONTAINING DEFECT AS PER THE BINARY CLASSIFIER
 
@@ -64,8 +93,7 @@ def predict_defects_photo(
 
         # --- LOAD THE SELECTED MULTILLABEL MODEL AND INFER
 
-        photo_model_selector.set_current_model_id(extra_info["selected_model"])
-        results_multi = photo_model_selector.predict_current(sub_filtered_files, pred_threshold=multi_threshold)
+        results_multi = photo_model_selector.predict(selected_model, sub_filtered_files, pred_threshold=multi_threshold)
 
         for i, result_multi in enumerate(results_multi):
 
@@ -0,0 +1,152 @@
+import os
+import sys
+import uuid
+import tempfile
+import threading
+from pathlib import Path
+from collections import Counter
+
+# --- PROFILER CONFIGURATION
+
+# interval (in milliseconds) between two samples of the stack of the profiled request
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+
+# number of profiles kept (the oldest ones are deleted first)
+PROFILES_MAX_ENTRIES = int(os.environ.get("PROFILES_MAX_ENTRIES", 50))
+
+# folder of the profiles (shared by the workers of the host, so that any worker can return a profile)
+PROFILES_DIR = os.environ.get("PROFILES_DIR") or os.path.join(tempfile.gettempdir(), "reachbots_profiles")
+
+PROFILE_EXTENSION = ".folded"
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler of a single thread (the request thread): a background thread records the stack of the
+    profiled thread at a fixed interval, and the samples are counted per stack ("folded" stacks, the input format
+    of flamegraph.pl and speedscope).
+
+    The profiled code isn't instrumented: the overhead is the time taken by the sampling thread to walk the stack
+    (it holds the GIL meanwhile). The time spent in native code releasing the GIL (ONNX Runtime, OpenCV) is sampled
+    as the Python line waiting for it.
+
+    Parameters
+    ----------
+    thread_id : int, optional
+        The id of the profiled thread (the current thread if None).
+    interval : float
+        The interval between two samples, in milliseconds.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL_MS):
+
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval / 1000
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self.__run, name="request-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __run(self):
+
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+
+            self.samples[self.__stack(frame)] += 1
+
+    @staticmethod
+    def __stack(frame):
+        """Return the stack of a frame as "outermost;...;innermost" (each frame as "function (file:line)")"""
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+
+        return ";".join(reversed(stack))
+
+    def num_samples(self):
+        return sum(self.samples.values())
+
+    def folded(self):
+        """Return the samples in the folded stacks format (one "stack count" line per distinct stack)"""
+
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfileStore:
+    """
+    The profiles of the profiled requests, saved as files of a folder (at most `max_entries` files).
+
+    Parameters
+    ----------
+    folder : str
+        The folder of the profiles.
+    max_entries : int
+        The number of profiles kept (the oldest ones are deleted when a new profile is saved).
+    """
+
+    def __init__(self, folder=PROFILES_DIR, max_entries=PROFILES_MAX_ENTRIES):
+
+        self.folder = Path(folder)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def put(self, content):
+        """Save a profile and return its id"""
+
+        profile_id = uuid.uuid4().hex
+        self.folder.mkdir(parents=True, exist_ok=True)
+        (self.folder / (profile_id + PROFILE_EXTENSION)).write_text(content)
+
+        with self.lock:
+            self.__prune()
+
+        return profile_id
+
+    def get(self, profile_id):
+        """Return the content of a profile, None if unknown (or deleted)"""
+
+        # (the ids are hexadecimal uuids: no path can be built from them)
+        if len(profile_id) != 32 or any(x not in "0123456789abcdef" for x in profile_id):
+            return None
+
+        try:
+            return (self.folder / (profile_id + PROFILE_EXTENSION)).read_text()
+        except FileNotFoundError:
+            return None
+
+    def __prune(self):
+
+        paths = []
+        for path in self.folder.glob("*" + PROFILE_EXTENSION):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+
+        for _, path in sorted(paths)[:max(0, len(paths) - self.max_entries)]:
+            path.unlink(missing_ok=True)
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,259 @@
+import os
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResultCache:
+    """
+    Content-addressed cache of the raw model outputs (one numpy array per image).
+
+    The entries are keyed by (image content hash, model id, model version) and stored in memory in a LRU cache
+    bounded by `max_entries` and expiring after `ttl` seconds. An optional on-disk tier (`cache_dir`) keeps the
+    entries evicted from memory (and the entries of the previous runs) with the same TTL, bounded by `disk_max_mb`.
+
+    The folder of the on-disk tier may be shared by several workers: it is swept every `sweep_interval` seconds,
+    or as soon as the files written since the last sweep exceed the budget. The sweep deletes the expired files,
+    then the oldest ones until the folder fits in the budget.
+
+    Only the raw outputs are cached: the thresholds are applied afterwards by the models,
+    so changing a threshold still hits the cache.
+
+    The key doesn't include the session settings (models.json `session` options, execution providers): the
+    server cache is opt-in (RESULT_CACHE_MAX_ENTRIES) and must be cleared (restart, empty folder of the on-disk
+    tier) when they change.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of entries kept in memory (the cache is disabled if 0).
+    ttl : float
+        The number of seconds an entry remains valid.
+    cache_dir : str, optional
+        The folder of the on-disk tier (no on-disk tier if None).
+    disk_max_mb : float
+        The maximum size of the on-disk tier, in MB.
+    sweep_interval : float
+        The number of seconds between two sweeps of the on-disk tier.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, cache_dir=None, disk_max_mb=1024, sweep_interval=60):
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.disk_max_bytes = disk_max_mb * 1024 * 1024
+        self.sweep_interval = sweep_interval
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.disk_bytes = 0 # size of the on-disk tier at the last sweep, plus the files written since then
+        self.last_sweep = None
+        self.sweeping = False
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.sweep()
+
+    def is_enabled(self):
+        return self.max_entries > 0
+
+    def __disk_path(self, key):
+        name = hashlib.sha256("|".join(key).encode()).hexdigest()
+        return self.cache_dir.joinpath(f"{name}.npy")
+
+    def get(self, key):
+        """Return the cached raw output of the given key (or None)"""
+
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+
+        if self.cache_dir is not None:
+            path = self.__disk_path(key)
+            try:
+                created_at = path.stat().st_mtime
+                if now - created_at <= self.ttl:
+                    value = np.load(path, allow_pickle=False)
+                    with self.lock:
+                        self.disk_hits += 1
+                    self.put(key, value, write_disk=False)
+                    return value
+                path.unlink()
+            except (OSError, ValueError):
+                pass
+
+        with self.lock:
+            self.misses += 1
+
+        return None
+
+    def put(self, key, value, write_disk=True):
+        """Store the raw output (numpy array) of the given key"""
+
+        value = np.asarray(value)
+
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if self.cache_dir is not None and write_disk:
+            path = self.__disk_path(key)
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, value, allow_pickle=False)
+                size = f.tell()
+            os.replace(tmp_path, path)
+
+            with self.lock:
+                self.disk_bytes += size
+                must_sweep = not self.sweeping and (
+                    self.disk_bytes > self.disk_max_bytes or time.time() - self.last_sweep >= self.sweep_interval
+                )
+                if must_sweep:
+                    self.sweeping = True
+
+            if must_sweep:
+                self.sweep()
+
+    def sweep(self):
+        """Delete the expired files of the on-disk tier, then the oldest ones until it fits in `disk_max_mb`"""
+
+        now = time.time()
+        total = 0
+
+        try:
+            files = []
+            for path in self.cache_dir.iterdir():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+
+                # (an expired .tmp file was left by an interrupted write)
+                if now - stat.st_mtime > self.ttl:
+                    path.unlink(missing_ok=True)
+                elif path.suffix == ".npy":
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+            files.sort()
+            total = sum(x[1] for x in files)
+            for _, size, path in files:
+                if total <= self.disk_max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+        finally:
+            with self.lock:
+                self.disk_bytes = total
+                self.last_sweep = now
+                self.sweeping = False
+
+    def get_stats(self):
+
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.is_enabled(),
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "on_disk": self.cache_dir is not None,
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups > 0 else 0.0,
+            }
+
+
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 0)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 3600)),
+    cache_dir=os.environ.get("RESULT_CACHE_DIR"),
+    disk_max_mb=float(os.environ.get("RESULT_CACHE_DIR_MAX_MB", 1024)),
+)
+
+
+def content_hash(file):
+    """Return (and memorize in the file structure) the SHA-256 of the uploaded file content"""
+
+    if 'hash' not in file:
+        file['hash'] = hashlib.sha256(file['buffer']).hexdigest()
+
+    return file['hash']
+
+
+def model_version(model_path):
+    """Return a version of the model file (its size and modification time) so that a new model invalidates the cache"""
+
+    try:
+        stat = os.stat(model_path)
+        return f"{stat.st_size}-{int(stat.st_mtime)}"
+    except OSError:
+        return "unknown"
+
+
+def cached_run(model_id, version, filtered_files, run):
+    """
+    Return the raw model outputs of the given files, only running the model on the files missing from the cache.
+
+    Parameters
+    ----------
+    model_id : str
+        The id of the model.
+    version : str
+        The version of the model (see `model_version`).
+    filtered_files : list of dict
+        The perenized files.
+    run : callable
+        A function taking a list of files and returning a sequence with one raw output (numpy array) per file.
+
+    Returns
+    -------
+    list
+        The raw output of each file.
+    """
+
+    if not result_cache.is_enabled():
+        return list(run(filtered_files))
+
+    keys = [(content_hash(f), model_id, version) for f in filtered_files]
+    outputs = [result_cache.get(key) for key in keys]
+
+    # -- Run the model once per missing content (the same image may be uploaded several times)
+    missing = OrderedDict()
+    for i, output in enumerate(outputs):
+        if output is None:
+            missing.setdefault(keys[i], []).append(i)
+
+    if len(missing) > 0:
+        missing_outputs = run([filtered_files[indexes[0]] for indexes in missing.values()])
+
+        for (key, indexes), output in zip(missing.items(), missing_outputs):
+            output = np.asarray(output)
+            result_cache.put(key, output)
+            for i in indexes:
+                outputs[i] = output
+
+    return outputs
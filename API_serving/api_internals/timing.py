@@ -0,0 +1,182 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+STAGES = ("decode", "preprocess", "inference", "formatting")
+
+# the timings of the current request (set by `collect_timings`, None outside of a measured request)
+_current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+class RequestTimings:
+    """
+    The time spent in each stage (decode, preprocess, inference, formatting) of a request, per model.
+
+    The stages can be nested (an image is decoded lazily by the preprocessing of the first model using it):
+    the time of a stage excludes the time of the stages nested in it, so that the stages add up.
+
+    The stages run for a single image can also be recorded per image (see the `item` argument of `stage`),
+    the stages nested in them being attributed to the same image.
+    """
+
+    def __init__(self):
+
+        self.stages = {} # (stage, model id) -> {"time": seconds, "count": number of items}
+        self.items = {} # (model id, item) -> {stage: seconds}
+        self.open_stages = [] # [time spent in the nested stages, (model id, item) or None] of each open stage
+        self.duration = None
+        self.lock = threading.Lock()
+
+    def add(self, stage_name, model, duration, count=1, item=None):
+
+        with self.lock:
+            entry = self.stages.setdefault((stage_name, model), {"time": 0.0, "count": 0})
+            entry["time"] += duration
+            entry["count"] += count
+
+            if item is not None:
+                item_entry = self.items.setdefault(item, {})
+                item_entry[stage_name] = item_entry.get(stage_name, 0.0) + duration
+
+    def item_timings(self, model, items):
+        """Return the time spent in each stage for the given items of a model, as a list of {stage: seconds}"""
+
+        with self.lock:
+            return [dict(self.items.get((model, x), {})) for x in items]
+
+    def total(self, stage_name=None, model=None):
+        """Return the time spent in a stage (all the stages if None), for a model (all the models if None)"""
+
+        with self.lock:
+            return sum(
+                x["time"] for (s, m), x in self.stages.items()
+                if (stage_name is None or s == stage_name) and (model is None or m == model)
+            )
+
+    def as_dict(self):
+        """Return the timings as {stage: {model id (or "-"): {"time": seconds, "count": items}}}"""
+
+        with self.lock:
+            timings = {}
+            for (stage_name, model), x in sorted(self.stages.items(), key=lambda x: (x[0][0], x[0][1] or "")):
+                timings.setdefault(stage_name, {})[model or "-"] = dict(x)
+
+        return timings
+
+
+@contextmanager
+def collect_timings():
+    """
+    Measure the stages run in the current context (request thread).
+
+    Yields
+    ------
+    RequestTimings
+        The timings, filled as the stages are run.
+    """
+
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    start_time = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.duration = time.perf_counter() - start_time
+        _current_timings.reset(token)
+
+
+@contextmanager
+def stage(stage_name, model=None, count=1, item=None):
+    """
+    Time a stage of the current request (nothing is recorded outside of `collect_timings`).
+
+    Parameters
+    ----------
+    stage_name : str
+        The stage ("decode", "preprocess", "inference" or "formatting").
+    model : str, optional
+        The model id (the file name of the model), None for the stages shared by the models (decode).
+    count : int
+        The number of images (or frames) processed by the stage.
+    item : str, optional
+        The image processed by the stage (its file name), to record the time of the stage per image.
+        The nested stages are recorded for the same image.
+    """
+
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    if item is not None:
+        item = (model, item)
+    elif timings.open_stages:
+        item = timings.open_stages[-1][1]
+
+    timings.open_stages.append([0.0, item])
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        nested, _ = timings.open_stages.pop()
+        if timings.open_stages:
+            timings.open_stages[-1][0] += duration
+
+        timings.add(stage_name, model, duration - nested, count, item)
+
+
+def timings_breakdown(timings, per_image_model=None, filenames=None):
+    """
+    Return the timings of a request as a JSON-serializable breakdown (the `?timings=1` answer).
+
+    Parameters
+    ----------
+    timings : RequestTimings
+        The timings of the request (see `collect_timings`).
+    per_image_model : str, optional
+        The model whose stages were recorded per image (the binary classifier).
+    filenames : list of str, optional
+        The names of the images given to this model.
+
+    Returns
+    -------
+    dict
+        - "total": the duration of the request (seconds),
+        - "stages": the time spent in each stage, and "other" (the time spent out of the stages),
+        - "models": the time and number of images of each stage of each model ("-" for the decode, shared by the models),
+        - "images": the time spent in each stage for each image of `per_image_model`. Its inference is run by
+          batch: the batch inference time is divided between the images run by the model (the images whose
+          result was cached are flagged as "cached").
+    """
+
+    total = timings.duration
+    stages = {x: timings.total(x) for x in STAGES}
+    stages["other"] = max(0.0, total - sum(stages.values())) if total is not None else None
+
+    breakdown = {
+        "total": total,
+        "stages": stages,
+        "models": {},
+    }
+    for stage_name, models in timings.as_dict().items():
+        for model, x in models.items():
+            breakdown["models"].setdefault(model, {})[stage_name] = x
+
+    if per_image_model is not None and filenames:
+        images = timings.item_timings(per_image_model, filenames)
+        batch_inference = timings.total("inference", per_image_model) - sum(x.get("inference", 0.0) for x in images)
+        num_run = sum(1 for x in images if x)
+
+        for name, x in zip(filenames, images):
+            cached = not x
+            if not cached and batch_inference > 0:
+                x["inference"] = x.get("inference", 0.0) + batch_inference / num_run
+            x["total"] = sum(x.values())
+            x["file"] = name
+            x["cached"] = cached
+
+        breakdown["images"] = images
+
+    return breakdown
@@ -2,19 +2,26 @@
 # coding: utf-8
 
 import io
+import os
 import json
+import time
 import base64
+import threading
+from collections import OrderedDict
 
-from flask import request
+from flask import request, abort
 
 from PIL import Image
 import cv2
 import numpy as np
 
-from api_internals.config_model_MULTILABEL_YOLOv8_Standalone import *
-from api_internals.config_model_MULTILABEL_YOLOv8_SAHI import *
-from api_internals.config_model_MULTILABEL_MobileNet import *
-from api_internals.config_model_laser_MULTICLASS_MobileNet import *
+# the model classes are imported on first use (see api_internals.model_classes)
+from api_internals.model_classes import get_model_class
+from api_internals.ingestion import ingest_file, open_buffer
+from api_internals.batching import stop_batched
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
 
 
 ALLOWED_EXTENSIONS = {
@@ -42,6 +49,21 @@ ALLOWED_EXTENSIONS = {
     # "webm",  # videos
 }
 
+# the laser videos (decoded server side, see api_internals.video)
+ALLOWED_VIDEO_EXTENSIONS = {
+    "asf",
+    "avi",
+    "m4v",
+    "mkv",
+    "mov",
+    "mp4",
+    "mpeg",
+    "mpg",
+    "ts",
+    "wmv",
+    "webm",
+}
+
 # --- DEFINE FUNCTIONS
 
 
@@ -106,37 +128,82 @@ def check_uploaded_files(request: request) -> list:
     # --- CHECK IF THE POST REQUEST HAS THE FILE PART
 
     if "file" not in request.files:
-        print("No file part")
+        logger.warning("no_file_part")
         abort(400, description="The 'file' form-data field is missing in the request.")
 
     # --- CHECK IF THE FILEPART CONTAINS DATA
 
     files = request.files.getlist("file")
     if len(files) == 1 and files[0].filename == "":
-        print("No data into the filepart")
+        logger.warning("no_data_in_file_part")
         abort(400, description="There is no data in the 'file' form-data field.")
     else:
-        print(f"There are {len(files)} files in the filepart")
+        logger.debug("uploaded_files", files=len(files))
 
     # --- CHECK IF THERE IS AT LEAST ONE FILE WITH A COMPATIBLE FORMAT
 
     filtered_files = list(filter(filter_images, files))
     if len(filtered_files) == 0:
-        print("The provided format is not supported")
+        logger.warning("unsupported_file_format", files=len(files))
         abort(400, description="The provided file(s) format is not supported.")
 
     return filtered_files
 
 
+def check_uploaded_video(request: request):
+    """
+    Check if a single video was uploaded properly and if it has a compatible format.
+
+    Parameters
+    ----------
+    request : request
+        The Flask request object containing the video to check.
+
+    Returns
+    -------
+    FileStorage
+        The uploaded video.
+
+    Raises
+    ------
+    BadRequest
+        If the 'file' form-data field is missing, contains no data or more than one file.
+    BadRequest
+        If the uploaded file is not a video of a compatible format.
+    """
+
+    if "file" not in request.files:
+        logger.warning("no_file_part")
+        abort(400, description="The 'file' form-data field is missing in the request.")
+
+    files = request.files.getlist("file")
+    if len(files) == 1 and files[0].filename == "":
+        logger.warning("no_data_in_file_part")
+        abort(400, description="There is no data in the 'file' form-data field.")
+
+    if len(files) > 1:
+        logger.warning("too_many_videos", files=len(files))
+        abort(400, description="Only one video can be uploaded per request.")
+
+    video = files[0]
+    if "." not in video.filename or video.filename.rsplit(".", 1)[1].lower() not in ALLOWED_VIDEO_EXTENSIONS:
+        logger.warning("unsupported_video_format", file=video.filename)
+        abort(400, description=f"The provided video format is not supported ({', '.join(sorted(ALLOWED_VIDEO_EXTENSIONS))}).")
+
+    return video
+
+
 def perenize_buffers(filtered_files):
     """
     Save the uploaded files buffers to a new structure so that we can use them with several models
-    (Otherwise the FileBuffer is consumed/deleted after the first read)
+    (Otherwise the FileBuffer is consumed/deleted after the first read).
+    The buffers are read-only and, when possible, share the memory of the uploaded files (see `ingest_file`).
 
     Parameters
     ----------
     filtered_files : list of str
-        A list of file paths of images to be preprocessed.
+        A list of file paths of images to be preprocessed
+        (the already perenized files are returned as is).
 
     Returns
     -------
@@ -145,7 +212,10 @@ def perenize_buffers(filtered_files):
         - "buffer" the file buffer
         - "filename" the file name
     """
-    return [{'buffer':np.frombuffer(f.read(), np.uint8), 'filename':f.filename} for f in filtered_files]
+    return [
+        f if isinstance(f, dict) else {'buffer':ingest_file(f), 'filename':f.filename}
+        for f in filtered_files
+    ]
 
 
 
@@ -158,7 +228,7 @@ def make_gif(filtered_files):
     # frames = [Image.open(image) for image in glob.glob(f"{frame_folder}/*.JPG")]
     frames = []
     for file in filtered_files:
-        image_bytes = Image.open(io.BytesIO(file['buffer']))
+        image_bytes = Image.open(open_buffer(file['buffer']))
         # nparr = file['buffer'] # np.frombuffer(file.read(), np.uint8)
         # image_bytes = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         frames.append(image_bytes)
@@ -252,21 +322,60 @@ def make_gif(filtered_files):
 # with open("models.json") as json_file:
 #     models = json.load(json_file)
 
+def load_models_json(path="models.json"):
+    """Return the models definitions (model id -> definition) of the models.json file"""
+
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def get_session_config(model_id):
+    """Return the ONNX Runtime session settings of a model (`session` entry of models.json) or None"""
+
+    return load_models_json().get(model_id, {}).get('session')
+
+
 class ModelSelector:
+    """
+    Load and serve the models of a given category as defined in the models.json file.
+
+    The model to use is resolved on each call (`get_model` / `predict`) without mutating any shared state,
+    so that concurrent requests asking for different models can't run on each other's model.
+    The loaded models are kept in a LRU cache bounded by a number of models and/or an estimated memory budget;
+    the pinned models (`"pinned": true` in models.json or `pin(model_id)`) are never evicted.
+
+    Parameters
+    ----------
+    category : str
+        The category of the models to serve ('photo', 'laser').
+    current_model_id : str, optional
+        The default model id (the last model of the category if None).
+    max_models : int, optional
+        The maximum number of models kept in memory (unbounded if None or 0).
+    max_memory_mb : float, optional
+        The maximum estimated memory used by the loaded models (unbounded if None or 0).
+        The memory used by a model is estimated with its `memory_mb` models.json entry or its file size.
+    """
 
-    def __init__(self, category, current_model_id=None):
+    def __init__(self, category, current_model_id=None, max_models=None, max_memory_mb=None):
 
-        self.models= {}
+        self.models = OrderedDict()
+        self.load_times = {}
+        self.memory_mb = {}
+        self.lock = threading.Lock()
+        self.loading_locks = {}
 
-        with open("models.json") as json_file:
-            models_json = json.load(json_file)
-            models_def = {}
+        models_json = load_models_json()
+        models_def = {}
 
-            for m_id in models_json:
-                if models_json[m_id]['category'] == category:
-                    models_def[m_id] = models_json[m_id]
+        for m_id in models_json:
+            if models_json[m_id]['category'] == category:
+                models_def[m_id] = models_json[m_id]
 
         self.models_def = models_def
+        self.max_models = max_models or None
+        self.max_memory_mb = max_memory_mb or None
+        self.pinned = {x for x in models_def if models_def[x].get('pinned', False)}
         self.last_model_id = None
         self.set_current_model_id(current_model_id)
 
@@ -274,6 +383,8 @@ class ModelSelector:
         return {x: self.models_def[x]["label"] for x in self.models_def}
 
     def set_current_model_id(self, model_id):
+        """Set the default model (used when no model id is provided to `get_model` / `predict`)"""
+
         if model_id is None:
             model_id = list(self.models_def.keys())[-1]
 
@@ -282,14 +393,139 @@ class ModelSelector:
     def get_current_model_id(self):
         return self.current_model_id
 
+    def resolve_model_id(self, model_id=None):
+        """Return the given model id (or the default one) after checking that it is available"""
+
+        if not model_id:
+            model_id = self.current_model_id
+
+        if model_id not in self.models_def:
+            raise ValueError(f"The '{model_id}' model is not available")
+
+        return model_id
+
+    def pin(self, model_id):
+        """Prevent a model from being evicted from memory"""
+
+        with self.lock:
+            self.pinned.add(self.resolve_model_id(model_id))
+
+    def unpin(self, model_id):
+        with self.lock:
+            self.pinned.discard(model_id)
+
+    def get_model(self, model_id=None):
+        """
+        Return the requested model (or the default one), loading it if needed.
+
+        Parameters
+        ----------
+        model_id : str, optional
+            The id of the model to return.
+
+        Returns
+        -------
+        object
+            The loaded model instance.
+        """
+
+        model_id = self.resolve_model_id(model_id)
+
+        with self.lock:
+            model = self.models.get(model_id)
+            if model is not None:
+                self.models.move_to_end(model_id)
+                return model
+
+            loading_lock = self.loading_locks.setdefault(model_id, threading.Lock())
+
+        # -- Load outside of the main lock so that the other (already loaded) models remain available
+        with loading_lock:
+            with self.lock:
+                model = self.models.get(model_id)
+            if model is None:
+                start_time = time.time()
+                model = self.load_model(model_id)
+                self.load_times[model_id] = time.time() - start_time
+
+        # (estimated before taking the lock: it may read the model file size)
+        memory_mb = self.estimate_memory_mb(model_id)
+
+        with self.lock:
+            self.models[model_id] = model
+            self.memory_mb[model_id] = memory_mb
+            self.models.move_to_end(model_id)
+            self.evict(keep=model_id)
+
+        return model
+
+    def load_model(self, model_id):
+
+        model_class = get_model_class(self.models_def[model_id]['class'])
+
+        # -- The constructor options and the ONNX Runtime session settings (if any) are handed to the model
+        kwargs = dict(self.models_def[model_id].get('options', {}))
+        if 'session' in self.models_def[model_id]:
+            kwargs['session_config'] = self.models_def[model_id]['session']
+
+        return model_class(f'models/{model_id}', **kwargs)
+
+    def get_input_size(self, model_id=None):
+        """
+        Return the (width, height) the model resizes the images to (None if it uses the full resolution images),
+        without loading the model.
+        """
+
+        model_id = self.resolve_model_id(model_id)
+
+        with self.lock:
+            model = self.models.get(model_id)
+        if model is None:
+            model = get_model_class(self.models_def[model_id]['class'])
+
+        return getattr(model, 'input_size', None)
+
+    def estimate_memory_mb(self, model_id):
+        """Return the estimated memory (in MB) used by a loaded model"""
+
+        if 'memory_mb' in self.models_def[model_id]:
+            return float(self.models_def[model_id]['memory_mb'])
+
+        model_path = os.path.join("models", model_id)
+        if os.path.exists(model_path):
+            return os.path.getsize(model_path) / (1024 * 1024)
+
+        return 0.0
+
+    def evict(self, keep=None):
+        """
+        Evict the least recently used (and not pinned) models until the budgets are satisfied
+        (to call with the lock held, the memory of the models is estimated when they are loaded).
+        """
+
+        def over_budget():
+            if self.max_models is not None and len(self.models) > self.max_models:
+                return True
+            if self.max_memory_mb is not None:
+                return sum(self.memory_mb[x] for x in self.models) > self.max_memory_mb
+            return False
+
+        candidates = [x for x in self.models if x != keep and x not in self.pinned]
+        while over_budget() and len(candidates) > 0:
+            model_id = candidates.pop(0)
+            stop_batched(self.models.pop(model_id))
+            del self.memory_mb[model_id]
+            logger.info("evict_model", model=model_id)
+
     def get_current_model(self):
-        if self.current_model_id not in self.models:
-            self.models[self.current_model_id] = eval(f"{self.models_def[self.current_model_id]['class']}('models/{self.current_model_id}')")
+        return self.get_model(self.current_model_id)
 
-        return self.models[self.current_model_id]
+    def predict(self, model_id, filtered_files, *args, **kwargs):
+        """Run the prediction with the requested model (or the default one if `model_id` is None)"""
 
+        defect_model = self.get_model(model_id)
+        return defect_model.predict(filtered_files, *args, **kwargs)
 
     def predict_current(self, filtered_files, *args, **kwargs):
 
-        defect_model = self.get_current_model()
-        return defect_model.predict(filtered_files, *args, **kwargs)
+        return self.predict(None, filtered_files, *args, **kwargs)
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import cv2
+
+from api_internals.frame_store import LaserFrameStore
+from api_internals.frame_pool import transform_frames
+from api_internals.ingestion import SpoolRegion, UPLOAD_SPOOL_DIR
+from api_internals.LaserProfileTransformation import transform_frame
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- VIDEO DECODING CONFIGURATION
+
+# number of frames per second sampled from the laser videos (the desired fps of LaserProfileTransformation)
+VIDEO_TARGET_FPS = float(os.environ.get("VIDEO_TARGET_FPS", 25))
+
+# maximum number of sampled frames per video (the transformed frames are held in memory, about 90 kB each)
+VIDEO_MAX_FRAMES = int(os.environ.get("VIDEO_MAX_FRAMES", 3000))
+
+
+def sampled_frames(capture, video_fps, target_fps):
+    """
+    Yield the index and the frame of the sampled frames of a video: one frame every `video_fps / target_fps` frames
+    (as the skip loop of LaserProfileTransformation, with a fractional step so that the sampled rate is target_fps).
+    The skipped frames are only grabbed (demuxed and decoded, but not converted to BGR images).
+
+    Parameters
+    ----------
+    capture : VideoCapture
+        The opened video.
+    video_fps : float
+        The frame rate of the video (all the frames are sampled if unknown, i.e. 0).
+    target_fps : float
+        The number of frames per second to sample.
+    """
+
+    step = video_fps / target_fps if video_fps > 0 and target_fps > 0 else 1.0
+    step = max(1.0, step)
+
+    index, next_sample = 0, 0.0
+    while True:
+        if index + 1e-6 >= next_sample:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield index, frame
+            next_sample += step
+        elif not capture.grab():
+            return
+
+        index += 1
+
+
+@contextmanager
+def video_path(video):
+    """
+    Give a path to an uploaded video (OpenCV only decodes files): the upload spool file itself when the video
+    is the only file of the request (see api_internals.ingestion), otherwise a temporary copy of the video.
+
+    Parameters
+    ----------
+    video : FileStorage
+        The uploaded video.
+
+    Yields
+    ------
+    str
+        The path of the video.
+    """
+
+    stream = video.stream
+    if isinstance(stream, SpoolRegion) and stream.offset == 0 and stream.length == stream.spool.size:
+        path = f"/proc/self/fd/{stream.spool.file.fileno()}"
+        if os.path.exists(path):
+            yield path
+            return
+
+    suffix = os.path.splitext(video.filename or "")[1]
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, suffix=suffix) as copy:
+        stream.seek(0)
+        shutil.copyfileobj(stream, copy, 1024 * 1024)
+        copy.flush()
+        yield copy.name
+
+
+class VideoFrameStore(LaserFrameStore):
+    """
+    Store of the sampled frames of a laser video (see `LaserFrameStore`): the frames are decoded server side,
+    converted to grayscale and transformed (`transform_frame`) as they are read, so that neither the decoded
+    video frames nor intermediate images are kept. The files of the store (`files`) are named after the index
+    of the frame in the video (frame_000012) and can be given to the laser pipeline along with the store.
+
+    When the process pool is enabled (LASER_TRANSFORM_WORKERS > 0), the grayscale frames are transformed by
+    chunks in the worker processes.
+
+    Parameters
+    ----------
+    path : str
+        The path of the video.
+    target_fps : float
+        The number of frames per second sampled from the video.
+    max_frames : int
+        The maximum number of sampled frames.
+    chunk_size : int
+        The number of frames transformed at once by the process pool.
+
+    Raises
+    ------
+    ValueError
+        If the video can't be decoded, or if it has more than `max_frames` sampled frames.
+    """
+
+    def __init__(self, path, target_fps=VIDEO_TARGET_FPS, max_frames=VIDEO_MAX_FRAMES, chunk_size=32):
+
+        super().__init__([], chunk_size)
+        self.target_fps = target_fps
+        self.video_fps = None
+        self.video_frames = None
+
+        self.__decode(path, max_frames)
+
+    def info(self):
+        """Return the frame rates and the numbers of frames of the video (added to the answer)"""
+
+        return {
+            "video_fps": self.video_fps,
+            "video_frames": self.video_frames,
+            "target_fps": self.target_fps,
+            "frames_sampled": len(self.files),
+        }
+
+    def __decode(self, path, max_frames):
+
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError("The provided video can't be decoded")
+
+        try:
+            self.video_fps = float(capture.get(cv2.CAP_PROP_FPS) or 0.0)
+            self.video_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0) # (read from the container)
+
+            pending = [] # grayscale frames waiting to be transformed by the process pool
+            for index, frame in sampled_frames(capture, self.video_fps, self.target_fps):
+                if len(self.files) >= max_frames:
+                    raise ValueError(
+                        f"The video has more than {max_frames} frames at {self.target_fps} fps, lower the target_fps"
+                    )
+
+                self.files.append({'buffer': None, 'filename': f"frame_{index:06d}"})
+                gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+                if self.pool is None:
+                    self.transformed[len(self.files) - 1] = transform_frame(gray_frame)
+                else:
+                    pending.append(gray_frame)
+                    if len(pending) >= self.chunk_size * self.pool._max_workers:
+                        self.__transform_pending(pending)
+
+            self.__transform_pending(pending)
+
+        finally:
+            capture.release()
+
+        logger.info(
+            "video_decoded", video_fps=self.video_fps, video_frames=self.video_frames,
+            target_fps=self.target_fps, frames_sampled=len(self.files),
+        )
+
+    def __transform_pending(self, pending):
+
+        if len(pending) == 0:
+            return
+
+        start = len(self.files) - len(pending)
+        transformed = transform_frames(pending, self.pool, decoded=True)
+        self.transformed.update(zip(range(start, start + len(pending)), transformed))
+        pending.clear()
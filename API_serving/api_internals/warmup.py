@@ -0,0 +1,165 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from api_internals.logs import get_logger
+
+logger = get_logger(__name__)
+
+# --- WARM-UP CONFIGURATION
+
+# "default": the default model of each selector and the shared (binary) models, "all": every model,
+# "none": no warm-up, or a comma separated list of model ids
+WARMUP_MODELS = os.environ.get("WARMUP_MODELS", "default")
+
+# number of dummy runs per model (the first one initializes the graph and the memory allocator)
+WARMUP_RUNS = int(os.environ.get("WARMUP_RUNS", 2))
+
+
+def resolve_warmup_models(spec, selectors, registry):
+    """
+    Return the loaders of the models to warm up.
+
+    Parameters
+    ----------
+    spec : str
+        "default", "all", "none" (or empty) or a comma separated list of model ids.
+    selectors : list of ModelSelector
+        The selectors of the selectable models (photo, laser).
+    registry : ModelRegistry
+        The registry of the shared models.
+
+    Returns
+    -------
+    OrderedDict
+        model id -> loader (a callable without argument returning the loaded model, None if the model is unknown).
+    """
+
+    spec = spec.strip()
+
+    def loader(model_id):
+        for selector in selectors:
+            if model_id in selector.models_def:
+                return lambda: selector.get_model(model_id)
+        if model_id in registry.loaders:
+            return lambda: registry.get(model_id)
+        return None
+
+    if spec in ("", "none"):
+        model_ids = []
+    elif spec == "default":
+        model_ids = list(registry.loaders) + [x.get_current_model_id() for x in selectors]
+    elif spec == "all":
+        model_ids = list(registry.loaders) + [x for selector in selectors for x in selector.models_def]
+    else:
+        model_ids = [x.strip() for x in spec.split(",") if x.strip()]
+
+    return OrderedDict((x, loader(x)) for x in model_ids)
+
+
+class ModelWarmup:
+    """
+    Load a list of models and run dummy inputs of their real input shapes through them (`warmup` method of the
+    model classes) in a background thread, so that the first requests don't pay the loading and first-run costs.
+
+    The state of each model ("pending", "loading", "warming", "ready" or "failed") and its timings are reported
+    by `get_status`; the worker is ready once every model is ready.
+
+    Parameters
+    ----------
+    loaders : OrderedDict
+        model id -> loader (see `resolve_warmup_models`).
+    runs : int
+        The number of dummy runs per model.
+    """
+
+    def __init__(self, loaders, runs=WARMUP_RUNS):
+
+        self.loaders = loaders
+        self.runs = runs
+        self.thread = None
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+
+        self.models = OrderedDict(
+            (x, {
+                "state": "pending",
+                "load_time": None,
+                "first_run_time": None,
+                "warm_run_time": None,
+                "error_msg": None,
+            }) for x in loaders
+        )
+
+    def start(self):
+        """Warm the models up in a background thread (the next calls do nothing)"""
+
+        with self.lock:
+            if self.thread is not None:
+                return
+
+            self.started_at = time.time()
+            self.thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self.thread.start()
+
+    def run(self):
+
+        for model_id, loader in self.loaders.items():
+            try:
+                self.__warmup_model(model_id, loader)
+            except Exception as e:
+                logger.error("warmup_failed", model=model_id, error=e)
+                self.__update(model_id, state="failed", error_msg=str(e))
+
+        self.finished_at = time.time()
+        logger.info("warmup_done", ready=self.is_ready(), duration=self.finished_at - self.started_at)
+
+    def __warmup_model(self, model_id, loader):
+
+        if loader is None:
+            raise ValueError(f"The '{model_id}' model is not available")
+
+        # -- Load
+        self.__update(model_id, state="loading")
+        start_time = time.time()
+        model = loader()
+        self.__update(model_id, state="warming", load_time=time.time() - start_time)
+
+        # -- Run the dummy inputs (the models without warm-up method are only loaded)
+        if hasattr(model, "warmup"):
+            for i in range(self.runs):
+                start_time = time.time()
+                model.warmup()
+                duration = time.time() - start_time
+
+                if i == 0:
+                    self.__update(model_id, first_run_time=duration)
+                else:
+                    self.__update(model_id, warm_run_time=duration)
+
+        self.__update(model_id, state="ready")
+        logger.info("warmup_model_ready", model=model_id, **self.models[model_id])
+
+    def __update(self, model_id, **values):
+        with self.lock:
+            self.models[model_id].update(values)
+
+    def is_ready(self):
+        with self.lock:
+            return all(x["state"] == "ready" for x in self.models.values())
+
+    def get_status(self):
+        """Return the readiness of the worker and the state and timings (in seconds) of each model"""
+
+        with self.lock:
+            models = {x: dict(state) for x, state in self.models.items()}
+
+        return {
+            "ready": all(x["state"] == "ready" for x in models.values()),
+            "failed": any(x["state"] == "failed" for x in models.values()),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "models": models,
+        }
@@ -0,0 +1,71 @@
+"""
+Benchmark of the photo binary classifier preprocessing (`transform_image_from_bytes`).
+
+It compares the former PIL preprocessing (the torchvision Resize 580 / ToTensor / Normalize transforms, reproduced
+with PIL and NumPy so that torch isn't needed) with the OpenCV one writing directly into the NCHW batch,
+reports the differences of the model inputs and the per-image timings.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_binary_preprocessing [--images 20] [--fixtures path/to/photos/folder]
+"""
+import io
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from api_internals.config_model_BINARY import transform_image_from_bytes, INPUT_SIZE, MEAN, STD
+from benchmarks.synthetic import make_photo, make_files
+
+
+def transform_image_pil(file):
+    """The former preprocessing (torchvision transforms on a PIL image), used as reference"""
+
+    img = Image.open(io.BytesIO(file['buffer']))
+    img = img.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR) # transforms.Resize (antialiased for PIL images)
+    img = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0 # transforms.ToTensor
+    return (img - MEAN[:, None, None]) / STD[:, None, None] # transforms.Normalize
+
+
+def load_files(fixtures, num_images):
+
+    if fixtures is None:
+        rng = np.random.default_rng(0)
+        return make_files([make_photo(rng) for _ in range(num_images)], ".jpg")
+
+    paths = sorted(x for x in Path(fixtures).iterdir() if x.suffix.lower() in (".png", ".jpg", ".jpeg", ".bmp"))
+    return [{'buffer': np.fromfile(x, np.uint8), 'filename': x.name} for x in paths[:num_images]]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20, help="number of images to preprocess")
+    parser.add_argument("--fixtures", default=None, help="folder of photos (synthetic photos if not provided)")
+    args = parser.parse_args()
+
+    files = load_files(args.fixtures, args.images)
+
+    start_time = time.perf_counter()
+    reference = np.stack([transform_image_pil(x) for x in files])
+    pil_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch = np.empty((len(files), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    for i, file in enumerate(files):
+        transform_image_from_bytes(file, batch[i])
+    cv2_time = time.perf_counter() - start_time
+
+    # -- Differences expressed in 8 bits pixel levels
+    levels = np.abs(batch - reference) * STD[None, :, None, None] * 255.0
+
+    print(f"images             : {len(files)}")
+    print(f"PIL + NumPy        : {pil_time / len(files) * 1000:8.3f} ms/image")
+    print(f"OpenCV (in batch)  : {cv2_time / len(files) * 1000:8.3f} ms/image  (x{pil_time / cv2_time:.1f})")
+    print(f"input differences  : mean {levels.mean():.3f}, p99 {np.percentile(levels, 99):.3f}, max {levels.max():.3f} pixel levels")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Import time budget of the API (worker boot / autoscaling cold start).
+
+The module is imported in fresh interpreters with `python -X importtime`, the total import time is compared
+with the budget and the heaviest packages are listed. The model frameworks (ultralytics/torch, sahi,
+openvino, anomalib...) must not be imported at startup: they are only loaded with the first model of a class
+that needs them (see `api_internals.model_classes`).
+
+The exit code is 1 if the budget is exceeded or a forbidden package is imported, so that it can be used in CI.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_import_time [--module API_client_server] [--budget-ms 1500] [--runs 5]
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+
+FORBIDDEN_PACKAGES = [
+    "torch",
+    "torchvision",
+    "ultralytics",
+    "sahi",
+    "openvino",
+    "anomalib",
+    "albumentations",
+]
+
+# "import time: self [us] | cumulative | imported package" (nested imports are indented by 2 spaces per level)
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_time(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Returns
+    -------
+    tuple of (float, dict, set)
+        The total import time (in milliseconds, including the interpreter startup imports), the import time
+        of each package (own modules only, in milliseconds) and the names of the imported modules.
+    """
+
+    # (the models are only loaded once the worker runs, the warm-up and the preloading are disabled anyway)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, WARMUP_MODELS="none", PRELOAD_MODELS="0"),
+    )
+    if process.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+
+    total, packages, imported = 0.0, defaultdict(float), set()
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+
+        self_time, cumulative, indent, name = match.groups()
+        imported.add(name)
+        packages[name.split(".")[0]] += int(self_time) / 1000
+        if len(indent) == 1: # top level import
+            total += int(cumulative) / 1000
+
+    return total, packages, imported
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="API_client_server", help="module to import")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="maximum (median) import time in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh imports")
+    parser.add_argument("--top", type=int, default=15, help="number of packages listed")
+    parser.add_argument("--allow", nargs="*", default=[], help="forbidden packages allowed anyway")
+    args = parser.parse_args()
+
+    totals, runs_packages = [], defaultdict(list)
+    for _ in range(args.runs):
+        total, packages, imported = import_time(args.module)
+        totals.append(total)
+        for name, duration in packages.items():
+            runs_packages[name].append(duration)
+
+    median_total = float(np.median(totals))
+    heaviest = sorted(((float(np.median(x)), name) for name, x in runs_packages.items()), reverse=True)
+
+    print(f"import {args.module}: median {median_total:.0f} ms (min {min(totals):.0f}, max {max(totals):.0f}) over {args.runs} runs")
+    print(f"\n{'package':30s} {'import (ms)':>12s}")
+    for duration, name in heaviest[:args.top]:
+        print(f"{name:30s} {duration:12.1f}")
+
+    forbidden = sorted(x for x in imported if x.split(".")[0] in FORBIDDEN_PACKAGES and x.split(".")[0] not in args.allow)
+    forbidden_roots = sorted({x.split(".")[0] for x in forbidden})
+
+    failed = False
+    if forbidden_roots:
+        print(f"\nFAIL: model frameworks imported at startup: {', '.join(forbidden_roots)}")
+        failed = True
+    if median_total > args.budget_ms:
+        print(f"\nFAIL: import time {median_total:.0f} ms > budget {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print(f"\nOK: import time within the {args.budget_ms:.0f} ms budget, no model framework imported")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark of the process pool used to decode and transform the laser frames (`transform_frames`).
+
+It transforms a sequence of synthetic laser frames (encoded as PNG, as uploaded to the API) in the request
+process and then with pools of 1 to N worker processes, checks that the outputs are identical
+and reports the scaling.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_laser_pool [--frames 300] [--max-workers N]
+"""
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from api_internals.frame_store import LaserFrameStore
+from api_internals.frame_pool import transform_frames
+from benchmarks.synthetic import make_laser_frames, make_files
+
+
+def same_frames(a, b):
+    return all((x is None and y is None) or (x is not None and y is not None and np.array_equal(x, y)) for x, y in zip(a, b))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300, help="number of frames of the sequence")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count(), help="maximum number of worker processes")
+    args = parser.parse_args()
+
+    files = make_files(make_laser_frames(args.frames))
+    buffers = [x['buffer'] for x in files]
+
+    # -- In-process reference (what the request thread does without the pool)
+    frame_store = LaserFrameStore(files)
+    frame_store.pool = None
+    start_time = time.perf_counter()
+    reference = [frame_store.get(i) for i in range(len(files))]
+    serial_time = time.perf_counter() - start_time
+    print(f"in-process : {serial_time:7.3f}s ({len(files) / serial_time:7.1f} frames/s)")
+
+    num_workers = 1
+    while num_workers <= args.max_workers:
+
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            transform_frames(buffers[:num_workers], executor) # start the workers
+
+            start_time = time.perf_counter()
+            transformed = transform_frames(buffers, executor)
+            pool_time = time.perf_counter() - start_time
+
+        status = "identical" if same_frames(reference, transformed) else "DIFFERENT"
+        print(f"{num_workers:2d} worker(s): {pool_time:7.3f}s ({len(files) / pool_time:7.1f} frames/s, "
+              f"x{serial_time / pool_time:.2f}) - {status}")
+
+        num_workers *= 2
+
+
+if __name__ == "__main__":
+    main()
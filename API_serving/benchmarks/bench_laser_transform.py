@@ -0,0 +1,118 @@
+"""
+Microbenchmark of the laser profile transformation (`transform_frame`).
+
+It compares the per-point Python loops that were used to filter, rotate and draw the profile points
+(`project_profile_loop` below) with the vectorized `project_profile`, checks that both produce identical
+images and reports the per-frame timings.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_laser_transform [--frames 100] [--fixtures path/to/frames/folder]
+"""
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from api_internals.LaserProfileTransformation import (
+    locate_profile,
+    project_profile,
+    is_near_polygon,
+    rotate_point,
+)
+from benchmarks.synthetic import make_laser_frames
+
+
+def project_profile_loop(coords, intersection, lower_left, triangle_vertices, polygon_threshold):
+    """The former (per-point) implementation of `project_profile`, used as reference"""
+
+    coords_filtered = [
+        pt for pt in coords
+        if is_near_polygon(pt, triangle_vertices, polygon_threshold)
+    ]
+
+    transformed_image = np.ones((300, 300), np.uint8) * 255
+
+    xi, yi = intersection
+    llx, lly = lower_left
+    translated_coords = [(x - xi, y - yi) for x, y in coords_filtered]
+    angle_rad = np.arctan2(lly - yi, llx - xi)
+    transformed_coords = [
+        rotate_point(x, y, -angle_rad) for x, y in translated_coords
+    ]
+
+    for x, y in transformed_coords:
+        translated_x, translated_y = x + 50, y + 250
+        if 0 <= translated_x < 300 and 0 <= translated_y < 300:
+            transformed_image[translated_y, translated_x] = 0
+
+    return transformed_image
+
+
+def load_frames(fixtures, num_frames):
+
+    if fixtures is None:
+        return make_laser_frames(num_frames)
+
+    paths = sorted(x for x in Path(fixtures).iterdir() if x.suffix.lower() in (".png", ".jpg", ".jpeg", ".bmp"))
+    return [cv2.imread(str(x), cv2.IMREAD_GRAYSCALE) for x in paths[:num_frames]]
+
+
+def timed(fn, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=100, help="number of frames to transform")
+    parser.add_argument("--fixtures", default=None, help="folder of laser frames (synthetic frames if not provided)")
+    args = parser.parse_args()
+
+    frames = load_frames(args.fixtures, args.frames)
+
+    locate_times, loop_times, vectorized_times = [], [], []
+    num_points = []
+    mismatches = 0
+    for frame in frames:
+
+        profile, locate_time = timed(locate_profile, frame)
+        if profile is None:
+            continue
+
+        reference, loop_time = timed(project_profile_loop, *profile, 5.0)
+        transformed, vectorized_time = timed(project_profile, *profile, 5.0)
+
+        if not np.array_equal(reference, transformed):
+            mismatches += 1
+
+        locate_times.append(locate_time)
+        loop_times.append(loop_time)
+        vectorized_times.append(vectorized_time)
+        num_points.append(len(profile[0]))
+
+    if len(locate_times) == 0:
+        print("No laser profile could be located in the provided frames")
+        return
+
+    locate_ms = np.mean(locate_times) * 1000
+    loop_ms = np.mean(loop_times) * 1000
+    vectorized_ms = np.mean(vectorized_times) * 1000
+
+    print(f"frames transformed : {len(locate_times)} / {len(frames)} (mean {np.mean(num_points):.0f} profile points)")
+    print(f"identical outputs  : {len(locate_times) - mismatches} / {len(locate_times)}")
+    print(f"locate_profile     : {locate_ms:8.3f} ms/frame")
+    print(f"projection (loops) : {loop_ms:8.3f} ms/frame")
+    print(f"projection (numpy) : {vectorized_ms:8.3f} ms/frame  (x{loop_ms / vectorized_ms:.1f})")
+    print(f"transform_frame    : {locate_ms + loop_ms:8.3f} -> {locate_ms + vectorized_ms:.3f} ms/frame "
+          f"(x{(locate_ms + loop_ms) / (locate_ms + vectorized_ms):.1f})")
+
+    if mismatches > 0:
+        raise SystemExit(f"{mismatches} frame(s) differ from the reference implementation")
+
+
+if __name__ == "__main__":
+    main()
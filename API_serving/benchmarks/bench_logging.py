@@ -0,0 +1,198 @@
+"""
+Benchmark of the logging cost of the laser requests: the former synchronous prints (the parameters, the model
+traces, the raw and formatted multiclass results, and the whole answer printed twice plus its JSON serialization)
+against the structured logger (api_internals/logs.py: the records are queued and written by a background thread,
+the debug traces are filtered out and only a sample of the answers is logged, truncated).
+
+The answers are synthetic laser answers (binary results of each frame of each sliding window and multiclass result),
+as built by `predict_defects_laser`. The logs are written to a file, to /dev/null, or to a pipe read by a slow
+consumer (a log collector reading at --pipe-mbps MB/s, as the docker log driver of a busy host), and the added
+latency per request is reported.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_logging [--frames 30,300,1000] [--requests 20] [--target file|devnull|pipe] [--pipe-mbps 20]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+from api_internals.logs import setup_logging, flush_logging, get_logger, log_payload
+
+WINDOW_SIZE = 10
+CLASS_NAMES = ["no_defect", "spatter", "irregular_bead"]
+
+
+def make_laser_answer(num_frames, slide_step, rng):
+    """Return a synthetic laser answer, and the raw and formatted multiclass results (as printed by the model)"""
+
+    binary_results = []
+    for i in range(num_frames):
+        score = float(rng.random())
+        binary_results.append({
+            "file": f"frame_{i:06d}.png",
+            "has_defect": score > 0.5,
+            "score": score,
+            "probability": score if score > 0.5 else 1.0 - score,
+        })
+
+    raw_results, windows = [], []
+    for start in range(0, num_frames - WINDOW_SIZE + 1, slide_step):
+        probabilities = rng.dirichlet(np.ones(len(CLASS_NAMES))).astype(np.float32)
+        raw_results.append(probabilities)
+        windows.append({
+            "indexes": list(range(start, start + WINDOW_SIZE)),
+            "has_defect": True,
+            "type": CLASS_NAMES[int(np.argmax(probabilities))],
+            "probability": float(probabilities.max()),
+            "score": float(probabilities.max()),
+        })
+
+    results = [
+        {"binary_results": binary_results[x["indexes"][0]:x["indexes"][-1] + 1], "multi_results": x}
+        for x in windows
+    ]
+    answer = {
+        "defect_models": ["laser_binary_classifier.onnx", "Laser_Multiclass_MobileNet.onnx"],
+        "inference_time": "12.34s",
+        "mean_inference_time": "0.04s",
+        "results": results,
+    }
+
+    return answer, raw_results, windows
+
+
+def log_with_prints(answer, raw_results, windows, extra_info):
+    """The logging of a laser request before the structured logger"""
+
+    print("params:", extra_info)
+    print("infer_laser_BINARY_CLASSIFIER", 0.5)
+    print("format_results_laser_BINARY_CLASSIFIER", 0.5)
+    print("infer_laser_MOBILENET", 1, 0.5)
+    for _ in windows:
+        print("NUM_DEFECTS_IN_BATCH:", WINDOW_SIZE)
+    print("RESULTS:", raw_results)
+    print("format_results_laser_MOBILENET")
+    print("IMAGES:", windows)
+    print("OUTPUT:\n", answer) # (predict_laser_json)
+    print("OUTPUT:\n", answer) # (route)
+    print(f"<Response {len(json.dumps(answer))} bytes [200 OK]>") # (print(jsonify(json_dict)))
+    sys.stdout.flush()
+
+
+def log_with_logger(logger, answer, raw_results, windows, extra_info):
+    """The logging of a laser request with the structured logger"""
+
+    num_frames = len(answer["results"][-1]["binary_results"]) + answer["results"][-1]["multi_results"]["indexes"][0]
+
+    logger.debug("params", **extra_info)
+    logger.debug("infer_laser_BINARY_CLASSIFIER", frames=num_frames, threshold=0.5)
+    logger.debug("format_results_laser_BINARY_CLASSIFIER", threshold=0.5)
+    logger.debug("infer_laser_MOBILENET", frames=num_frames, defects_threshold=1, threshold=0.5)
+    logger.debug("format_results_laser_MOBILENET", windows=len(windows))
+    logger.info("predict_laser_defects", frames=num_frames, windows=len(windows), models=",".join(answer["defect_models"]), inference_time=12.34)
+    log_payload(logger, "predict_laser_defects_output", answer)
+
+
+class SlowPipe:
+    """A pipe drained by a thread reading at a limited rate (a log collector)"""
+
+    def __init__(self, mbps):
+
+        self.read_fd, write_fd = os.pipe()
+        self.stream = os.fdopen(write_fd, "w", buffering=1)
+        self.bytes_per_sec = mbps * 1024 * 1024
+        self.thread = threading.Thread(target=self.__drain, daemon=True)
+        self.thread.start()
+
+    def __drain(self):
+
+        chunk = 64 * 1024
+        while True:
+            data = os.read(self.read_fd, chunk)
+            if not data:
+                break
+            time.sleep(len(data) / self.bytes_per_sec)
+
+    def close(self):
+
+        self.stream.close()
+        self.thread.join()
+        os.close(self.read_fd)
+
+
+def open_target(target, mbps, folder):
+
+    if target == "pipe":
+        pipe = SlowPipe(mbps)
+        return pipe.stream, pipe.close
+
+    path = os.devnull if target == "devnull" else os.path.join(folder, "bench.log")
+    stream = open(path, "w")
+    return stream, stream.close
+
+
+def measure(run, requests):
+
+    durations = []
+    for _ in range(requests):
+        start_time = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start_time)
+
+    return float(np.median(durations)), float(np.percentile(durations, 95))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", default="30,300,1000", help="comma separated numbers of frames per request")
+    parser.add_argument("--slide-step", type=int, default=1, help="sliding window step (frames)")
+    parser.add_argument("--requests", type=int, default=20, help="number of requests per size")
+    parser.add_argument("--target", choices=["file", "devnull", "pipe"], default="pipe", help="where the logs are written")
+    parser.add_argument("--pipe-mbps", type=float, default=20, help="reading rate of the pipe consumer (MB/s)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    extra_info = {"selected_model": None, "slide_step": None, "min_defects": None, "binary_threshold": None, "multi_threshold": None}
+    logger = get_logger("bench_logging")
+
+    print(f"target: {args.target}" + (f" ({args.pipe_mbps} MB/s)" if args.target == "pipe" else ""))
+    print(f"{'frames':>6s} {'answer':>9s}   {'prints p50':>11s} {'p95':>9s}   {'logger p50':>11s} {'p95':>9s}   {'speedup':>7s}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        for num_frames in [int(x) for x in args.frames.split(",")]:
+            answer, raw_results, windows = make_laser_answer(num_frames, args.slide_step, rng)
+
+            # -- Prints (stdout redirected to the target)
+            stream, close = open_target(args.target, args.pipe_mbps, folder)
+            stdout, sys.stdout = sys.stdout, stream
+            try:
+                prints = measure(lambda: log_with_prints(answer, raw_results, windows, extra_info), args.requests)
+            finally:
+                sys.stdout = stdout
+                close()
+
+            # -- Structured logger (the writer thread writes to the target)
+            stream, close = open_target(args.target, args.pipe_mbps, folder)
+            setup_logging(stream=stream)
+            try:
+                logged = measure(lambda: log_with_logger(logger, answer, raw_results, windows, extra_info), args.requests)
+            finally:
+                flush_logging()
+                close()
+
+            size = len(json.dumps(answer)) / 1024
+            print(
+                f"{num_frames:6d} {size:7.0f}kB   {prints[0] * 1000:9.2f}ms {prints[1] * 1000:7.2f}ms   "
+                f"{logged[0] * 1000:9.3f}ms {logged[1] * 1000:7.3f}ms   x{prints[0] / logged[0]:6.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
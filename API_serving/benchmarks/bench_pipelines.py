@@ -0,0 +1,294 @@
+"""
+End-to-end benchmark of the photo and laser pipelines (`predict_defects_photo`, `predict_defects_laser`)
+with stand-in models (see benchmarks/standins.py), so that it runs without the project weights.
+
+The stand-in models and a models.json listing them are generated in a temporary working folder. Requests of
+synthetic photos (JPEG) and laser frames (PNG) of each size are sent to each model of the pipelines. For each
+request size, the benchmark reports the median latency, the throughput (images per second) and the time spent
+in each stage (decode, preprocess, inference, formatting, see api_internals/timing.py). The stand-in classifiers
+flag every photo and frame as defective, so every request goes through both models.
+
+The results are saved as JSON (with the commit and the configuration) to compare them across commits.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_pipelines [--sizes 1,10,100] [--repeat 3] [--output results.json]
+    python -m benchmarks.bench_pipelines --compare base.json new.json [--tolerance 0.1]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+SERVING_DIR = Path(__file__).resolve().parents[1]
+
+# the configuration recorded with the results
+CONFIG_VARIABLES = [
+    "MICRO_BATCHING", "MICRO_BATCHING_MAX_SIZE", "MICRO_BATCHING_MAX_WAIT_MS", "LASER_TRANSFORM_WORKERS",
+    "LASER_BINARY_INFER_REQUESTS", "JPEG_REDUCED_DECODE", "JPEG_REDUCED_DECODE_MIN_RATIO", "RESULT_CACHE_MAX_ENTRIES",
+]
+
+LASER_MIN_FRAMES = 10
+
+
+def git_commit():
+    """Return the current commit (suffixed with "+dirty" if the tracked files were modified), None outside of git"""
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVING_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=SERVING_DIR, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ("+dirty" if status.strip() else "")
+
+
+def make_requests_data(args):
+    """Encode the distinct synthetic photos and laser frames (repeated to build the requests)"""
+
+    from benchmarks.synthetic import make_photo, make_laser_frames, encode
+
+    rng = np.random.default_rng(0)
+    photos = [encode(make_photo(rng, args.photo_width, args.photo_height), ".jpg").tobytes() for _ in range(args.distinct)]
+    frames = [encode(x, ".png").tobytes() for x in make_laser_frames(args.distinct)]
+
+    return photos, frames
+
+
+def make_request_files(contents, num_files, extension):
+    """Build the uploaded files of a request (as parsed by werkzeug for a small request)"""
+
+    from werkzeug.datastructures import FileStorage
+
+    return [
+        FileStorage(stream=io.BytesIO(contents[i % len(contents)]), filename=f"image_{i:04d}{extension}")
+        for i in range(num_files)
+    ]
+
+
+def run_request(predict, files, extra_info):
+    """Run a request and return its duration and stage timings"""
+
+    from api_internals.timing import collect_timings
+
+    with collect_timings() as timings:
+        start_time = time.perf_counter()
+        predict(files, extra_info)
+        duration = time.perf_counter() - start_time
+
+    return duration, timings
+
+
+def summarize(durations, timings, num_images):
+    """Summarize the runs of a request size (medians)"""
+
+    from api_internals.timing import STAGES
+
+    total = float(np.median(durations))
+
+    stages = {x: float(np.median([t.total(x) for t in timings])) for x in STAGES}
+    stages["other"] = max(0.0, total - sum(stages.values()))
+
+    models = {}
+    for stage_name, model in sorted({k for t in timings for k in t.stages}, key=lambda x: (x[0], x[1] or "")):
+        if model is not None:
+            models.setdefault(model, {})[stage_name] = float(np.median([t.total(stage_name, model) for t in timings]))
+
+    return {
+        "images": num_images,
+        "runs": len(durations),
+        "latency": total,
+        "latency_min": float(np.min(durations)),
+        "images_per_sec": num_images / total,
+        "stages": stages,
+        "models": models,
+    }
+
+
+def bench_pipeline(name, predict, models, contents, extension, extra_info, sizes, repeat):
+    """Run the requests of each size on each model of a pipeline, return the results (and print them)"""
+
+    results = []
+    for model_id in models:
+        info = dict(extra_info, selected_model=model_id)
+
+        # -- Load and warm the models up (not measured)
+        try:
+            predict(make_request_files(contents, max(sizes[0], LASER_MIN_FRAMES if name == "laser" else 1), extension), info)
+        except ImportError as e:
+            print(f"{name:8s} {model_id:40s} skipped: {e}")
+            results.append({"pipeline": name, "model": model_id, "skipped": str(e)})
+            continue
+
+        for num_images in sizes:
+            if name == "laser" and num_images < LASER_MIN_FRAMES:
+                continue
+
+            durations, timings = [], []
+            for _ in range(repeat):
+                duration, request_timings = run_request(predict, make_request_files(contents, num_images, extension), info)
+                durations.append(duration)
+                timings.append(request_timings)
+
+            result = dict(pipeline=name, model=model_id, **summarize(durations, timings, num_images))
+            results.append(result)
+            print_result(result)
+
+    return results
+
+
+def print_header():
+    print(f"\n{'pipeline':8s} {'model':40s} {'images':>6s} {'latency':>10s} {'img/s':>8s}   " + " ".join(f"{x:>10s}" for x in ("decode", "preprocess", "inference", "formatting", "other")))
+
+
+def print_result(result):
+
+    stages = " ".join(f"{result['stages'][x] * 1000:8.1f}ms" for x in ("decode", "preprocess", "inference", "formatting", "other"))
+    print(f"{result['pipeline']:8s} {result['model']:40s} {result['images']:6d} {result['latency'] * 1000:8.1f}ms {result['images_per_sec']:8.1f}   {stages}")
+
+
+def run_benchmark(args):
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+    results = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "photo_size": [args.photo_width, args.photo_height],
+            "environment": {x: os.environ[x] for x in CONFIG_VARIABLES if x in os.environ},
+        },
+        "results": [],
+    }
+
+    photos, frames = make_requests_data(args)
+
+    initial_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+
+        # -- The pipelines load models.json and the models from the working folder (when they are imported)
+        from benchmarks.standins import write_standin_models
+
+        with open(SERVING_DIR / "models.json") as f:
+            standins = write_standin_models(json.load(f), work_dir)
+
+        for model_id, reason in standins.items():
+            if reason is not None:
+                print(f"{model_id}: {reason}")
+
+        os.chdir(work_dir)
+        try:
+            results["results"] = run_pipelines(args, sizes, photos, frames)
+        finally:
+            os.chdir(initial_dir)
+
+    return results
+
+
+def run_pipelines(args, sizes, photos, frames):
+    """Benchmark the pipelines (from the working folder of the stand-in models)"""
+
+    from api_internals.predict_defects_photo import predict_defects_photo, photo_model_selector
+    from api_internals.predict_defects_laser import predict_defects_laser, laser_model_selector
+
+    results = []
+    print_header()
+
+    if "photo" in args.pipelines.split(","):
+        results += bench_pipeline(
+            "photo", predict_defects_photo, list(photo_model_selector.models_def), photos, ".jpg",
+            {'binary_threshold': None, 'multi_threshold': None}, sizes, args.repeat,
+        )
+
+    if "laser" in args.pipelines.split(","):
+        results += bench_pipeline(
+            "laser", predict_defects_laser, list(laser_model_selector.models_def), frames, ".png",
+            {'slide_step': None, 'min_defects': None, 'binary_threshold': None, 'multi_threshold': None}, sizes, args.repeat,
+        )
+
+    return results
+
+
+def compare(base_path, new_path, tolerance):
+    """Print the latency changes between two results files, return the number of regressions (above the tolerance)"""
+
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def by_key(results):
+        return {(x["pipeline"], x["model"], x["images"]): x for x in results["results"] if "skipped" not in x}
+
+    base_results, new_results = by_key(base), by_key(new)
+    print(f"base: {base['commit']} ({base['date']})  new: {new['commit']} ({new['date']})\n")
+    print(f"{'pipeline':8s} {'model':40s} {'images':>6s} {'base':>10s} {'new':>10s} {'change':>8s}   stages (change)")
+
+    regressions = 0
+    for key in sorted(set(base_results) & set(new_results)):
+        a, b = base_results[key], new_results[key]
+        change = b["latency"] / a["latency"] - 1
+
+        stages = "  ".join(
+            f"{x} {b['stages'][x] / a['stages'][x] - 1:+.0%}" for x in a["stages"]
+            if x in b["stages"] and a["stages"][x] > 0.001 * a["latency"]
+        )
+        flag = ""
+        if change > tolerance:
+            regressions += 1
+            flag = "  << regression"
+
+        print(f"{key[0]:8s} {key[1]:40s} {key[2]:6d} {a['latency'] * 1000:8.1f}ms {b['latency'] * 1000:8.1f}ms {change:+8.1%}   {stages}{flag}")
+
+    for key in sorted(set(base_results) ^ set(new_results)):
+        print(f"{key[0]:8s} {key[1]:40s} {key[2]:6d} only in the {'base' if key in base_results else 'new'} results")
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,10,100", help="comma separated numbers of images per request (the laser requests need at least 10 frames)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of requests of each size (the median is reported)")
+    parser.add_argument("--pipelines", default="photo,laser", help="comma separated pipelines to benchmark")
+    parser.add_argument("--distinct", type=int, default=10, help="number of distinct photos and frames (repeated to fill the requests)")
+    parser.add_argument("--photo-width", type=int, default=1920, help="width of the synthetic photos")
+    parser.add_argument("--photo-height", type=int, default=1080, help="height of the synthetic photos")
+    parser.add_argument("--output", default=None, help="results file (benchmarks/results/pipelines_<commit>.json by default)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), default=None, help="compare two results files instead of running the benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="latency increase reported as a regression by --compare")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        regressions = compare(*args.compare, args.tolerance)
+        sys.exit(1 if regressions > 0 else 0)
+
+    # every request must reach the models (the synthetic images are repeated)
+    os.environ.setdefault("RESULT_CACHE_MAX_ENTRIES", "0")
+
+    output = Path(args.output).resolve() if args.output else None
+    results = run_benchmark(args)
+
+    if output is None:
+        output = SERVING_DIR / "benchmarks" / "results" / f"pipelines_{results['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\nresults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
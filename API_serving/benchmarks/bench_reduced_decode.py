@@ -0,0 +1,152 @@
+"""
+Benchmark and accuracy check of the reduced JPEG decoding (`DecodedImage`, JPEG_REDUCED_DECODE).
+
+Each photo goes through the photo pipeline preprocessing (binary classifier input, then the input of a multilabel
+model) with a full decode and with the reduced decode (the smallest libjpeg scale covering both inputs).
+The per-image time and the differences of the model inputs are reported (and the distance of the multilabel inputs
+to an area-averaged downscaling of the full image), and when the ONNX models are given, the agreement of their
+decisions (at the default thresholds) and the differences of the binary scores.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_reduced_decode [--fixtures path/to/photos/folder] [--images 20]
+        [--binary-model models/binary_classifier.onnx] [--multilabel-model models/multilabel_mobilenet.onnx]
+"""
+import os
+import time
+import argparse
+from pathlib import Path
+from collections import Counter
+
+import cv2
+import numpy as np
+
+os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0" # every run must reach the models
+
+from api_internals.decoded_image import DecodedImage
+from api_internals.config_model_BINARY import INPUT_SIZE
+from benchmarks.synthetic import make_photo, make_files
+
+MULTILABEL_INPUT_SIZES = {
+    "mobilenet": (224, 224),
+    "yolov8": (640, 640),
+}
+
+
+def load_files(fixtures, num_images, width, height):
+
+    if fixtures is None:
+        rng = np.random.default_rng(0)
+        return make_files([make_photo(rng, width, height) for _ in range(num_images)], ".jpg")
+
+    paths = sorted(x for x in Path(fixtures).iterdir() if x.suffix.lower() in (".png", ".jpg", ".jpeg", ".bmp"))
+    return [{'buffer': np.fromfile(x, np.uint8), 'filename': x.name} for x in paths[:num_images]]
+
+
+def with_images(files, reduced_decode, multilabel_size):
+    """Return copies of the files with a new DecodedImage (declaring the multilabel input, as the pipeline does)"""
+
+    copies = []
+    for file in files:
+        image = DecodedImage(file['buffer'], file['filename'], reduced_decode=reduced_decode)
+        image.require(multilabel_size)
+        copies.append(dict(file, image=image))
+
+    return copies
+
+
+def preprocess(files, multilabel_size):
+    """Compute the binary classifier and multilabel inputs of the files (as the photo pipeline does)"""
+
+    binary_inputs, multilabel_inputs = [], []
+    for file in files:
+        binary_inputs.append(file['image'].resized((INPUT_SIZE, INPUT_SIZE), antialias=True, oriented=False))
+        multilabel_inputs.append(file['image'].resized(multilabel_size))
+
+    return np.stack(binary_inputs), np.stack(multilabel_inputs)
+
+
+def area_reference(files, multilabel_size):
+    """The multilabel inputs downscaled from the full resolution images by pixel area averaging (no aliasing)"""
+
+    images = [cv2.imdecode(x['buffer'], cv2.IMREAD_COLOR) for x in files]
+    return np.stack([cv2.resize(x, multilabel_size, interpolation=cv2.INTER_AREA) for x in images])
+
+
+def levels(a, b):
+    diff = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    return f"mean {diff.mean():.3f}, p99 {np.percentile(diff, 99):.0f}, max {diff.max()} pixel levels"
+
+
+def compare_model(name, predict, full_files, reduced_files):
+    """Run a model on both decodes, report the agreement of its decisions and return the results"""
+
+    full_decisions, full_scores = predict(full_files)
+    reduced_decisions, reduced_scores = predict(reduced_files)
+
+    agreement = np.mean([a == b for a, b in zip(full_decisions, reduced_decisions)])
+    line = f"{name:28s}: {agreement * 100:.1f}% of the decisions identical"
+    if full_scores is not None:
+        diff = np.abs(np.array(full_scores) - np.array(reduced_scores))
+        line += f", score differences: mean {diff.mean():.4f}, max {diff.max():.4f}"
+    print(line)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=None, help="folder of photos (synthetic JPEG photos if not provided)")
+    parser.add_argument("--images", type=int, default=20, help="number of photos")
+    parser.add_argument("--width", type=int, default=4000, help="width of the synthetic photos")
+    parser.add_argument("--height", type=int, default=3000, help="height of the synthetic photos")
+    parser.add_argument("--multilabel", choices=list(MULTILABEL_INPUT_SIZES), default="mobilenet", help="multilabel model input size")
+    parser.add_argument("--binary-model", default=None, help="path of the binary classifier ONNX model (accuracy check)")
+    parser.add_argument("--multilabel-model", default=None, help="path of the MobileNet multilabel ONNX model (accuracy check)")
+    args = parser.parse_args()
+
+    files = load_files(args.fixtures, args.images, args.width, args.height)
+    multilabel_size = MULTILABEL_INPUT_SIZES[args.multilabel]
+
+    # -- Timings (decode + both model inputs) and inputs differences
+    timings, inputs = {}, {}
+    for reduced in (False, True):
+        start_time = time.perf_counter()
+        decoded_files = with_images(files, reduced, multilabel_size)
+        inputs[reduced] = preprocess(decoded_files, multilabel_size)
+        timings[reduced] = (time.perf_counter() - start_time) / len(files)
+
+    scales = [DecodedImage(x['buffer'], reduced_decode=True).decode_scale({((INPUT_SIZE, INPUT_SIZE), True, False), (multilabel_size, False, True)}) for x in files]
+
+    print(f"images                      : {len(files)} (decode scales: {dict(sorted(Counter(scales).items()))})")
+    print(f"full decode                 : {timings[False] * 1000:8.2f} ms/image")
+    print(f"reduced decode              : {timings[True] * 1000:8.2f} ms/image  (x{timings[False] / timings[True]:.2f})")
+    print(f"binary input differences    : {levels(inputs[False][0], inputs[True][0])}")
+    print(f"multilabel input differences: {levels(inputs[False][1], inputs[True][1])}")
+
+    # (the bilinear downscaling of the full resolution images aliases: the reduced decode is usually closer to the area average)
+    reference = area_reference(files, multilabel_size)
+    print(f"multilabel input vs area avg: full decode {levels(inputs[False][1], reference)}")
+    print(f"                              reduced decode {levels(inputs[True][1], reference)}")
+
+    # -- Accuracy of the models on both decodes (new images for each model: the variants are cached)
+    if args.binary_model is not None:
+        from api_internals.config_model_BINARY import BinaryClassifier
+
+        model = BinaryClassifier(args.binary_model)
+        def predict_binary(decoded_files):
+            images, _ = model.predict(decoded_files)
+            return [x['has_defect'] for x in images], [x['score'] for x in images]
+
+        compare_model("binary classifier", predict_binary, with_images(files, False, multilabel_size), with_images(files, True, multilabel_size))
+
+    if args.multilabel_model is not None:
+        from api_internals.config_model_MULTILABEL_MobileNet import MultiLabel_MobileNet
+
+        model = MultiLabel_MobileNet(args.multilabel_model)
+        def predict_multilabel(decoded_files):
+            images = model.predict(decoded_files)
+            return [sorted(x['type'] for x in detects) for detects in images], None
+
+        compare_model("multilabel classifier", predict_multilabel, with_images(files, False, multilabel_size), with_images(files, True, multilabel_size))
+
+if __name__ == "__main__":
+    main()
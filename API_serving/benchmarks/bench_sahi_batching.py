@@ -0,0 +1,98 @@
+"""
+Comparison of the batched SAHI slicing engine (`MultiLabel_YOLOv8_SAHI`) with the former per-image
+`get_sliced_prediction` calls (slices run one by one).
+
+Both paths run the same YOLOv8 model on the same images; the detections are matched (same class and
+IoU >= --match-iou) and the per-image timings reported.
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_sahi_batching --model models/ReachBotsTP_v1_sahi_yolo_final_wt.pt [--fixtures path/to/photos/folder] [--batch-size 16]
+"""
+import os
+import time
+import argparse
+
+os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0" # every run must reach the model
+
+import cv2
+import numpy as np
+from sahi import AutoDetectionModel
+from sahi.predict import get_sliced_prediction
+
+from api_internals.config_model_MULTILABEL_YOLOv8_SAHI import MultiLabel_YOLOv8_SAHI
+from benchmarks.bench_yolo_onnx import load_files, match_detections
+
+
+def predict_per_image(detection_model, class_names, files):
+    """The former implementation: one `get_sliced_prediction` per image"""
+
+    images = []
+    for file in files:
+        image = cv2.imdecode(file['buffer'], cv2.IMREAD_COLOR)
+        result = get_sliced_prediction(
+            image,
+            detection_model,
+            slice_height=512,
+            slice_width=512,
+            overlap_height_ratio=0.2,
+            overlap_width_ratio=0.2,
+            verbose=0,
+        )
+        images.append([
+            {
+                "coords": list(x.bbox.to_xyxy()),
+                "type": class_names[x.category.id],
+                "probability": float(x.score.value),
+            }
+            for x in result.object_prediction_list
+        ])
+
+    return images
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="path of the YOLOv8 (.pt) model")
+    parser.add_argument("--fixtures", default=None, help="folder of photos (synthetic 1080p photos if not provided)")
+    parser.add_argument("--images", type=int, default=10, help="number of images to predict")
+    parser.add_argument("--batch-size", type=int, default=16, help="number of slices per model call")
+    parser.add_argument("--match-iou", type=float, default=0.9, help="minimum IoU of two matching detections")
+    args = parser.parse_args()
+
+    files = load_files(args.fixtures, args.images)
+
+    batched_model = MultiLabel_YOLOv8_SAHI(args.model, batch_size=args.batch_size)
+    detection_model = AutoDetectionModel.from_pretrained(
+        model_type="yolov8",
+        model_path=args.model,
+        confidence_threshold=0.3,
+        device="cpu",
+    )
+
+    # -- Warm up both paths
+    batched_model.predict(files[:1])
+    predict_per_image(detection_model, batched_model.class_names, files[:1])
+
+    start_time = time.perf_counter()
+    reference = predict_per_image(detection_model, batched_model.class_names, files)
+    per_image_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    detections = batched_model.predict(files)
+    batched_time = time.perf_counter() - start_time
+
+    num_reference = sum(len(x) for x in reference)
+    num_detections = sum(len(x) for x in detections)
+    matched, conf_diffs = match_detections(reference, detections, args.match_iou)
+
+    print(f"images              : {len(files)}")
+    print(f"per-image SAHI      : {per_image_time / len(files) * 1000:8.1f} ms/image ({num_reference} detections)")
+    print(f"batched slices      : {batched_time / len(files) * 1000:8.1f} ms/image ({num_detections} detections, "
+          f"batches of {args.batch_size}, x{per_image_time / batched_time:.2f})")
+    print(f"matched detections  : {matched} / {num_reference}"
+          f" (mean |dconf| {np.mean(conf_diffs) if len(conf_diffs) > 0 else 0.0:.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Peak memory of the ingestion of a large upload (a laser sequence of about 200 MB by default).
+
+The multipart body is written to disk and parsed from there (as if read from the socket), then each uploaded
+frame is decoded once (as the frame store does), in a fresh process for each ingestion:
+- "before": the werkzeug default upload containers and a copy of each file (`np.frombuffer(f.read())`),
+- "after": `IngestionRequest` (uploads spooled to a single file) and `perenize_buffers` (memory-mapped buffers).
+
+The reported memory is the growth during the request of the anonymous memory (heap, not backed by a file,
+that the system can't reclaim) and of the resident memory (including the mapped spool pages, which are page cache).
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_upload_memory [--size-mb 200]
+"""
+import os
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import make_laser_frames
+
+
+def make_noisy_frames(num_frames, seed=0):
+    """Encode laser frames with some sensor noise (so that their PNG size is realistic)"""
+
+    rng = np.random.default_rng(seed)
+    frames = []
+    for frame in make_laser_frames(num_frames, seed):
+        noisy = np.clip(frame.astype(np.int16) + rng.normal(0, 6, frame.shape), 0, 255).astype(np.uint8)
+        frames.append(cv2.imencode(".png", noisy)[1].tobytes())
+
+    return frames
+
+
+def write_multipart_body(path, frames, size_mb):
+    """Write a multipart/form-data body uploading the frames (repeated until `size_mb`), return its content type"""
+
+    boundary = uuid.uuid4().hex
+    written, i = 0, 0
+    with open(path, "wb") as f:
+        while written < size_mb * 1024 * 1024:
+            frame = frames[i % len(frames)]
+            f.write(
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="file"; filename="frame_{i:06d}.png"\r\n'
+                f"Content-Type: image/png\r\n\r\n".encode()
+            )
+            f.write(frame)
+            f.write(b"\r\n")
+            written += len(frame)
+            i += 1
+
+        f.write(f"--{boundary}--\r\n".encode())
+
+    return f"multipart/form-data; boundary={boundary}", i
+
+
+def read_memory_kb():
+    """Return the current anonymous and resident memory of the process (in KB, Linux)"""
+
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "VmRSS:")):
+                key, value = line.split(":")
+                values[key] = int(value.split()[0])
+
+    return values["RssAnon"], values["VmRSS"]
+
+
+class MemorySampler:
+    """Sample the memory of the process in a background thread and keep the peaks"""
+
+    def __init__(self, interval=0.002):
+
+        self.interval = interval
+        self.peak_anon, self.peak_rss = read_memory_kb()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        anon, rss = read_memory_kb()
+        self.peak_anon = max(self.peak_anon, anon)
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.sample()
+
+
+def run_ingestion(mode, body_path, content_type):
+    """Parse the request, ingest the uploaded files and decode each frame (run in a fresh process)"""
+
+    from flask import Request
+    from api_internals.ingestion import IngestionRequest
+    from api_internals.utils import perenize_buffers
+
+    request_class = IngestionRequest if mode == "after" else Request
+
+    base_anon, base_rss = read_memory_kb()
+    start_time = time.perf_counter()
+
+    with open(body_path, "rb") as body, MemorySampler() as sampler:
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "CONTENT_TYPE": content_type,
+            "CONTENT_LENGTH": str(os.path.getsize(body_path)),
+            "wsgi.input": body,
+            "wsgi.url_scheme": "http",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+        }
+        request = request_class(environ)
+        request.max_form_parts = 10 ** 6 # (1000 by default)
+        files = request.files.getlist("file")
+        parse_time = time.perf_counter() - start_time
+
+        if mode == "after":
+            buffers = [x['buffer'] for x in perenize_buffers(files)]
+        else:
+            buffers = [np.frombuffer(f.read(), np.uint8) for f in files]
+
+        for buffer in buffers:
+            cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+
+        sampler.sample()
+        request.close()
+
+    return {
+        "files": len(buffers),
+        "peak_anon_mb": (sampler.peak_anon - base_anon) / 1024,
+        "peak_rss_mb": (sampler.peak_rss - base_rss) / 1024,
+        "parse_time": parse_time,
+        "total_time": time.perf_counter() - start_time,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=200, help="size of the uploaded files")
+    parser.add_argument("--distinct-frames", type=int, default=50, help="number of distinct frames (repeated to reach the size)")
+    args = parser.parse_args()
+
+    frames = make_noisy_frames(args.distinct_frames)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        body_path = os.path.join(tmp_dir, "body.multipart")
+        content_type, num_files = write_multipart_body(body_path, frames, args.size_mb)
+        print(f"request body: {os.path.getsize(body_path) / 2**20:.0f} MB, {num_files} frames of {np.mean([len(x) for x in frames]) / 1024:.0f} KB")
+
+        context = multiprocessing.get_context("spawn")
+        print(f"\n{'ingestion':10s} {'peak anon (MB)':>15s} {'peak RSS (MB)':>14s} {'parse (s)':>10s} {'total (s)':>10s}")
+        for mode in ("before", "after"):
+            with context.Pool(1) as pool:
+                result = pool.apply(run_ingestion, (mode, body_path, content_type))
+
+            print(f"{mode:10s} {result['peak_anon_mb']:15.0f} {result['peak_rss_mb']:14.0f} {result['parse_time']:10.2f} {result['total_time']:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the server-side video ingestion of the laser pipeline (`/predict_laser_video`, api_internals/video.py)
+against the upload of the sampled frames as PNG images (`/predict_laser_defects`).
+
+A synthetic laser sequence recorded at --video-fps is written as an MP4 video (mp4v). The frames sampled at
+--target-fps are encoded as PNG, as a client extracting the frames would upload them. The benchmark reports
+the upload size and the server time to get the transformed frames of both paths: decoding and transforming the
+PNG frames (`LaserFrameStore`), or decoding, sampling and transforming the video (`VideoFrameStore`). It also
+counts the frames whose laser profile is found by both paths (the video frames are lossy).
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_video_ingestion [--frames 1000] [--video-fps 100] [--target-fps 25]
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import cv2
+
+from api_internals.frame_store import LaserFrameStore
+from api_internals.video import VideoFrameStore, sampled_frames
+from benchmarks.synthetic import make_laser_frames, make_files
+
+
+def write_video(frames, path, fps):
+
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame in frames:
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=1000, help="number of frames of the recorded sequence")
+    parser.add_argument("--video-fps", type=float, default=100, help="frame rate of the recorded sequence")
+    parser.add_argument("--target-fps", type=float, default=25, help="frame rate sampled by the pipeline")
+    args = parser.parse_args()
+
+    frames = make_laser_frames(args.frames)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "sequence.mp4")
+        write_video(frames, path, args.video_fps)
+        video_size = os.path.getsize(path)
+
+        # -- The frames sampled by the pipeline, uploaded as PNG images
+        capture = cv2.VideoCapture(path)
+        indexes = [index for index, _ in sampled_frames(capture, args.video_fps, args.target_fps)]
+        capture.release()
+        files = make_files([frames[i] for i in indexes])
+        png_size = sum(len(x['buffer']) for x in files)
+
+        frame_store = LaserFrameStore(files)
+        start_time = time.perf_counter()
+        frame_store.prefetch()
+        png_frames = [frame_store.get(i) for i in range(len(files))]
+        png_time = time.perf_counter() - start_time
+
+        # -- The video, decoded and sampled server side
+        start_time = time.perf_counter()
+        video_store = VideoFrameStore(path, args.target_fps, max_frames=args.frames)
+        video_time = time.perf_counter() - start_time
+        video_frames = [video_store.get(i) for i in range(len(video_store))]
+
+    both_found = sum(x is not None and y is not None for x, y in zip(png_frames, video_frames))
+
+    print(f"sequence: {args.frames} frames at {args.video_fps:g} fps, {len(files)} frames sampled at {args.target_fps:g} fps")
+    print(f"{'':6s} {'upload':>10s} {'server':>9s} {'frames/s':>9s}")
+    print(f"{'png':6s} {png_size / 1024 / 1024:8.2f}MB {png_time:8.3f}s {len(files) / png_time:9.1f}")
+    print(f"{'video':6s} {video_size / 1024 / 1024:8.2f}MB {video_time:8.3f}s {len(video_store) / video_time:9.1f}")
+    print(f"profile found in both: {both_found}/{len(files)} frames")
+
+
+if __name__ == "__main__":
+    main()
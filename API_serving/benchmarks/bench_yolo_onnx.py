@@ -0,0 +1,150 @@
+"""
+Comparison of the YOLOv8 backends: ultralytics (`MultiLabel_YOLOv8_Standalone`, .pt model) and the exported graph
+run with ONNX Runtime or OpenVINO (`MultiLabel_YOLOv8_ONNX`, .onnx model exported from the same weights).
+
+Each backend runs in a fresh process (so that the startup memory includes the imported frameworks) and reports
+its load time, peak memory and per-image latency. The detections of the exported graph are then matched with
+the ultralytics ones (same class and IoU >= --match-iou).
+
+Usage (from the API_serving folder):
+    python -m benchmarks.bench_yolo_onnx --pt models/ReachBotsTP_v1_Full_Size_final_wt.pt \
+        --onnx models/ReachBotsTP_v1_Full_Size_final_wt.onnx [--fixtures path/to/photos/folder] [--openvino]
+"""
+import os
+import time
+import argparse
+import resource
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+
+
+def load_files(fixtures, num_images):
+
+    if fixtures is None:
+        from benchmarks.synthetic import make_photo, make_files
+        rng = np.random.default_rng(0)
+        return make_files([make_photo(rng) for _ in range(num_images)], ".jpg")
+
+    paths = sorted(x for x in Path(fixtures).iterdir() if x.suffix.lower() in (".png", ".jpg", ".jpeg", ".bmp"))
+    return [{'buffer': np.fromfile(x, np.uint8), 'filename': x.name} for x in paths[:num_images]]
+
+
+def current_rss_mb():
+    """Return the current resident memory of the process (Linux), or its peak if unavailable"""
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, model_path, fixtures, num_images, batch_size):
+    """Load a backend and predict the images (run in a fresh process)"""
+
+    os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0" # every run must reach the model
+    files = load_files(fixtures, num_images)
+
+    rss_before = current_rss_mb()
+    start_time = time.perf_counter()
+
+    if backend == "ultralytics":
+        from api_internals.config_model_MULTILABEL_YOLOv8_Standalone import MultiLabel_YOLOv8_Standalone
+        model = MultiLabel_YOLOv8_Standalone(model_path)
+    else:
+        from api_internals.config_model_MULTILABEL_YOLOv8_ONNX import MultiLabel_YOLOv8_ONNX
+        model = MultiLabel_YOLOv8_ONNX(model_path, backend=backend)
+
+    load_time = time.perf_counter() - start_time
+    rss_load = current_rss_mb() - rss_before
+    model.predict(files[:1]) # warm up
+
+    detections, latencies = [], []
+    for i in range(0, len(files), batch_size):
+        start_time = time.perf_counter()
+        detections += model.predict(files[i:i + batch_size])
+        latencies.append((time.perf_counter() - start_time) / len(files[i:i + batch_size]))
+
+    return {
+        "load_time": load_time,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # KB on Linux
+        "rss_load_mb": rss_load, # imported frameworks and loaded model
+        "latency_ms": float(np.median(latencies) * 1000),
+        "detections": detections,
+    }
+
+
+def iou(a, b):
+
+    width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def match_detections(reference, detections, min_iou):
+    """Greedily match the detections of each image with the reference ones (same type, best IoU first)"""
+
+    matched, conf_diffs = 0, []
+    for ref_image, image in zip(reference, detections):
+
+        available = list(range(len(image)))
+        for ref in sorted(ref_image, key=lambda x: -x['probability']):
+            candidates = [(iou(ref['coords'], image[j]['coords']), j) for j in available if image[j]['type'] == ref['type']]
+            if len(candidates) == 0:
+                continue
+
+            best_iou, j = max(candidates)
+            if best_iou >= min_iou:
+                matched += 1
+                conf_diffs.append(abs(ref['probability'] - image[j]['probability']))
+                available.remove(j)
+
+    return matched, conf_diffs
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pt", required=True, help="path of the ultralytics (.pt) model")
+    parser.add_argument("--onnx", required=True, help="path of the exported (.onnx) model")
+    parser.add_argument("--fixtures", default=None, help="folder of photos (synthetic photos if not provided)")
+    parser.add_argument("--images", type=int, default=50, help="number of images to predict")
+    parser.add_argument("--batch-size", type=int, default=1, help="number of images per prediction")
+    parser.add_argument("--match-iou", type=float, default=0.9, help="minimum IoU of two matching detections")
+    parser.add_argument("--openvino", action="store_true", help="also run the exported graph with OpenVINO")
+    args = parser.parse_args()
+
+    backends = [("ultralytics", args.pt), ("onnxruntime", args.onnx)]
+    if args.openvino:
+        backends.append(("openvino", args.onnx))
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for backend, model_path in backends:
+        with context.Pool(1) as pool:
+            results[backend] = pool.apply(run_backend, (backend, model_path, args.fixtures, args.images, args.batch_size))
+
+    reference = results["ultralytics"]["detections"]
+    num_reference = sum(len(x) for x in reference)
+
+    print(f"{'backend':12s} {'load (s)':>9s} {'peak RSS (MB)':>14s} {'load RSS (MB)':>14s} {'ms/image':>9s} {'detections':>11s} {'matched':>8s} {'mean |dconf|':>13s}")
+    for backend, result in results.items():
+
+        num_detections = sum(len(x) for x in result["detections"])
+        matched, conf_diffs = match_detections(reference, result["detections"], args.match_iou)
+        conf_diff = np.mean(conf_diffs) if len(conf_diffs) > 0 else 0.0
+
+        print(f"{backend:12s} {result['load_time']:9.2f} {result['rss_mb']:14.0f} {result['rss_load_mb']:14.0f} "
+              f"{result['latency_ms']:9.1f} {num_detections:11d} {matched:4d}/{num_reference:<4d} {conf_diff:13.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Stand-in models for the benchmarks (so that the pipelines can run without the project weights).
+
+Each stand-in is a small ONNX model with the input and output signature of a models.json entry, built with
+`onnx.helper` and seeded random weights. The classifiers are biased so that every photo and frame is
+classified as defective: every request of the pipelines goes through all the stages (worst case).
+
+- `BinaryClassifier`: float32 [N, 3, 580, 580] -> [N, 1] score (below 0.5, i.e. defect),
+- `MultiLabel_MobileNet`: uint8 [N, 224, 224, 3] -> [N, 5] probabilities,
+- `MultiLabel_YOLOv8_ONNX`: float32 [N, 3, 640, 640] -> [N, 4 + C, 8400] raw YOLOv8 output (and the class names metadata),
+- `Laser_Multiclass_MobileNet`: float64 [N, 10, 224, 224, 3] -> [N, 3] probabilities,
+- the laser binary classifier (anomalib/OpenVINO, not in models.json): float32 [1, 3, 256, 256] -> [1, 1, 256, 256]
+  anomaly map, with its metadata (the albumentations transform is only written if albumentations is installed).
+
+The ultralytics models (.pt) have no stand-in.
+"""
+import json
+from pathlib import Path
+from importlib.util import find_spec
+
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+OPSET = 17
+
+YOLO_CLASS_NAMES = {0: 'spatter', 1: 'irregular_bead', 2: 'slag', 3: 'start_stop_overlap', 4: 'porosity_burn_through'}
+
+
+class GraphBuilder:
+    """Minimal helper chaining ONNX nodes (each node output is named after the node)"""
+
+    def __init__(self, seed):
+
+        self.rng = np.random.default_rng(seed)
+        self.nodes = []
+        self.initializers = []
+        self.channels = {}
+
+    def constant(self, name, value):
+
+        self.initializers.append(numpy_helper.from_array(np.asarray(value), name))
+        return name
+
+    def weights(self, name, shape, scale=0.1):
+        return self.constant(name, (self.rng.standard_normal(shape) * scale).astype(np.float32))
+
+    def node(self, op_type, inputs, name, **attributes):
+
+        self.nodes.append(helper.make_node(op_type, inputs, [name], name=name, **attributes))
+        return name
+
+    def features(self, x, channels, stride):
+        """Strided convolution + ReLU (the backbone of the stand-ins)"""
+
+        w = self.weights(f"{x}_conv_w", (channels, 3, stride, stride))
+        conv = self.node("Conv", [x, w], f"{x}_conv", strides=[stride, stride])
+        relu = self.node("Relu", [conv], f"{x}_relu")
+        self.channels[relu] = channels
+        return relu
+
+    def head(self, x, num_outputs, bias):
+        """Global average pooling + dense layer (biased)"""
+
+        pooled = self.node("GlobalAveragePool", [x], "pooled")
+        flat = self.node("Flatten", [pooled], "flat")
+        w = self.weights("dense_w", (self.channels[x], num_outputs))
+        dense = self.node("MatMul", [flat, w], "dense")
+        return self.node("Add", [dense, self.constant("dense_b", np.full(num_outputs, bias, np.float32))], "logits")
+
+    def save(self, path, inputs, outputs, metadata=None):
+
+        graph = helper.make_graph(self.nodes, Path(path).stem, inputs, outputs, self.initializers)
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", OPSET)], producer_name="benchmarks.standins")
+        model.ir_version = 8 # (readable by the older runtimes)
+        if metadata:
+            helper.set_model_props(model, metadata)
+
+        onnx.checker.check_model(model)
+        onnx.save(model, str(path))
+
+
+def make_binary_classifier(path, seed=0):
+
+    g = GraphBuilder(seed)
+    features = g.features("image", 8, 20) # 580 -> 29
+    score = g.node("Sigmoid", [g.head(features, 1, bias=-4.0)], "score")
+
+    g.save(
+        path,
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["N", 3, 580, 580])],
+        [helper.make_tensor_value_info(score, TensorProto.FLOAT, ["N", 1])],
+    )
+
+
+def make_multilabel_mobilenet(path, num_classes=5, seed=1):
+
+    g = GraphBuilder(seed)
+    image = g.node("Cast", ["image"], "image_float", to=TensorProto.FLOAT)
+    nchw = g.node("Transpose", [image], "nchw", perm=[0, 3, 1, 2])
+    scaled = g.node("Mul", [nchw, g.constant("scale", np.float32(1 / 255))], "scaled")
+    features = g.features(scaled, 16, 16) # 224 -> 14
+    probabilities = g.node("Sigmoid", [g.head(features, num_classes, bias=0.5)], "probabilities")
+
+    g.save(
+        path,
+        [helper.make_tensor_value_info("image", TensorProto.UINT8, ["N", 224, 224, 3])],
+        [helper.make_tensor_value_info(probabilities, TensorProto.FLOAT, ["N", num_classes])],
+    )
+
+
+def make_yolov8(path, input_size=640, class_names=YOLO_CLASS_NAMES, seed=2):
+    """The raw [N, 4 + C, 8400] output of the 3 strides (8, 16, 32): boxes in pixels, then the class scores"""
+
+    num_classes = len(class_names)
+    g = GraphBuilder(seed)
+    levels = []
+    for stride in (8, 16, 32):
+        w = g.weights(f"level{stride}_w", (4 + num_classes, 3, stride, stride), scale=0.05)
+        conv = g.node("Conv", ["images", w], f"level{stride}_conv", strides=[stride, stride])
+        shape = g.constant(f"level{stride}_shape", np.array([0, 4 + num_classes, -1], np.int64))
+        levels.append(g.node("Reshape", [conv, shape], f"level{stride}"))
+
+    raw = g.node("Concat", levels, "raw", axis=2) # (N, 4 + C, 8400)
+
+    # -- boxes: centers spread over the image, sizes up to a quarter of it / scores: few candidates above 0.25
+    boxes = g.node("Slice", [raw, g.constant("boxes_start", np.array([0], np.int64)), g.constant("boxes_end", np.array([4], np.int64)), g.constant("axis", np.array([1], np.int64))], "boxes_raw")
+    boxes = g.node("Sigmoid", [boxes], "boxes_sigmoid")
+    boxes = g.node("Mul", [boxes, g.constant("boxes_scale", np.array([input_size, input_size, input_size / 4, input_size / 4], np.float32).reshape(1, 4, 1))], "boxes")
+
+    scores = g.node("Slice", [raw, g.constant("scores_start", np.array([4], np.int64)), g.constant("scores_end", np.array([4 + num_classes], np.int64)), "axis"], "scores_raw")
+    scores = g.node("Add", [scores, g.constant("scores_bias", np.float32(-2.5))], "scores_biased")
+    scores = g.node("Sigmoid", [scores], "scores")
+
+    output = g.node("Concat", [boxes, scores], "output0", axis=1)
+
+    g.save(
+        path,
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["N", 3, input_size, input_size])],
+        [helper.make_tensor_value_info(output, TensorProto.FLOAT, ["N", 4 + num_classes, 8400])],
+        metadata={"names": repr(class_names), "stride": "32", "task": "detect"},
+    )
+
+
+def make_laser_multiclass_mobilenet(path, num_classes=3, seed=3):
+
+    g = GraphBuilder(seed)
+    frames = g.node("Cast", ["frames"], "frames_float", to=TensorProto.FLOAT)
+    mean_frame = g.node("ReduceMean", [frames], "mean_frame", axes=[1], keepdims=0)
+    nchw = g.node("Transpose", [mean_frame], "nchw", perm=[0, 3, 1, 2])
+    features = g.features(nchw, 16, 16)
+    probabilities = g.node("Softmax", [g.head(features, num_classes, bias=0.0)], "probabilities", axis=1)
+
+    g.save(
+        path,
+        [helper.make_tensor_value_info("frames", TensorProto.DOUBLE, ["N", 10, 224, 224, 3])],
+        [helper.make_tensor_value_info(probabilities, TensorProto.FLOAT, ["N", num_classes])],
+    )
+
+
+def make_laser_binary_classifier(path, metadata_path, input_size=256, seed=4):
+    """Anomaly map model and its anomalib metadata (min-max normalization: every frame is above the threshold)"""
+
+    g = GraphBuilder(seed)
+    w = g.weights("anomaly_w", (1, 3, 3, 3))
+    conv = g.node("Conv", ["input", w], "anomaly_conv", pads=[1, 1, 1, 1])
+    anomaly_map = g.node("Sigmoid", [conv], "anomaly_map")
+
+    g.save(
+        path,
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, input_size, input_size])],
+        [helper.make_tensor_value_info(anomaly_map, TensorProto.FLOAT, [1, 1, input_size, input_size])],
+    )
+
+    metadata = {"image_threshold": 0.0, "pixel_threshold": 0.0, "min": 0.0, "max": 1.0}
+
+    # -- the transform of the (300x300 grayscale) transformed frames
+    if find_spec("albumentations") is not None:
+        import albumentations as A
+        from albumentations.pytorch import ToTensorV2
+
+        transform = A.Compose([A.Resize(input_size, input_size), A.Normalize(mean=(0.5,), std=(0.5,)), ToTensorV2()])
+        metadata["transform"] = A.to_dict(transform)
+
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f)
+
+
+STANDIN_MAKERS = {
+    "BinaryClassifier": make_binary_classifier,
+    "MultiLabel_MobileNet": make_multilabel_mobilenet,
+    "MultiLabel_YOLOv8_ONNX": make_yolov8,
+    "Laser_Multiclass_MobileNet": make_laser_multiclass_mobilenet,
+}
+
+LASER_BINARY_MODEL_ID = "laser_binary_classifier.onnx"
+LASER_BINARY_METADATA = "laser_binary_classifier_metadata.json"
+
+
+def write_standin_models(models_json, folder):
+    """
+    Write the stand-in models of the models.json entries (and of the laser binary classifier) and a models.json
+    listing them.
+
+    Parameters
+    ----------
+    models_json : dict
+        The models definitions (model id -> definition, see `load_models_json`).
+    folder : str or Path
+        The working folder of the benchmark: the models are written to its `models` folder and the
+        models definitions (the entries having a stand-in) to its models.json.
+
+    Returns
+    -------
+    dict
+        model id -> None if the stand-in was written, or the reason why it wasn't.
+    """
+
+    folder = Path(folder)
+    (folder / "models").mkdir(parents=True, exist_ok=True)
+
+    status, models_def = {}, {}
+    for model_id, definition in models_json.items():
+
+        maker = STANDIN_MAKERS.get(definition['class'])
+        if maker is None:
+            status[model_id] = f"no stand-in for the {definition['class']} class"
+            continue
+
+        maker(folder / "models" / model_id)
+        models_def[model_id] = definition
+        status[model_id] = None
+
+    make_laser_binary_classifier(folder / "models" / LASER_BINARY_MODEL_ID, folder / "models" / LASER_BINARY_METADATA)
+    status[LASER_BINARY_MODEL_ID] = None
+
+    with open(folder / "models.json", "w") as f:
+        json.dump(models_def, f, indent=4)
+
+    return status
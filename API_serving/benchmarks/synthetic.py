@@ -0,0 +1,100 @@
+"""
+Synthetic inputs for the benchmarks (so that they can run without the project data).
+
+- `make_laser_frame` draws a laser profile similar to the welding sequences (two plates lines and a bead),
+- `make_photo` draws a textured photo of the given size.
+"""
+import cv2
+import numpy as np
+
+
+def make_laser_frame(rng, height=480, width=640):
+    """
+    Draw a grayscale laser profile frame: two plates lines meeting at a (randomly placed) intersection with a bead.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        The random generator used to vary the profile.
+    height : int
+        The height of the frame.
+    width : int
+        The width of the frame.
+
+    Returns
+    -------
+    ndarray
+        A (height, width) uint8 frame with a black profile on a white background.
+    """
+
+    frame = np.full((height, width), 255, np.uint8)
+
+    xi = int(width / 2 + rng.integers(-30, 30))
+    yi = int(height * 0.7 + rng.integers(-20, 20))
+    left = (int(rng.integers(20, 60)), int(height * 0.2 + rng.integers(-20, 20)))
+    right = (int(width - rng.integers(20, 60)), int(height * 0.2 + rng.integers(-20, 20)))
+
+    cv2.line(frame, left, (xi, yi), 0, 3)
+    cv2.line(frame, (xi, yi), right, 0, 3)
+
+    # -- The weld bead (with a random shape)
+    axes = (int(rng.integers(25, 45)), int(rng.integers(10, 25)))
+    cv2.ellipse(frame, (xi, yi - axes[1] // 2), axes, 0, 180, 360, 0, 3)
+
+    # -- Some speckles
+    speckles = rng.integers(0, [width, height], size=(30, 2))
+    frame[speckles[:, 1], speckles[:, 0]] = 0
+
+    return frame
+
+
+def make_laser_frames(num_frames, seed=0, height=480, width=640):
+    rng = np.random.default_rng(seed)
+    return [make_laser_frame(rng, height, width) for _ in range(num_frames)]
+
+
+def make_photo(rng, width=1920, height=1080):
+    """
+    Draw a BGR photo with some large shapes and some noise (so that it doesn't compress too well).
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        The random generator used to draw the photo.
+    width : int
+        The width of the photo.
+    height : int
+        The height of the photo.
+
+    Returns
+    -------
+    ndarray
+        A (height, width, 3) uint8 BGR image.
+    """
+
+    small = rng.integers(0, 256, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    photo = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    for _ in range(10):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(x) for x in rng.integers(0, 256, size=3))
+        cv2.circle(photo, center, int(rng.integers(20, height // 4)), color, -1)
+
+    noise = rng.integers(-8, 8, size=photo.shape)
+    return np.clip(photo.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def encode(image, extension=".png"):
+    """Encode an image as the server would receive it (a uint8 buffer of the file content)"""
+
+    success, buffer = cv2.imencode(extension, image)
+    if not success:
+        raise ValueError(f"Could not encode the image as {extension}")
+
+    return buffer.reshape(-1)
+
+
+def make_files(images, extension=".png"):
+    """Build the perenized files structure of the given images (see `perenize_buffers`)"""
+
+    return [{'buffer': encode(image, extension), 'filename': f"image_{i:04d}{extension}"} for i, image in enumerate(images)]
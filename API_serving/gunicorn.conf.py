@@ -0,0 +1,9 @@
+# gunicorn settings of the API (read from the working directory by default)
+
+
+def post_worker_init(worker):
+    """Start the warm-up of the models once the worker has loaded the app (not when the module is imported)"""
+
+    import API_client_server
+
+    API_client_server.start_model_warmup()
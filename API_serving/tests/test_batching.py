@@ -0,0 +1,71 @@
+"""
+Tests of the micro-batcher (api_internals/batching.py): the concurrent calls are run together, and the thread
+of the batcher of an evicted model is stopped without failing the requests still holding the model.
+
+Run from the API_serving folder:
+    python -m pytest tests
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api_internals import batching
+from api_internals.batching import MicroBatcher, stop_batched
+
+
+def double(items):
+    return [2 * x for x in items]
+
+
+def test_concurrent_calls_are_batched():
+
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=50)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda x: batcher([x, x + 1]), range(0, 16, 2)))
+    finally:
+        batcher.stop()
+
+    assert results == [[2 * x, 2 * x + 2] for x in range(0, 16, 2)]
+    assert batcher.get_stats()["num_batches"] < 8
+
+
+def test_stop_ends_the_thread():
+
+    batcher = MicroBatcher(double, max_wait_ms=1)
+    assert batcher([1, 2]) == [2, 4]
+
+    batcher.stop()
+    batcher.worker.join(timeout=5)
+
+    assert not batcher.worker.is_alive()
+    assert batcher([3]) == [6] # (run directly once stopped)
+
+
+class BatchedModel:
+
+    def __init__(self):
+        self.run_model = batching.make_batched("model.onnx", double)
+
+
+def test_evicted_models_stop_their_batcher(monkeypatch):
+
+    monkeypatch.setattr(batching, "MICRO_BATCHING", True)
+    monkeypatch.setattr(batching, "batchers", {})
+    threads_before = threading.active_count()
+
+    # -- Load, evict and reload the same model
+    for _ in range(5):
+        model = BatchedModel()
+        assert model.run_model([1]) == [2]
+        stop_batched(model)
+        model.run_model.worker.join(timeout=5)
+
+    assert threading.active_count() == threads_before
+    assert batching.batchers == {}
+
+    # -- A reloaded model replaces (and stops) the batcher of its previous instance
+    first, second = BatchedModel(), BatchedModel()
+    first.run_model.worker.join(timeout=5)
+    assert not first.run_model.worker.is_alive()
+    assert batching.batchers["model.onnx"] is second.run_model
+    stop_batched(second)
@@ -0,0 +1,50 @@
+"""
+Tests of the asynchronous job manager (api_internals/jobs.py): the number of pending jobs is bounded.
+
+Run from the API_serving folder:
+    python -m pytest tests
+"""
+import threading
+
+import pytest
+
+from api_internals.jobs import JobManager, TooManyJobsError
+
+
+def wait_for(job, release):
+    release.wait(timeout=10)
+    return job.job_id
+
+
+def test_submit_beyond_max_pending():
+
+    job_manager = JobManager(max_workers=1, max_pending=2)
+    release = threading.Event()
+
+    try:
+        jobs = [job_manager.submit(wait_for, 1, release) for _ in range(2)]
+        with pytest.raises(TooManyJobsError):
+            job_manager.submit(wait_for, 1, release)
+    finally:
+        release.set()
+        job_manager.executor.shutdown(wait=True)
+
+    assert all(job.status == "done" and job.result == job.job_id for job in jobs)
+
+    # (the finished jobs are not pending anymore)
+    with job_manager.lock:
+        assert job_manager.count_pending() == 0
+
+
+def test_submit_without_max_pending():
+
+    job_manager = JobManager(max_workers=1, max_pending=0)
+    release = threading.Event()
+
+    try:
+        jobs = [job_manager.submit(wait_for, 1, release) for _ in range(32)]
+    finally:
+        release.set()
+        job_manager.executor.shutdown(wait=True)
+
+    assert all(job.status == "done" for job in jobs)
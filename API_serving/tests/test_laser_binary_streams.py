@@ -0,0 +1,47 @@
+"""
+Tests of the laser binary classifier shared by the concurrent streams (`iter_predict`): the compiled model is
+a single registry object, each stream must run its inferences on its own infer request.
+
+The classifier runs on its stand-in model (see benchmarks/standins.py), the test is skipped without OpenVINO,
+anomalib and albumentations.
+
+Run from the API_serving folder:
+    python -m pytest tests
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+@pytest.fixture
+def laser_binary_classifier(tmp_path):
+
+    for module in ("openvino", "anomalib", "albumentations"):
+        pytest.importorskip(module)
+
+    from benchmarks.standins import make_laser_binary_classifier
+    from api_internals.config_model_laser_BINARY import LaserBinaryClassifier
+
+    make_laser_binary_classifier(tmp_path / "laser_binary_classifier.onnx", tmp_path / "metadata.json")
+    return LaserBinaryClassifier(str(tmp_path / "laser_binary_classifier.onnx"), str(tmp_path / "metadata.json"))
+
+
+def test_concurrent_streams_get_their_own_scores(laser_binary_classifier):
+
+    from api_internals.frame_store import LaserFrameStore
+    from benchmarks.synthetic import make_laser_frames, make_files
+
+    sequences = [make_files(make_laser_frames(40, seed=seed)) for seed in (0, 1)]
+
+    def stream_scores(files):
+        frame_store = LaserFrameStore(files)
+        frame_store.pool = None
+        return [x["score"] for x in laser_binary_classifier.iter_predict(files, frame_store=frame_store)]
+
+    expected = [stream_scores(x) for x in sequences]
+    assert expected[0] != expected[1]
+
+    # -- Two streams at once, several times (as two requests of a gunicorn worker with --threads=2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for _ in range(5):
+            assert list(executor.map(stream_scores, sequences)) == expected
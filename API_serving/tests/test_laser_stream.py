@@ -0,0 +1,91 @@
+"""
+Tests of the streamed laser pipeline (`iter_predict_defects_laser`): the transformed frames are forgotten once
+the sliding windows moved past them, so that the memory used by a stream doesn't grow with its length.
+
+The laser binary classifier (OpenVINO) is replaced by a classifier flagging the frames of every other block of
+20 frames as defective, the multiclass model runs on its stand-in model (see benchmarks/standins.py).
+
+Run from the API_serving folder:
+    python -m pytest tests
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+API_SERVING_DIR = Path(__file__).resolve().parents[1]
+MULTICLASS_MODEL_ID = "laser_multiclass_mobilenet.onnx"
+
+
+class BlockBinaryClassifier:
+    """Stand-in of the laser binary classifier: the frames of the even blocks of 20 frames are defective"""
+
+    model_name = "laser_binary_classifier.onnx"
+
+    def iter_predict(self, filtered_files, pred_threshold=0.5, frame_store=None):
+
+        for i, file in enumerate(filtered_files):
+            frame_store.get(i)
+            has_defect = (i // 20) % 2 == 0
+            yield {"file": file['filename'], "has_defect": has_defect, "score": float(has_defect), "probability": 1.0}
+
+
+@pytest.fixture
+def laser_pipeline(tmp_path, monkeypatch):
+
+    pytest.importorskip("onnxruntime")
+    from benchmarks.standins import write_standin_models
+    from api_internals import predict_defects_laser
+    from api_internals.config_model_laser_MULTICLASS_MobileNet import Laser_Multiclass_MobileNet
+
+    with open(API_SERVING_DIR / "models.json") as json_file:
+        write_standin_models({MULTICLASS_MODEL_ID: json.load(json_file)[MULTICLASS_MODEL_ID]}, tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    multi_model = Laser_Multiclass_MobileNet(f"models/{MULTICLASS_MODEL_ID}")
+    monkeypatch.setattr(predict_defects_laser.model_registry, "get", lambda model_id: BlockBinaryClassifier())
+    monkeypatch.setattr(predict_defects_laser.laser_model_selector, "resolve_model_id", lambda model_id: MULTICLASS_MODEL_ID)
+    monkeypatch.setattr(predict_defects_laser.laser_model_selector, "get_model", lambda model_id: multi_model)
+
+    # -- Record the number of transformed frames held by the frame store of the stream
+    stores = []
+
+    class RecordingFrameStore(predict_defects_laser.LaserFrameStore):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = None
+            self.max_held = 0
+            stores.append(self)
+
+        def get(self, index):
+            frame = super().get(index)
+            self.max_held = max(self.max_held, len(self.transformed))
+            return frame
+
+    monkeypatch.setattr(predict_defects_laser, "LaserFrameStore", RecordingFrameStore)
+
+    return predict_defects_laser, stores
+
+
+@pytest.mark.parametrize("slide_step, min_defects", [(1, 1), (3, 1), (10, 5)])
+def test_stream_releases_the_frames_behind_the_windows(laser_pipeline, slide_step, min_defects):
+
+    from benchmarks.synthetic import make_laser_frames, make_files
+
+    predict_defects_laser, stores = laser_pipeline
+    files = make_files(make_laser_frames(200))
+    extra_info = {
+        "selected_model": None,
+        "slide_step": slide_step,
+        "min_defects": min_defects,
+        "binary_threshold": None,
+        "multi_threshold": None,
+    }
+
+    nodes = list(predict_defects_laser.iter_predict_defects_laser(files, extra_info))
+
+    assert nodes[-1]["num_windows"] == len(nodes) - 1 == len(range(0, 200 - 10 + 1, slide_step))
+    # (the frames of the current window, and the next frames used to replace its frames without laser profile)
+    assert stores[0].max_held <= 2 * 10
+    assert len(stores[0].transformed) == 0
@@ -0,0 +1,142 @@
+"""
+Tests of the process-wide model registry (api_internals/model_registry.py): a registered model is loaded once,
+whatever the number of requests and threads asking for it.
+
+Run from the API_serving folder:
+    python -m pytest tests
+"""
+import json
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from api_internals.model_registry import ModelRegistry
+
+API_SERVING_DIR = Path(__file__).resolve().parents[1]
+
+
+class CountingLoader:
+    """A loader returning a new stand-in model at each call (the number of calls is counted)"""
+
+    def __init__(self, load_time=0.0):
+
+        self.load_time = load_time
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.load_time)
+        return object()
+
+
+def test_get_loads_the_model_once():
+
+    registry = ModelRegistry()
+    loader = CountingLoader()
+    registry.register("model.onnx", loader)
+
+    assert not registry.is_loaded("model.onnx")
+    first = registry.get("model.onnx")
+    second = registry.get("model.onnx")
+
+    assert first is second
+    assert loader.calls == 1
+    assert registry.is_loaded("model.onnx")
+
+
+def test_concurrent_gets_load_the_model_once():
+
+    registry = ModelRegistry()
+    loader = CountingLoader(load_time=0.05)
+    registry.register("model.onnx", loader)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        models = list(executor.map(lambda _: registry.get("model.onnx"), range(32)))
+
+    assert loader.calls == 1
+    assert all(x is models[0] for x in models)
+
+
+def test_get_unknown_model():
+
+    with pytest.raises(ValueError):
+        ModelRegistry().get("unknown.onnx")
+
+
+def test_preload():
+
+    registry = ModelRegistry()
+    loaders = {x: CountingLoader() for x in ("a.onnx", "b.onnx", "c.onnx")}
+    for model_id, loader in loaders.items():
+        registry.register(model_id, loader)
+
+    registry.preload(["a.onnx"])
+    assert registry.is_loaded("a.onnx") and not registry.is_loaded("b.onnx")
+
+    registry.preload()
+    assert all(registry.is_loaded(x) for x in loaders)
+
+    preloaded = registry.get("b.onnx")
+    registry.preload()
+    assert registry.get("b.onnx") is preloaded
+    assert all(x.calls == 1 for x in loaders.values())
+
+
+@pytest.fixture
+def photo_pipeline(tmp_path, monkeypatch):
+    """The photo pipeline, run on stand-in models (see benchmarks/standins.py) written to a temporary folder"""
+
+    pytest.importorskip("onnxruntime")
+    from benchmarks.standins import write_standin_models
+
+    with open(API_SERVING_DIR / "models.json") as json_file:
+        write_standin_models(json.load(json_file), tmp_path)
+
+    # (the models are loaded from the working folder)
+    monkeypatch.chdir(tmp_path)
+
+    from api_internals import predict_defects_photo
+    return predict_defects_photo
+
+
+def test_next_requests_do_not_reload_the_binary_classifier(photo_pipeline, monkeypatch):
+
+    from api_internals.model_registry import model_registry
+    from benchmarks.synthetic import make_photo, make_files
+
+    model_id = photo_pipeline.BINARY_MODEL_ID
+    loader = model_registry.loaders[model_id]
+    calls = []
+
+    def counting_loader():
+        calls.append(model_id)
+        return loader()
+
+    monkeypatch.setitem(model_registry.loaders, model_id, counting_loader)
+    monkeypatch.delitem(model_registry.models, model_id, raising=False)
+
+    rng = np.random.default_rng(0)
+    extra_info = {"selected_model": None, "binary_threshold": None, "multi_threshold": None}
+
+    # (different photos at each request, so that the results aren't taken from the result cache)
+    for _ in range(2):
+        files = make_files([make_photo(rng, 640, 480) for _ in range(2)], ".jpg")
+        photo_pipeline.predict_defects_photo(files, extra_info)
+        assert len(calls) == 1
+
+    binary_classifier = model_registry.get(model_id)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(
+            lambda x: photo_pipeline.predict_defects_photo(make_files([x], ".jpg"), extra_info),
+            [make_photo(rng, 640, 480) for _ in range(4)],
+        ))
+
+    assert len(calls) == 1
+    assert model_registry.get(model_id) is binary_classifier
@@ -0,0 +1,78 @@
+"""
+Tests of the on-disk tier of the result cache (api_internals/result_cache.py): its size is bounded and the
+expired files are deleted, even if their key is never looked up again.
+
+Run from the API_serving folder:
+    python -m pytest tests
+"""
+import os
+import time
+
+import numpy as np
+
+from api_internals.result_cache import ResultCache
+
+ENTRY_SIZE = 128 * 1024 + 128 # (a float64 array of 16384 values, plus the .npy header)
+
+
+def entry(i):
+    return np.full(16384, i, dtype=np.float64)
+
+
+def key(i):
+    return (f"{i:064x}", "model.onnx", "1-1")
+
+
+def disk_files(cache_dir):
+    return sorted(x for x in os.listdir(cache_dir) if x.endswith(".npy"))
+
+
+def test_disk_tier_size_is_bounded(tmp_path):
+
+    cache = ResultCache(max_entries=2, ttl=3600, cache_dir=tmp_path, disk_max_mb=1)
+
+    for i in range(20):
+        cache.put(key(i), entry(i))
+
+    assert os.path.getsize(tmp_path / disk_files(tmp_path)[0]) == ENTRY_SIZE
+    assert len(disk_files(tmp_path)) == 1024 * 1024 // ENTRY_SIZE
+    assert sum(os.path.getsize(tmp_path / x) for x in disk_files(tmp_path)) <= 1024 * 1024
+    assert cache.get_stats()["disk_bytes"] <= 1024 * 1024
+
+    # -- The oldest entries are evicted first (the newest ones are still on disk once out of memory)
+    cache.entries.clear()
+    assert cache.get(key(0)) is None
+    assert np.array_equal(cache.get(key(19)), entry(19))
+
+
+def test_expired_files_are_swept(tmp_path):
+
+    cache = ResultCache(max_entries=16, ttl=60, cache_dir=tmp_path, sweep_interval=0)
+
+    for i in range(4):
+        cache.put(key(i), entry(i))
+    assert len(disk_files(tmp_path)) == 4
+
+    # -- Age the files (and a file left by an interrupted write) past the TTL
+    (tmp_path / "interrupted.123.tmp").write_bytes(b"partial")
+    past = time.time() - 120
+    for name in os.listdir(tmp_path):
+        os.utime(tmp_path / name, (past, past))
+
+    cache.put(key(4), entry(4))
+
+    assert os.listdir(tmp_path) == disk_files(tmp_path)
+    assert len(disk_files(tmp_path)) == 1
+    assert np.array_equal(cache.get(key(4)), entry(4))
+
+
+def test_previous_runs_are_swept_at_startup(tmp_path):
+
+    cache = ResultCache(max_entries=16, ttl=3600, cache_dir=tmp_path)
+    for i in range(12):
+        cache.put(key(i), entry(i))
+    assert len(disk_files(tmp_path)) == 12
+
+    ResultCache(max_entries=16, ttl=3600, cache_dir=tmp_path, disk_max_mb=0.5)
+
+    assert len(disk_files(tmp_path)) == 512 * 1024 // ENTRY_SIZE
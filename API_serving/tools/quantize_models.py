@@ -0,0 +1,291 @@
+"""
+Offline tool producing static INT8 versions of the ONNX models (ONNX Runtime QDQ quantization).
+
+The activations ranges are calibrated on the images of a local folder (preprocessed exactly like the server does),
+the quantized model is saved next to the original one (`<name>.int8.onnx`) and the FP32 and INT8 models are then
+compared side by side on an evaluation folder: agreement of the decisions (at the default thresholds),
+output differences and per-image latency.
+
+With `--register`, the quantized model is added to models.json as a separate entry (same class, category
+and session settings), so that it can be selected like the FP32 model (or chosen with BINARY_MODEL_ID
+for the binary classifier).
+
+Usage (from the API_serving folder, with the dependencies of tools/requirements.txt):
+    python -m tools.quantize_models multilabel_mobilenet.onnx --calibration path/to/photos [--evaluation path/to/photos] [--register]
+    python -m tools.quantize_models laser_multiclass_mobilenet.onnx --calibration path/to/laser/sequence --register
+"""
+import re
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from onnxruntime.quantization import (
+    quantize_static,
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from api_internals.config_model_BINARY import BinaryClassifier, transform_image_from_bytes, INPUT_SIZE
+from api_internals.config_model_MULTILABEL_MobileNet import MultiLabel_MobileNet
+from api_internals.config_model_laser_MULTICLASS_MobileNet import Laser_Multiclass_MobileNet, WINDOW_SIZE
+from api_internals.frame_store import LaserFrameStore
+from api_internals.onnx_session import create_session
+from api_internals.utils import load_models_json
+
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+ONNX_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(double)": np.float64,
+    "tensor(float16)": np.float16,
+    "tensor(uint8)": np.uint8,
+}
+
+CALIBRATION_METHODS = {
+    "minmax": CalibrationMethod.MinMax,
+    "entropy": CalibrationMethod.Entropy,
+    "percentile": CalibrationMethod.Percentile,
+}
+
+
+# --- MODEL INPUTS (one batch of size 1 per sample, preprocessed like the server does)
+
+def list_images(folder, limit=None):
+
+    paths = sorted(x for x in Path(folder).iterdir() if x.suffix.lower() in IMAGE_EXTENSIONS)
+    return paths[:limit] if limit else paths
+
+
+def read_file(path):
+    return {'buffer': np.fromfile(path, np.uint8), 'filename': path.name}
+
+
+def binary_inputs(model, paths):
+
+    for path in paths:
+        batch = np.empty((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        transform_image_from_bytes(read_file(path), batch[0])
+        yield path.name, batch
+
+
+def mobilenet_inputs(model, paths):
+
+    for path in paths:
+        yield path.name, np.expand_dims(model.preprocess(read_file(path)), 0)
+
+
+def laser_inputs(model, paths):
+    # the (sorted) frames of the folder are a laser sequence, split into consecutive windows of usable frames
+
+    frame_store = LaserFrameStore([read_file(x) for x in paths])
+    frame_store.prefetch()
+
+    window, names = [], []
+    for i in range(len(frame_store)):
+
+        preprocessed = model.preprocess(frame_store.get(i))
+        frame_store.release(i)
+        if preprocessed is None:
+            continue
+
+        window.append(preprocessed)
+        names.append(frame_store.filename(i))
+        if len(window) == WINDOW_SIZE:
+            yield f"{names[0]}..{names[-1]}", np.expand_dims(np.stack(window), 0)
+            window, names = [], []
+
+
+# -- The decisions made by the server on the raw outputs (with the default thresholds)
+MODEL_KINDS = {
+    "BinaryClassifier": (BinaryClassifier, binary_inputs, lambda out: out[..., 0] > 0.5),
+    "MultiLabel_MobileNet": (MultiLabel_MobileNet, mobilenet_inputs, lambda out: out > 0.3),
+    "Laser_Multiclass_MobileNet": (Laser_Multiclass_MobileNet, laser_inputs, lambda out: np.argmax(out, axis=-1)),
+}
+
+
+class ModelInputsReader(CalibrationDataReader):
+    """Hand the calibration inputs to the ONNX Runtime calibrator (cast to the model input type)"""
+
+    def __init__(self, inputs, input_name, input_type):
+
+        self.inputs = inputs
+        self.input_name = input_name
+        self.input_type = input_type
+
+    def get_next(self):
+
+        item = next(self.inputs, None)
+        if item is None:
+            return None
+
+        return {self.input_name: item[1].astype(self.input_type)}
+
+
+# --- COMPARISON
+
+def run_model(session, inputs):
+    """Run the model on each sample and return the raw outputs and the latencies (in milliseconds)"""
+
+    input_meta = session.get_inputs()[0]
+    input_type = ONNX_TYPES.get(input_meta.type, np.float32)
+
+    outputs, latencies = [], []
+    for i, (name, batch) in enumerate(inputs):
+
+        batch = batch.astype(input_type)
+        if i == 0:
+            session.run(None, {input_meta.name: batch}) # warm up
+
+        start_time = time.perf_counter()
+        output = session.run(None, {input_meta.name: batch})[0]
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        outputs.append(output[0])
+
+    return np.array(outputs), np.array(latencies)
+
+
+def compare(fp32_outputs, int8_outputs, fp32_latencies, int8_latencies, decide):
+
+    differences = np.abs(fp32_outputs.astype(np.float64) - int8_outputs.astype(np.float64))
+    fp32_decisions = decide(fp32_outputs)
+    int8_decisions = decide(int8_outputs)
+    agreement = (fp32_decisions == int8_decisions).reshape(len(fp32_outputs), -1).all(axis=1)
+
+    return {
+        "samples": len(fp32_outputs),
+        "decision_agreement": float(agreement.mean()),
+        "output_mean_abs_diff": float(differences.mean()),
+        "output_max_abs_diff": float(differences.max()),
+        "fp32_latency_ms": float(np.median(fp32_latencies)),
+        "int8_latency_ms": float(np.median(int8_latencies)),
+        "speedup": float(np.median(fp32_latencies) / np.median(int8_latencies)),
+    }
+
+
+# --- MAIN
+
+def register(model_id, quantized_id, models_json_path="models.json"):
+    """
+    Add the quantized model to models.json (copying the definition of the FP32 model).
+
+    The new entry is appended to the file with the indentation of the file, the other entries are left untouched
+    (the file is only rewritten when the quantized model was already registered).
+    """
+
+    models_json = load_models_json(models_json_path)
+
+    definition = dict(models_json[model_id])
+    definition['label'] = f"{definition['label']} (INT8)"
+    definition['quantized_from'] = model_id
+    definition.pop('pinned', None)
+    definition.pop('memory_mb', None)
+
+    with open(models_json_path) as json_file:
+        text = json_file.read()
+
+    # (the indentation of the first indented line, a tab if none)
+    match = re.search(r"^([ \t]+)\S", text, re.MULTILINE)
+    indent = match.group(1) if match else "\t"
+
+    if quantized_id in models_json or len(models_json) == 0:
+        models_json[quantized_id] = definition
+        text = json.dumps(models_json, indent=indent) + "\n"
+    else:
+        entry = json.dumps({quantized_id: definition}, indent=indent)[1:-1].strip("\n")
+        text = text.rstrip()[:-1].rstrip() + ",\n" + entry + "\n}\n"
+
+    with open(models_json_path, "w") as json_file:
+        json_file.write(text)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_id", help="id of the FP32 model in models.json (e.g. multilabel_mobilenet.onnx)")
+    parser.add_argument("--calibration", required=True, help="folder of the calibration images (or laser frames)")
+    parser.add_argument("--evaluation", default=None, help="folder of the evaluation images (the calibration folder if not provided)")
+    parser.add_argument("--num-calibration", type=int, default=200, help="maximum number of calibration images")
+    parser.add_argument("--num-evaluation", type=int, default=200, help="maximum number of evaluation images")
+    parser.add_argument("--method", choices=list(CALIBRATION_METHODS), default="minmax", help="calibration method")
+    parser.add_argument("--per-channel", action="store_true", help="quantize the weights per channel")
+    parser.add_argument("--register", action="store_true", help="add the quantized model to models.json")
+    parser.add_argument("--report", default=None, help="path of a JSON file where the comparison is saved")
+    args = parser.parse_args()
+
+    models_json = load_models_json()
+    if args.model_id not in models_json:
+        raise SystemExit(f"The '{args.model_id}' model is not defined in models.json")
+
+    definition = models_json[args.model_id]
+    if definition['class'] not in MODEL_KINDS:
+        raise SystemExit(f"The {definition['class']} models can't be quantized (expected one of {list(MODEL_KINDS)})")
+
+    model_class, make_inputs, decide = MODEL_KINDS[definition['class']]
+    session_config = definition.get('session')
+
+    model_path = Path("models", args.model_id)
+    quantized_id = f"{model_path.stem}.int8.onnx"
+    quantized_path = model_path.with_name(quantized_id)
+
+    model = model_class(str(model_path))
+    input_meta = model.model.get_inputs()[0]
+    input_type = ONNX_TYPES.get(input_meta.type, np.float32)
+
+    # -- Quantize (after the shape inference and graph optimizations recommended by ONNX Runtime)
+    calibration_paths = list_images(args.calibration, args.num_calibration)
+    print(f"calibrating {args.model_id} on {len(calibration_paths)} images ({args.method})")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        preprocessed_path = Path(tmp_dir, "preprocessed.onnx")
+        quant_pre_process(str(model_path), str(preprocessed_path))
+
+        quantize_static(
+            str(preprocessed_path),
+            str(quantized_path),
+            ModelInputsReader(make_inputs(model, calibration_paths), input_meta.name, input_type),
+            quant_format=QuantFormat.QDQ,
+            per_channel=args.per_channel,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CALIBRATION_METHODS[args.method],
+        )
+
+    print(f"saved {quantized_path}")
+
+    # -- Compare the FP32 and INT8 models (same session settings, no optimized graph cache)
+    evaluation_paths = list_images(args.evaluation or args.calibration, args.num_evaluation)
+    inputs = list(make_inputs(model, evaluation_paths))
+    if len(inputs) == 0:
+        raise SystemExit("No evaluation sample could be built from the evaluation folder")
+
+    fp32_outputs, fp32_latencies = run_model(create_session(model_path, session_config, cache_dir=""), inputs)
+    int8_outputs, int8_latencies = run_model(create_session(quantized_path, session_config, cache_dir=""), inputs)
+    report = compare(fp32_outputs, int8_outputs, fp32_latencies, int8_latencies, decide)
+    report.update({"model_id": args.model_id, "quantized_id": quantized_id})
+
+    print(f"{'':22s} {'FP32':>10s} {'INT8':>10s}")
+    print(f"{'latency (ms/sample)':22s} {report['fp32_latency_ms']:10.2f} {report['int8_latency_ms']:10.2f}  (x{report['speedup']:.2f})")
+    print(f"{'model size (MB)':22s} {model_path.stat().st_size / 2**20:10.1f} {quantized_path.stat().st_size / 2**20:10.1f}")
+    print(f"decision agreement     : {report['decision_agreement'] * 100:.1f}% of {report['samples']} samples")
+    print(f"output differences     : mean {report['output_mean_abs_diff']:.4f}, max {report['output_max_abs_diff']:.4f}")
+
+    if args.evaluation is None:
+        print("(evaluated on the calibration images, use --evaluation for an unbiased comparison)")
+
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.register:
+        register(args.model_id, quantized_id)
+        print(f"registered {quantized_id} in models.json")
+
+
+if __name__ == "__main__":
+    main()